@@ -1,28 +1,223 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
 import os
+import logging
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import io
 import re
+import sys
+import json
+import base64
+import asyncio
+import contextlib
+import collections
+import functools
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared bridge modules (jobindex, ...) live one level up: /app in the container
+_BRIDGE_DIR = str(Path(__file__).resolve().parent.parent)
+if _BRIDGE_DIR not in sys.path:
+    sys.path.insert(0, _BRIDGE_DIR)
+import jobindex
+import joblayout
+import jobsearch
+import spool_archive
+import events
+import metrics
+import submit
+import jobstate
+import fscache
 
 # Configurable directories (match bridge defaults)
 OUTDIR = Path(os.getenv("BRIDGE_OUTDIR", "/app/spool"))
 LOGDIR = Path(os.getenv("BRIDGE_LOGDIR", "/app/logs"))
 PIDDIR = Path(os.getenv("BRIDGE_PIDDIR", "/app/pids"))
 READY_FILE = Path(os.getenv("BRIDGE_READYFILE", str(PIDDIR / "console_bridge.ready")))
+INDEX_PATH = os.getenv("BRIDGE_INDEX", str(OUTDIR / "jobindex.db"))
+# Seconds between SSE keepalive comments on idle event streams
+EVENTS_KEEPALIVE = 15
+# Threads for blocking disk and index work; the event loop itself never touches the disk.
+# Listings are mostly CPU under the GIL, so more threads than cores only slow the loop down
+FS_THREADS = int(os.getenv("BRIDGE_API_FS_THREADS", str(min(4, os.cpu_count() or 1))))
+FS_EXECUTOR = ThreadPoolExecutor(max_workers=FS_THREADS, thread_name_prefix="api-fs")
+# Seconds between refreshes of the path checks /health and /ready report
+HEALTH_REFRESH = 1.0
+# Directory caches kept (one inotify watch each); the least recently used is closed beyond this.
+# Above the number of JOBID directories, so a full listing does not evict its own caches
+DIR_CACHES = int(os.getenv("BRIDGE_API_DIR_CACHES", "2048"))
+
+# Job events pushed by console_bridge/console_watch (see events.py)
+EVENT_BUS = events.EventBus()
+# Last metrics snapshot of each bridge process (see metrics.py)
+METRICS = metrics.Store()
+M_REQUEST = metrics.histogram("bridge_api_request_seconds", "API time to the response headers, per route",
+                              ("method", "route", "status"))
+# Job submission to the 3505 reader (see submit.py); None with BRIDGE_SUBMIT_DB=off
+SUBMITTER: Optional["submit.Submitter"] = None
+# Lifecycle of every job seen on the console or the printer (see jobstate.py)
+JOB_TRACKER: Optional["jobstate.JobTracker"] = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    listeners = []
+    if events.enabled():
+        ensure_dir(Path(events.EVENTS_SOCKET).parent)
+        listeners.append(asyncio.create_task(events.listen(EVENT_BUS)))
+    if metrics.enabled():
+        ensure_dir(Path(metrics.METRICS_SOCKET).parent)
+        listeners.append(asyncio.create_task(metrics.listen(METRICS)))
+    listeners.append(asyncio.create_task(refresh_path_status()))
+    global SUBMITTER, JOB_TRACKER
+    try:
+        JOB_TRACKER = jobstate.JobTracker()
+        EVENT_BUS.handlers.append(JOB_TRACKER.on_event)
+        listeners.append(asyncio.create_task(flush_job_tracker(JOB_TRACKER)))
+    except Exception:
+        logging.getLogger("uvicorn.error").exception("job lifecycle tracking disabled")
+    if submit.SUBMIT_DB.lower() != "off":
+        try:
+            ensure_dir(Path(submit.SUBMIT_DB).parent)
+            SUBMITTER = submit.Submitter(submit.SubmitQueue(submit.SUBMIT_DB))
+            EVENT_BUS.handlers.append(SUBMITTER.on_event)
+            listeners.append(asyncio.create_task(SUBMITTER.run()))
+        except Exception:
+            logging.getLogger("uvicorn.error").exception("job submission disabled")
+    try:
+        yield
+    finally:
+        for listener in listeners:
+            listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await listener
+        if SUBMITTER is not None:
+            EVENT_BUS.handlers.remove(SUBMITTER.on_event)
+            await run_fs(SUBMITTER.queue.close)
+            SUBMITTER = None
+        if JOB_TRACKER is not None:
+            EVENT_BUS.handlers.remove(JOB_TRACKER.on_event)
+            await run_fs(JOB_TRACKER.flush)
+            JOB_TRACKER = None
+        with _dir_caches_lock:
+            caches = list(_dir_caches.values())
+            _dir_caches.clear()
+        for cache in caches:
+            cache.close()
+
+
+async def run_fs(fn, *args, **kwargs):
+    """Run blocking filesystem (or job index) work on FS_EXECUTOR."""
+    return await asyncio.get_running_loop().run_in_executor(FS_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+_dir_caches: "collections.OrderedDict[str, fscache.DirCache]" = collections.OrderedDict()
+_dir_caches_lock = threading.Lock()
+
+
+def dir_cache(d: Path) -> "fscache.DirCache":
+    """Shared ``fscache.DirCache`` of directory ``d`` (LRU of ``DIR_CACHES``)."""
+    evicted = None
+    with _dir_caches_lock:
+        cache = _dir_caches.get(str(d))
+        if cache is not None:
+            _dir_caches.move_to_end(str(d))
+            return cache
+        cache = _dir_caches[str(d)] = fscache.DirCache(d)
+        if len(_dir_caches) > DIR_CACHES:
+            _, evicted = _dir_caches.popitem(last=False)
+    if evicted is not None:
+        # a thread still using it falls back to mtime checks (no watch is re-added)
+        evicted.close()
+    return cache
+
+
+# Last path checks for /health and /ready, refreshed off the loop every HEALTH_REFRESH
+PATH_STATUS: Dict[str, bool] = {}
+
+
+def path_status() -> Dict[str, bool]:
+    return {
+        "bridge_ready": READY_FILE.exists(),
+        "spool_dir_exists": OUTDIR.exists(),
+        "log_dir_exists": LOGDIR.exists(),
+        "pid_dir_exists": PIDDIR.exists(),
+    }
+
+
+async def refresh_path_status():
+    while True:
+        try:
+            PATH_STATUS.update(await run_fs(path_status))
+        except Exception:
+            logging.getLogger("uvicorn.error").exception("path checks failed")
+        await asyncio.sleep(HEALTH_REFRESH)
+
+
+async def current_path_status() -> Dict[str, bool]:
+    # sin lifespan (p.ej. un TestClient sin with) no hay tarea de refresco
+    return PATH_STATUS or await run_fs(path_status)
+
+
+async def flush_job_tracker(tracker: "jobstate.JobTracker"):
+    while True:
+        await asyncio.sleep(jobstate.FLUSH_SECONDS)
+        try:
+            # the changed rows are taken on the loop, written on FS_EXECUTOR
+            if (data := tracker.pending()) is not None:
+                await run_fs(tracker.save, *data)
+        except Exception:
+            logging.getLogger("uvicorn.error").exception("cannot save job lifecycle to %s", tracker.path)
+
+
+class RequestMetrics:
+    """ASGI middleware timing each request up to its response headers (streams are not timed to the end)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        done = False
+
+        def observe(status):
+            nonlocal done
+            done = True
+            # plantilla de la ruta, no la URL, para no crear una serie por fichero
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            M_REQUEST.labels(scope["method"], route, status).observe(time.perf_counter() - t0)
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start" and not done:
+                observe(message["status"])
+            await send(message)
 
-app = FastAPI(title="OpenMVS Bridge API", version="0.1")
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not done:
+                observe(500)
+
+
+app = FastAPI(title="OpenMVS Bridge API", version="0.1", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # cross-origin clients only see these if listed (conditional GETs, paging, line windows, ranges)
+    expose_headers=["ETag", "X-Total-Lines", "X-Line-Start", "X-Next-Cursor", "Link", "Content-Range"],
 )
+app.add_middleware(RequestMetrics)
 
 # Serve the web UI (if present) under /ui
 # Robustly discover the repo-level `web/` folder by walking up ancestors
@@ -37,7 +232,6 @@ for ancestor in [ _start ] + list(_start.parents):
 if WEB_DIR:
     app.mount("/ui", StaticFiles(directory=str(WEB_DIR), html=True), name="ui")
 else:
-    import logging
     logging.getLogger("uvicorn.error").warning("Web UI directory not found in any ancestor; /ui will return 404")
 
 
@@ -56,49 +250,207 @@ def ensure_dir(d: Path):
         pass
 
 
+_job_index = None
+
+
+def get_job_index() -> Optional["jobindex.JobIndex"]:
+    """Read-only handle on the bridge job index, None until the bridge has created it."""
+    global _job_index
+    if _job_index is None and INDEX_PATH.lower() != "off" and Path(INDEX_PATH).exists():
+        try:
+            _job_index = jobindex.open_index(INDEX_PATH, readonly=True)
+        except Exception:
+            logging.getLogger("uvicorn.error").exception("cannot open job index %s", INDEX_PATH)
+    return _job_index
+
+
+# Page size bounds for /spools and /joblogs
+DEFAULT_PAGE = 200
+MAX_PAGE = 1000
+
+
+class ListParams:
+    """Query parameters shared by /spools and /joblogs.
+
+    - job_name / job_id: exact match (case-insensitive)
+    - job_name_prefix: jobname starts with (case-insensitive)
+    - rc_min / rc_max: RC range, compared as 4-character codes ("0000".."9999")
+    - since_mtime (exclusive) / until_mtime: time window on the job's last update
+    - sort (mtime, size, jobid, jobname, rc, name) and order (asc, desc); ties are broken by
+      a stable id so pages never overlap
+    - limit: page size; the next page's cursor comes back in the X-Next-Cursor header
+    """
+
+    def __init__(self,
+                 job_name: Optional[str] = None,
+                 job_id: Optional[str] = None,
+                 job_name_prefix: Optional[str] = None,
+                 rc_min: Optional[str] = None,
+                 rc_max: Optional[str] = None,
+                 since_mtime: Optional[float] = None,
+                 until_mtime: Optional[float] = None,
+                 sort: str = Query("mtime", pattern="^(" + "|".join(jobindex.SORT_KEYS) + ")$"),
+                 order: str = Query("desc", pattern="^(asc|desc)$"),
+                 limit: int = Query(DEFAULT_PAGE, ge=1, le=MAX_PAGE),
+                 cursor: Optional[str] = None):
+        self.job_name = job_name
+        self.job_id = job_id
+        self.job_name_prefix = job_name_prefix
+        self.rc_min = rc_min
+        self.rc_max = rc_max
+        self.since_mtime = since_mtime
+        self.until_mtime = until_mtime
+        self.sort = sort
+        self.order = order
+        self.limit = limit
+        self.after = decode_cursor(cursor, sort, order) if cursor else None
+
+
+def encode_cursor(sort: str, order: str, after) -> str:
+    raw = json.dumps([sort, order, after[0], after[1]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    try:
+        c_sort, c_order, value, key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if (c_sort, c_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="cursor was issued for a different sort/order")
+    return (value, key)
+
+
+def job_item(name: str, job_id, job_name, job_rc, size, mtime, path=None) -> Dict[str, Any]:
+    return {
+        "file-name": name,
+        "job-name": job_name,
+        "job-rc": job_rc,
+        "job-id": job_id,
+        # sin path: el directorio que le toca según joblayout
+        "path": path or os.path.join(joblayout.job_dir(str(OUTDIR), name), name),
+        "size": size,
+        "mtime": mtime,
+    }
+
+
+def list_indexed_jobs(prefix: str, q: ListParams):
+    """One page of jobs from the index as ``(items, next_after)``; None if no index is available."""
+    index = get_job_index()
+    if index is None:
+        return None
+    rows = index.list_jobs(prefix, job_name=q.job_name, job_id=q.job_id, job_name_prefix=q.job_name_prefix,
+                           rc_min=q.rc_min, rc_max=q.rc_max, since_mtime=q.since_mtime,
+                           until_mtime=q.until_mtime, sort=q.sort, order=q.order,
+                           limit=q.limit + 1, after=q.after)
+    next_after = index.row_cursor(rows[q.limit - 1], q.sort) if len(rows) > q.limit else None
+    items = [job_item(r["name"], r["jobid"], r["jobname"], r["rc"], r["size"], r["mtime"]) for r in rows[:q.limit]]
+    return items, next_after
+
+
+def list_dir_jobs(pattern: str, q: ListParams):
+    """Same as list_indexed_jobs from the listings of OUTDIR and its JOBID directories (no index yet); O(files)."""
+    items = [i for d in joblayout.job_dirs(str(OUTDIR)) for i in list_dir_files(Path(d), pattern)]
+    field = {"mtime": "mtime", "size": "size", "jobid": "job-id", "jobname": "job-name", "rc": "job-rc", "name": "file-name"}[q.sort]
+
+    def keep(i):
+        name = (i["job-name"] or "").lower()
+        if q.job_name and name != q.job_name.strip().lower():
+            return False
+        if q.job_id and (i["job-id"] or "").lower() != q.job_id.strip().lower():
+            return False
+        if q.job_name_prefix and not (i["job-name"] and name.startswith(q.job_name_prefix.strip().lower())):
+            return False
+        if q.rc_min is not None and not (i["job-rc"] is not None and i["job-rc"] >= q.rc_min):
+            return False
+        if q.rc_max is not None and not (i["job-rc"] is not None and i["job-rc"] <= q.rc_max):
+            return False
+        if q.since_mtime is not None and not i["mtime"] > q.since_mtime:
+            return False
+        if q.until_mtime is not None and not i["mtime"] <= q.until_mtime:
+            return False
+        return True
+
+    def key(i):
+        v = i[field]
+        return (v if v is not None else "", i["file-name"])
+
+    desc = q.order == "desc"
+    items = sorted((i for i in items if keep(i)), key=key, reverse=desc)
+    if q.after is not None:
+        after = (q.after[0], str(q.after[1]))
+        items = [i for i in items if (key(i) < after if desc else key(i) > after)]
+    next_after = list(key(items[q.limit - 1])) if len(items) > q.limit else None
+    return items[:q.limit], next_after
+
+
+def list_jobs_response(request: Request, prefix: str, pattern: str, q: ListParams) -> Response:
+    """Page of jobs with ETag/If-None-Match and X-Next-Cursor/Link headers (blocking: see run_fs)."""
+    index = get_job_index()
+    version = index.version() if index is not None else None
+    if version is not None:
+        etag = f'W/"jobs-{version}"'
+    else:
+        # cambia con cada alta, baja, rename o escritura vista en OUTDIR o sus directorios de JOBID (fscache)
+        try:
+            versions = ",".join(dir_cache(Path(d)).version() for d in joblayout.job_dirs(str(OUTDIR)))
+            etag = f'W/"dir-{zlib.crc32(versions.encode()):08x}"'
+        except OSError:
+            etag = None
+    if etag and etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    page = list_indexed_jobs(prefix, q)
+    items, next_after = page if page is not None else list_dir_jobs(pattern, q)
+    headers = {"ETag": etag} if etag else {}
+    if next_after is not None:
+        cursor = encode_cursor(q.sort, q.order, next_after)
+        headers["X-Next-Cursor"] = cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"'
+    return JSONResponse(items, headers=headers)
+
+
+# (directory, pattern) -> (DirCache version, items) of the last listing
+_listings: Dict[tuple, tuple] = {}
+
+
 def list_dir_files(d: Path, pattern: str = "*") -> List[Dict[str, Any]]:
+    """Files of ``d`` as job items, newest first; rebuilt only when the directory changed."""
     ensure_dir(d)
-    files = [p for p in d.glob(pattern) if p.is_file()]
-    files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    cache = dir_cache(d)
+    version = cache.version()
+    last = _listings.get((str(d), pattern))
+    if last is not None and last[0] == version:
+        return last[1]
+    files = sorted(cache.files(pattern).items(), key=lambda f: f[1][1], reverse=True)
     out = []
-    for p in files:
-        # derive job id/name from the filename stem (without extension)
-        job_id = None
-        job_name = None
-        job_rc = None
-        try:
-            stem = p.stem
-            parts = stem.split('-')
-            # Expect filenames like: JOB00001-NAME-RC0000 (third segment is RC)
-            if parts and re.match(r"^JOB\d+$", parts[0]):
-                job_id = parts[0]
-                if len(parts) >= 2:
-                    job_name = parts[1].split('.')[0].strip()
-                if len(parts) >= 3:
-                    third = parts[2]
-                    # normalize RC: if starts with 'RC' strip that prefix
-                    if third.upper().startswith('RC'):
-                        job_rc = third[2:]
-                    else:
-                        job_rc = third
-            else:
-                # fallback: if whole stem is JOBxxxx
-                if re.match(r"^JOB\d+$", stem):
-                    job_id = stem
-        except Exception:
-            job_id = None
-            job_name = None
-            job_rc = None
-
-        out.append({
-            "file-name": p.name,
-            "job-name": job_name,
-            "job-rc": job_rc,
-            "job-id": job_id,
-            "path": str(p),
-            "size": p.stat().st_size,
-            "mtime": p.stat().st_mtime,
-        })
+    for name, (size, mtime) in files:
+        # derive job id/name/rc from the filename (JOB00001-NAME-RC0000.txt)
+        job_id, job_name, job_rc = jobindex.parse_job_filename(name)
+        out.append(job_item(name, job_id, job_name, job_rc, size, mtime, str(d / name)))
+    _listings[(str(d), pattern)] = (version, out)
+    return out
+
+
+def outdir_file_or_404(name: str, detail: str) -> Path:
+    """Path of finished job file ``name``: in its JOBID directory, else in OUTDIR itself (blocking).
+
+    Dot names are the extractor's temp files of jobs still being written.
+    """
+    if not name.startswith("."):
+        for d in dict.fromkeys((Path(joblayout.job_dir(str(OUTDIR), name)), OUTDIR)):
+            if dir_cache(d).stat(name) is not None:
+                return d / name
+    raise HTTPException(status_code=404, detail=detail)
+
+
+def events_dropped() -> Dict[str, int]:
+    """Events each bridge process could not deliver, from its last metrics snapshot."""
+    out = {}
+    for process, snap in METRICS.current().items():
+        fam = snap["metrics"].get("bridge_events_dropped_total")
+        if fam:
+            out[process] = sum(value for _, value in fam["samples"])
     return out
 
 
@@ -106,112 +458,386 @@ def list_dir_files(d: Path, pattern: str = "*") -> List[Dict[str, Any]]:
 async def health():
     return {
         "status": "ok",
-        "bridge_ready": READY_FILE.exists(),
-        "spool_dir_exists": OUTDIR.exists(),
-        "log_dir_exists": LOGDIR.exists(),
-        "pid_dir_exists": PIDDIR.exists(),
+        **await current_path_status(),
+        "events": dict(EVENT_BUS.stats(), dropped=events_dropped()),
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the API and of every bridge process that pushed recently."""
+    snapshots = METRICS.current()
+    snapshots["api"] = {"metrics": metrics.REGISTRY.snapshot()}
+    return Response(metrics.render(snapshots), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/spools")
-async def list_spools(job_name: Optional[str] = None, job_id: Optional[str] = None):
-    """List spools; optional query params:
-    - job_name: returns entries whose job-name matches (case-insensitive)
-    - job_id: returns entries whose job-id matches (case-insensitive)
-    If both provided, both filters are applied.
+async def list_spools(request: Request, q: ListParams = Depends()):
+    """List spools (JOB* job files), newest first, one page at a time.
+
+    See ListParams for filters, sorting and cursor pagination. Answers 304 when
+    If-None-Match carries the current ETag (nothing changed since last poll).
     """
-    items = list_dir_files(OUTDIR, "JOB*")
-    if job_name:
-        jn = job_name.strip().lower()
-        items = [i for i in items if i.get("job-name") and i.get("job-name").strip().lower() == jn]
-    if job_id:
-        jid = job_id.strip().lower()
-        items = [i for i in items if i.get("job-id") and i.get("job-id").strip().lower() == jid]
-    return items
+    return await run_fs(list_jobs_response, request, "JOB", "JOB*", q)
+
+
+# Line window syntax for ?lines=: "start:end", 1-based and inclusive; either side may be empty
+LINES_PATTERN = r"^\d*:\d*$"
+
+
+def parse_line_window(lines: str):
+    start, _, end = lines.partition(":")
+    start = int(start) if start else 1
+    end = int(end) if end else None
+    if start < 1 or (end is not None and end < start):
+        raise HTTPException(status_code=400, detail="lines must be start:end with 1 <= start <= end")
+    return start, end
+
+
+def line_checkpoint(name: str, start: int):
+    """(total lines or None, checkpoint) from the job index, (None, None) without one."""
+    index = get_job_index()
+    if index is None:
+        return None, None
+    try:
+        return index.line_checkpoint(name, start)
+    except Exception:
+        # índice de una versión anterior sin lineoffsets
+        return None, None
+
+
+def line_window_response(p: Path, lines: str) -> StreamingResponse:
+    """Stream only lines ``start:end`` of ``p``, seeking from the nearest indexed line offset.
+
+    Blocking (index lookup): call through run_fs; the body is read in Starlette's thread pool.
+    """
+    start, end = parse_line_window(lines)
+    total, checkpoint = line_checkpoint(p.name, start)
+    headers = {"X-Line-Start": str(start)}
+    if total is not None:
+        headers["X-Total-Lines"] = str(total)
+    return StreamingResponse(jobsearch.iter_line_window(str(p), start, end, checkpoint),
+                             media_type="text/plain; charset=utf-8", headers=headers)
 
 
 @app.get("/spools/{name}")
-async def get_spool(name: str):
-    p = OUTDIR / name
-    if not p.exists() or not p.is_file():
-        raise HTTPException(status_code=404, detail="Spool not found")
+async def get_spool(name: str, lines: Optional[str] = Query(None, pattern=LINES_PATTERN)):
+    """Download a job file; HTTP Range requests are honoured, ``?lines=start:end`` returns a line window."""
+    p = await run_fs(outdir_file_or_404, name, "Spool not found")
+    if lines is not None:
+        return await run_fs(line_window_response, p, lines)
     return FileResponse(path=str(p), media_type="application/octet-stream", filename=p.name)
 
 
+def parse_byte_range(header: str, size: int):
+    """(start, end) exclusive for a single ``bytes=`` range, None when the header does not apply."""
+    m = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)) + 1, size) if m.group(2) else size
+    else:
+        start, end = max(size - int(m.group(2)), 0), size
+    if start >= size or end <= start:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def archive_stream_or_404(stream: str):
+    paths = spool_archive.segments(stream)
+    if not paths:
+        raise HTTPException(status_code=404, detail="Archive stream not found")
+    return paths
+
+
+def archive_listing(stream: Optional[str]):
+    out: Dict[str, Dict[str, Any]] = {}
+    for p in spool_archive.segments(stream):
+        try:
+            seg = spool_archive.read_segment(p)
+        except (OSError, ValueError):
+            continue
+        st = out.setdefault(seg.stream, {"stream": seg.stream, "bytes": 0, "stored": 0, "jobs": 0,
+                                         "created": seg.created, "segments": []})
+        size = sum(c[3] for c in seg.chunks)
+        st["bytes"] += size
+        st["stored"] += seg.size
+        st["jobs"] += len(seg.jobs)
+        st["segments"].append({"name": os.path.basename(p), "seq": seg.seq, "codec": spool_archive._CODEC_NAMES.get(seg.codec),
+                               "bytes": size, "stored": seg.size, "chunks": len(seg.chunks),
+                               "jobs": len(seg.jobs), "closed": seg.closed})
+    return sorted(out.values(), key=lambda s: s["created"], reverse=True)
+
+
+@app.get("/archive")
+async def list_archive(stream: Optional[str] = None):
+    """Archived spool streams with their segments (sizes, codec, chunk and job counts)."""
+    return await run_fs(archive_listing, stream)
+
+
+@app.get("/archive/{stream}")
+def get_archive_stream(stream: str, request: Request):
+    """Stream bytes of an archived spool; a ``Range: bytes=`` header reads only the chunks it needs."""
+    archive_stream_or_404(stream)
+    size = spool_archive.stream_size(stream)
+    headers = {"Accept-Ranges": "bytes"}
+    rng = parse_byte_range(request.headers["range"], size) if "range" in request.headers else None
+    start, end = rng or (0, size)
+    headers["Content-Length"] = str(end - start)
+    status = 200
+    if rng:
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return StreamingResponse(spool_archive.read_range(stream, start, end), status_code=status,
+                             media_type="application/octet-stream", headers=headers)
+
+
+@app.get("/archive/{stream}/jobs")
+def list_archive_jobs(stream: str):
+    """Jobs recorded in the stream's segment footers (stream offsets, jobid, jobname, rc)."""
+    jobs = []
+    for p in archive_stream_or_404(stream):
+        jobs.extend(spool_archive.read_segment(p).jobs)
+    return jobs
+
+
+@app.get("/archive/{stream}/jobs/{job}")
+def get_archive_job(stream: str, job: str):
+    """Raw bytes of one job (by JOBID or joblog file name), decompressing only its chunks."""
+    archive_stream_or_404(stream)
+    entry = spool_archive.find_job(stream, job)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Job not found in archive stream")
+    return StreamingResponse(spool_archive.read_range(stream, entry["start"], entry["end"]),
+                             media_type="application/octet-stream",
+                             headers={"Content-Length": str(entry["end"] - entry["start"])})
+
+
 @app.get("/joblogs")
-async def list_joblogs(job_name: Optional[str] = None, job_id: Optional[str] = None):
-    """List joblogs; supports same optional filters as /spools.
+async def list_joblogs(request: Request, q: ListParams = Depends()):
+    """List joblogs; supports same filters, sorting and pagination as /spools.
     """
-    items = list_dir_files(OUTDIR, "joblog_*")
-    if job_name:
-        jn = job_name.strip().lower()
-        items = [i for i in items if i.get("job-name") and i.get("job-name").strip().lower() == jn]
-    if job_id:
-        jid = job_id.strip().lower()
-        items = [i for i in items if i.get("job-id") and i.get("job-id").strip().lower() == jid]
-    return items
+    return await run_fs(list_jobs_response, request, "joblog_", "joblog_*", q)
 
 
 @app.get("/joblogs/{name}")
-async def get_joblog(name: str):
-    p = OUTDIR / name
-    if not p.exists() or not p.is_file():
-        raise HTTPException(status_code=404, detail="Joblog not found")
+async def get_joblog(name: str, lines: Optional[str] = Query(None, pattern=LINES_PATTERN)):
+    """Download a joblog; supports HTTP Range and ``?lines=start:end`` like /spools/{name}."""
+    p = await run_fs(outdir_file_or_404, name, "Joblog not found")
+    if lines is not None:
+        return await run_fs(line_window_response, p, lines)
     # Serve as text when possible
     return FileResponse(path=str(p), media_type="text/plain; charset=utf-8", filename=p.name)
 
 
+# Bytes read per step when scanning a log backwards from EOF
+TAIL_BLOCK = 64 * 1024
+# Upper bound for /logs/{logname}?lines=
+MAX_TAIL_LINES = 10000
+# Files whose tail is kept between calls
+TAIL_CACHE_FILES = 16
+# New bytes worth appending to a cached tail; beyond that the tail is re-read from EOF
+TAIL_APPEND_MAX = 4 * 1024 * 1024
+
+
+class _Tail:
+    """Last lines of one file (by inode) as of ``size`` bytes."""
+
+    def __init__(self, size, lines, partial, at_start, keep):
+        self.size = size
+        self.lines = collections.deque(lines, maxlen=keep)
+        # bytes after the last newline (a line still being written)
+        self.partial = partial
+        # True when self.lines starts at the first line of the file
+        self.at_start = at_start
+
+
+_tail_cache: "collections.OrderedDict[tuple, _Tail]" = collections.OrderedDict()
+_tail_lock = threading.Lock()
+
+
+def _read_tail(path: Path, size: int, lines: int, keep: int) -> _Tail:
+    """Read fixed-size blocks backwards from ``size`` until ``lines`` full lines are found."""
+    chunks = []
+    newlines = 0
+    pos = size
+    with path.open("rb") as f:
+        # one newline more than lines, so the oldest line is known to be complete
+        while pos > 0 and newlines <= lines:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step)
+            chunks.append(block)
+            newlines += block.count(b"\n")
+    data = b"".join(reversed(chunks))
+    parts = data.split(b"\n")
+    partial = parts.pop()
+    if pos > 0:
+        parts = parts[1:]  # cut through by the first block read
+    return _Tail(size, parts[-keep:], partial, pos == 0 and len(parts) <= keep, keep)
+
+
+def _file_tail(path: Path, lines: int) -> _Tail:
+    """Tail of ``path`` with at least ``lines`` lines (unless the file is shorter).
+
+    Cached per (device, inode): a later call on a file that only grew reads
+    just the appended bytes, and a log renamed by RotatingFileHandler keeps
+    its cache entry under the backup name.
+    """
+    st = path.stat()
+    key = (st.st_dev, st.st_ino)
+    keep = max(lines, 200)
+    with _tail_lock:
+        t = _tail_cache.get(key)
+        usable = (t is not None and t.size <= st.st_size and st.st_size - t.size <= TAIL_APPEND_MAX
+                  and (len(t.lines) >= lines or t.at_start) and t.lines.maxlen >= lines)
+        if not usable:
+            t = _read_tail(path, st.st_size, lines, keep)
+        elif st.st_size > t.size:
+            with path.open("rb") as f:
+                f.seek(t.size)
+                new = f.read(st.st_size - t.size)
+            parts = (t.partial + new).split(b"\n")
+            t.partial = parts.pop()
+            if len(t.lines) + len(parts) > t.lines.maxlen:
+                t.at_start = False
+            t.lines.extend(parts)
+            t.size += len(new)
+        _tail_cache[key] = t
+        _tail_cache.move_to_end(key)
+        while len(_tail_cache) > TAIL_CACHE_FILES:
+            _tail_cache.popitem(last=False)
+        return t
+
+
 def tail_lines(path: Path, lines: int = 200) -> str:
+    """Last ``lines`` lines of a log, continuing into its rotated backups (.1, .2, ...) when short."""
     if not path.exists() or not path.is_file():
         raise FileNotFoundError(str(path))
-    # Read backwards in binary to avoid encoding issues
-    with path.open("rb") as f:
-        avg_line_size = 200
-        to_read = lines * avg_line_size
+    out: List[bytes] = []
+    n = 0
+    current = path
+    while True:
         try:
-            f.seek(0, 2)
-            file_size = f.tell()
-            if to_read < file_size:
-                f.seek(-to_read, 2)
-            else:
-                f.seek(0)
-            data = f.read()
-        except OSError:
-            f.seek(0)
-            data = f.read()
+            t = _file_tail(current, lines - len(out))
+        except FileNotFoundError:
+            break
+        got = list(t.lines) + ([t.partial] if t.partial else [])
+        out[:0] = got[-(lines - len(out)):]
+        if len(out) >= lines or not t.at_start:
+            break
+        n += 1
+        current = path.with_name(f"{path.name}.{n}")
+    return "\n".join(l.rstrip(b"\r").decode("utf-8", errors="replace") for l in out)
+
+
+def parse_last_event_id(request_value: Optional[str]) -> Optional[int]:
+    if request_value is None or request_value == "":
+        return None
     try:
-        text = data.decode("utf-8", errors="replace")
-    except Exception:
-        text = data.decode("latin-1", errors="replace")
-    arr = text.splitlines()
-    return "\n".join(arr[-lines:])
+        return int(request_value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+
+async def sse_events(request: Request, types, last_id, frame):
+    """Yield SSE frames for bus events matching ``types``, starting after ``last_id``."""
+    q, missed = EVENT_BUS.subscribe(last_id, types)
+    try:
+        for event in missed:
+            yield frame(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(q.get(), EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                # fell behind: the client reconnects with its Last-Event-ID
+                break
+            if not types or events.matches(event, types):
+                yield frame(event)
+    finally:
+        EVENT_BUS.unsubscribe(q)
+
+
+@app.get('/events')
+async def stream_events(request: Request, types: Optional[str] = None, last_event_id: Optional[str] = None):
+    """Job events as Server-Sent Events, pushed as the bridge sees them.
+
+    ``types`` is a comma separated filter ("job", "job.end,console.submitted").
+    Reconnecting clients resume from the Last-Event-ID header (or the
+    ``last_event_id`` query parameter) while the event is still in the backlog.
+    """
+    wanted = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    last_id = parse_last_event_id(request.headers.get("last-event-id", last_event_id))
+    return StreamingResponse(sse_events(request, wanted, last_id, events.format_sse),
+                             media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.websocket('/ws/events')
+async def ws_events(websocket: WebSocket, types: Optional[str] = None, last_event_id: Optional[int] = None):
+    """Same events as /events, one JSON message each."""
+    wanted = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    await websocket.accept()
+    q, missed = EVENT_BUS.subscribe(last_event_id, wanted)
+    try:
+        for event in missed:
+            await websocket.send_json(event)
+        while (event := await q.get()) is not None:
+            if not wanted or events.matches(event, wanted):
+                await websocket.send_json(event)
+        await websocket.close(code=1013)  # fell behind; reconnect with last_event_id
+    except WebSocketDisconnect:
+        pass
+    finally:
+        EVENT_BUS.unsubscribe(q)
 
 
 @app.get('/stream/watch')
 async def stream_watch(request: Request):
-    """Stream new lines from console_watch.log as Server-Sent Events (SSE).
-    Keep the connection open and yield new lines as they are appended.
+    """Stream console (hardcopy) lines as Server-Sent Events (SSE).
+
+    Lines are pushed from console_watch through the event bus; with the bus
+    turned off (BRIDGE_EVENTS_SOCKET=off) new lines of console_watch.log are
+    polled instead.
     """
+    if events.enabled():
+        last_id = parse_last_event_id(request.headers.get("last-event-id"))
+        frame = lambda e: f"id: {e['id']}\ndata: {e['line']}\n\n"
+        return StreamingResponse(sse_events(request, ["console.line"], last_id, frame),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
     log_path = LOGDIR / 'console_watch.log'
-    ensure_dir(LOGDIR)
-    # If file doesn't exist yet, create an empty one
-    if not log_path.exists():
-        log_path.write_text("")
+
+    def open_log():
+        ensure_dir(LOGDIR)
+        # If file doesn't exist yet, create an empty one
+        if not log_path.exists():
+            log_path.write_text("")
+        f = log_path.open('r', encoding='utf-8', errors='replace')
+        # seek to end
+        f.seek(0, 2)
+        return f
 
     async def event_generator():
-        with log_path.open('r', encoding='utf-8', errors='replace') as f:
-            # seek to end
-            f.seek(0, 2)
+        f = await run_fs(open_log)
+        try:
             while True:
                 if await request.is_disconnected():
                     break
-                line = f.readline()
-                if line:
+                new = await run_fs(f.readlines)
+                for line in new:
                     yield f"data: {line.rstrip()}\n\n"
-                else:
+                if not new:
                     # no new line, wait a bit
-                    import asyncio
                     await asyncio.sleep(0.5)
+        finally:
+            f.close()
 
     # Return a StreamingResponse with the SSE media type. This avoids
     # relying on EventSourceResponse from starlette which may not be present
@@ -219,54 +845,19 @@ async def stream_watch(request: Request):
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
-@app.get('/joblogs/{name}/meta')
-async def joblog_meta(name: str, head_lines: int = 8):
-    p = OUTDIR / name
-    if not p.exists() or not p.is_file():
-        raise HTTPException(status_code=404, detail='Joblog not found')
+def read_joblog_meta(name: str, head_lines: int):
+    p = outdir_file_or_404(name, 'Joblog not found')
     stat = p.stat()
-    # attempt to read first few lines for metadata (try utf-8 then fallback)
-    try:
-        with p.open('r', encoding='utf-8') as f:
-            first = [next(f).rstrip('\n') for _ in range(head_lines)]
-    except Exception:
-        try:
-            with p.open('r', encoding='cp037', errors='replace') as f:
-                first = [next(f).rstrip('\n') for _ in range(head_lines)]
-        except Exception:
-            first = []
-    # parse filename for job id, job name and job rc (e.g. JOB00002-ECHO-RC0000.txt)
-    job_id = None
-    job_name = None
-    job_rc = None
+    # first lines only: one bounded read, decoded once
     try:
-        base = p.stem  # filename without suffix
-        parts = base.split('-')
-        if parts and re.match(r"^JOB\d+$", parts[0]):
-            job_id = parts[0]
-            if len(parts) >= 2:
-                job_name = parts[1]
-            if len(parts) >= 3:
-                third = parts[2]
-                if third.upper().startswith('RC'):
-                    job_rc = third[2:]
-                else:
-                    job_rc = third
-        else:
-            if re.match(r"^JOB\d+$", base):
-                job_id = base
-    except Exception:
-        job_id = None
-        job_name = None
-        job_rc = None
-
-    # defensive cleanup: remove any accidental extension or trailing dots/whitespace
-    if job_id:
-        job_id = job_id.split('.')[0].strip()
-    if job_name:
-        job_name = job_name.split('.')[0].strip()
-    if job_rc:
-        job_rc = job_rc.split('.')[0].strip()
+        head = b"".join(jobsearch.iter_line_window(str(p), 1, head_lines))
+        if head.endswith(b"\n"):
+            head = head[:-1]
+        first = [jobsearch.decode(l) for l in head.split(b"\n")] if head else []
+    except OSError:
+        first = []
+    job_id, job_name, job_rc = jobindex.parse_job_filename(p.name)
+    total, _ = line_checkpoint(p.name, 1)
 
     return {
         'name': p.name,
@@ -276,23 +867,27 @@ async def joblog_meta(name: str, head_lines: int = 8):
         'job_id': job_id,
         'job_name': job_name,
         'job_rc': job_rc,
+        'lines': total,
     }
 
 
+@app.get('/joblogs/{name}/meta')
+async def joblog_meta(name: str, head_lines: int = 8):
+    return await run_fs(read_joblog_meta, name, head_lines)
+
+
 @app.get("/logs/{logname}")
-async def get_log_tail(logname: str, lines: int = 200):
+async def get_log_tail(logname: str, lines: int = Query(200, ge=1, le=MAX_TAIL_LINES)):
     p = LOGDIR / logname
-    if not p.exists() or not p.is_file():
-        raise HTTPException(status_code=404, detail="Log not found")
     try:
-        text = tail_lines(p, lines)
+        # tail_lines checks the file exists
+        text = await run_fs(tail_lines, p, lines)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Log not found")
     return JSONResponse({"name": p.name, "lines": lines, "content": text})
 
 
-@app.get("/pids")
-async def list_pids():
+def read_pids():
     ensure_dir(PIDDIR)
     out = []
     for p in sorted(PIDDIR.glob("*.pid")):
@@ -304,28 +899,140 @@ async def list_pids():
     return out
 
 
+@app.get("/pids")
+async def list_pids():
+    return await run_fs(read_pids)
+
+
 @app.get("/ready")
 async def ready():
-    return {"ready": READY_FILE.exists(), "ready_path": str(READY_FILE)}
+    return {"ready": (await current_path_status())["bridge_ready"], "ready_path": str(READY_FILE)}
+
+
+def get_submitter() -> "submit.Submitter":
+    if SUBMITTER is None:
+        raise HTTPException(status_code=503, detail="job submission disabled")
+    return SUBMITTER
+
+
+@app.post("/jobs")
+async def submit_jobs(request: Request, wait: float = Query(30, ge=0, le=600)):
+    """Queue JCL for the card reader and return each deck's JOBID.
+
+    The body is plain JCL (any number of JOB cards, each starts a deck) or JSON
+    ``{"jcl": "..."}`` / ``{"jcl": ["...", ...]}``. The answer waits up to
+    ``wait`` seconds for the $HASP100 of every deck: 200 when all have a JOBID,
+    202 with the submission ids (see /jobs/submissions/{id}) otherwise.
+    """
+    submitter = get_submitter()
+    body = await request.body()
+    if len(body) > submit.MAX_BODY:
+        raise HTTPException(status_code=413, detail=f"body larger than {submit.MAX_BODY} bytes")
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            jcl = json.loads(body).get("jcl")
+            text = "\n".join(jcl) if isinstance(jcl, list) else jcl
+            if not isinstance(text, str):
+                raise ValueError("'jcl' must be a string or a list of strings")
+        else:
+            text = body.decode("ascii")
+        ids = await submitter.submit(text)
+    except (ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"invalid JCL: {e}")
+    rows = await submitter.wait(ids, wait) if wait else await submitter.queue.call(submitter.queue.get, ids)
+    status = 200 if all(r["jobid"] for r in rows) else 202
+    return JSONResponse({"jobs": rows}, status_code=status)
+
+
+@app.get("/jobs/submissions/stats")
+async def submission_stats(window: int = Query(60, ge=1, le=86400)):
+    """Counts per state, jobs/s over the last ``window`` seconds and latency percentiles per state."""
+    queue = get_submitter().queue
+    return await queue.call(queue.stats, window)
+
+
+@app.get("/jobs/submissions")
+async def list_submissions(state: Optional[str] = Query(None, pattern="^(" + "|".join(submit.STATES) + ")$"),
+                           limit: int = Query(100, ge=1, le=MAX_PAGE)):
+    queue = get_submitter().queue
+    return await queue.call(queue.list, state, limit)
+
+
+@app.get("/jobs/submissions/{sid}")
+async def get_submission(sid: int, wait: float = Query(0, ge=0, le=600)):
+    submitter = get_submitter()
+    rows = await submitter.wait([sid], wait, until=("printed",)) if wait else await submitter.queue.call(submitter.queue.get, [sid])
+    if not rows:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    return rows[0]
+
+
+def get_job_tracker() -> "jobstate.JobTracker":
+    if JOB_TRACKER is None:
+        raise HTTPException(status_code=503, detail="job lifecycle tracking disabled")
+    return JOB_TRACKER
+
+
+@app.get("/jobs")
+async def list_jobs(state: Optional[str] = Query(None, pattern="^(" + "|".join(s for _, s in jobstate.STAGES) + ")$"),
+                    job_name: Optional[str] = None, limit: int = Query(100, ge=1, le=MAX_PAGE)):
+    """Job lifecycles (submitted, started, ended, printed, RC and stage durations), most recently updated first."""
+    return get_job_tracker().list(state, job_name, limit)
+
+
+@app.get("/jobs/stats")
+async def job_stats(since: Optional[float] = None):
+    """Jobs per state and p50/p95/p99 of queue, run, print and total time; ``bottleneck`` is the slowest stage."""
+    return get_job_tracker().stats(since)
+
+
+@app.get("/jobs/{jobid}")
+async def get_job(jobid: str):
+    job = get_job_tracker().get(jobid.upper())
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 # Optional: simple search for a substring within raw dump (first N bytes)
+@app.get("/search")
+def search(q: str = Query(..., min_length=1), scope: str = Query("joblogs", pattern="^(joblogs|raw|all)$"),
+           regex: bool = False, limit: int = Query(50, ge=1, le=1000), context: int = Query(0, ge=0, le=20)):
+    """Find the job (or raw dump offset) that printed ``q``, e.g. a message ID or abend code.
+
+    Literal joblog queries of 3+ characters use the job index's trigram table;
+    ``regex=true``, shorter queries and ``scope=raw`` stream over the files.
+    Matching is case-insensitive; one hit per line, newest jobs first.
+    """
+    if regex:
+        try:
+            jobsearch.compile_query(q, regex=True)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+    out: Dict[str, Any] = {"query": q, "regex": regex}
+    if scope in ("joblogs", "all"):
+        ensure_dir(OUTDIR)
+        mode, hits = jobsearch.search_joblogs(q, str(OUTDIR), get_job_index(), regex=regex, limit=limit, context=context)
+        out["mode"] = mode
+        out["joblogs"] = hits
+    if scope in ("raw", "all"):
+        out["raw"] = jobsearch.search_raw(q, str(LOGDIR), regex=regex, limit=limit, context=context)
+    return out
+
+
 @app.get("/raw/search")
-async def raw_search(q: str, limit_bytes: int = 65536):
+def raw_search(q: str, limit_bytes: int = 65536):
+    """Whether ``q`` appears in the first ``limit_bytes`` of the raw dump (0 = whole file), and where first."""
     p = LOGDIR / "console_bridge-raw.bin"
     if not p.exists() or not p.is_file():
         raise HTTPException(status_code=404, detail="raw dump not found")
     try:
-        with p.open("rb") as f:
-            data = f.read(limit_bytes)
+        hits = jobsearch.scan_file(str(p), jobsearch.compile_query(q), limit=1, size=limit_bytes or None)
     except Exception:
         raise HTTPException(status_code=500, detail="failed reading raw dump")
-    try:
-        text = data.decode("utf-8", errors="replace")
-    except Exception:
-        text = data.decode("latin-1", errors="replace")
-    found = q in text
-    return {"query": q, "found": found}
+    found = bool(hits)
+    return {"query": q, "found": found, "offset": hits[0]["offset"] if found else None,
+            "line": hits[0]["line"] if found else None}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,759 @@
+"""Local benchmarks for the bridge hot paths.
+
+Run from the bridge directory, e.g.::
+
+    python3 bench.py extractor --chunk-sizes 512,4096,65536 --job-sizes 16384,1048576
+    python3 bench.py replay --input /app/logs/console_bridge-raw.1.bin /app/logs/console_bridge-raw.bin
+    python3 bench.py recv --total 268435456 --consumer session
+    python3 bench.py console --lines 500000
+    python3 bench.py api --files 20000 --spools-clients 8
+    python3 bench.py e2e --jobs 2000 --job-size 2048-262144 --codepage cp037
+
+Every benchmark works on synthetic JES2 output (or the ``--input`` files) in a
+temporary directory, so nothing under /app is touched.
+"""
+import argparse, asyncio, json, os, random, shutil, socket, sqlite3, subprocess, sys, tempfile, threading, time, logging
+import http.client
+
+# Keep console_bridge's import-time directories out of /app
+_TMP = tempfile.mkdtemp(prefix="bridge-bench-")
+for _var, _sub in (("BRIDGE_OUTDIR", "spool"), ("BRIDGE_LOGDIR", "logs"), ("BRIDGE_PIDDIR", "pids")):
+    os.environ.setdefault(_var, os.path.join(_TMP, _sub))
+os.environ.setdefault("BRIDGE_READYFILE", os.path.join(_TMP, "pids", "console_bridge.ready"))
+os.environ.setdefault("BRIDGE_EVENTS_SOCKET", "off")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import console_bridge  # noqa: E402
+import joblayout  # noqa: E402
+
+logging.getLogger("console_bridge").setLevel(logging.WARNING)
+
+
+def parse_sizes(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def make_job(num, size, rc="0000"):
+    """Return one JES2-like job (separator, JOBID line, listing, RC, END) of ~size bytes."""
+    head = (
+        b"\r\n****A  START  JOB %d  BENCH%d  ROOM  SYSOUT\r\n" % (num, num % 1000)
+        + b" 12.00.00 JOB %d  $HASP373 BENCH STARTED\r\n" % num
+        + b"   JES2.JOB%05d.D0000101.?\r\n" % num
+    )
+    tail = b"  IEF142I BENCH STEP1 - STEP WAS EXECUTED - COND CODE RC= %s\r\n****A   END    JOB %d\r\n" % (rc.encode("ascii"), num)
+    line = b" IEF236I ALLOC. FOR BENCH STEP1 SYSPRINT  SYSOUT DATASET LISTING LINE PADDING........\r\n"
+    body = line * max(0, (size - len(head) - len(tail)) // len(line))
+    return head + body + tail
+
+
+def make_stream(total, job_size, seed=0):
+    rnd = random.Random(seed)
+    jobs = []
+    n = 0
+    while sum(len(j) for j in jobs) < total:
+        n += 1
+        jobs.append(make_job(n, job_size, "%04d" % rnd.choice((0, 0, 4, 8, 12))))
+    return b"".join(jobs), n
+
+
+def bench_extractor(args):
+    print("%10s %10s %8s %10s %10s" % ("job_size", "chunk", "jobs", "MB/s", "us/chunk"))
+    for job_size in parse_sizes(args.job_sizes):
+        data, jobs = make_stream(args.total, job_size)
+        if args.codepage != "ascii":
+            data = data.decode("ascii").encode(args.codepage)
+        for chunk in parse_sizes(args.chunk_sizes):
+            chunks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+            best = None
+            for _ in range(args.repeat):
+                outdir = tempfile.mkdtemp(dir=_TMP)
+                ex = console_bridge.JobLogExtractor(outdir=outdir, codepage=args.codepage)
+                t0 = time.perf_counter()
+                for c in chunks:
+                    ex.feed(c)
+                ex.close()
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            print("%10d %10d %8d %10.1f %10.2f" % (
+                job_size, chunk, jobs, len(data) / best / 1e6, best / len(chunks) * 1e6))
+
+
+def replay_chunks(size, total, seed):
+    """Chunk lengths for ``bench.py replay``: ``size`` bytes each, or log-uniform 1 B..1 MiB."""
+    if size:
+        return [size] * ((total + size - 1) // size)
+    rnd = random.Random(seed)
+    sizes = []
+    left = total
+    while left > 0:
+        n = min(left, int(2 ** rnd.uniform(0, 20)))
+        sizes.append(n)
+        left -= n
+    return sizes
+
+
+def extract(data, codepage, sizes):
+    """Feed ``data`` in chunks of ``sizes``; return ``({file: bytes}, seconds)``."""
+    outdir = tempfile.mkdtemp(dir=_TMP)
+    try:
+        ex = console_bridge.JobLogExtractor(outdir=outdir, codepage=codepage)
+        mv = memoryview(data)
+        pos = 0
+        t0 = time.perf_counter()
+        for n in sizes:
+            ex.feed(mv[pos:pos + n])
+            pos += n
+        ex.close()
+        elapsed = time.perf_counter() - t0
+        out = {}
+        for entry in joblayout.iter_job_files(outdir):
+            with open(entry.path, "rb") as f:
+                out[entry.name] = f.read()
+        return out, elapsed
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+
+def diff_outputs(ref, got):
+    """First difference between two extractions, or None."""
+    if ref.keys() != got.keys():
+        return "files differ: missing %s, extra %s" % (sorted(ref.keys() - got.keys())[:3], sorted(got.keys() - ref.keys())[:3])
+    for name in sorted(ref):
+        a, b = ref[name], got[name]
+        if a != b:
+            at = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+            return "%s differs at byte %d (%d vs %d bytes)" % (name, at, len(a), len(b))
+    return None
+
+
+def bench_replay(args):
+    """Replay a stream at many chunk sizes and check every extraction matches one whole-stream feed."""
+    if args.input:
+        data = b"".join(open(p, "rb").read() for p in args.input)
+    else:
+        data = make_stream(args.total, args.job_size)[0]
+    codepage = args.codepage
+    if codepage == "auto":
+        codepage = console_bridge.detect_codepage(data[:console_bridge.DETECT_SAMPLE], final=True)
+    print("%d bytes, codepage %s" % (len(data), codepage))
+    # Reference extraction per replayed length (tiny chunks replay a prefix, see --max-feeds)
+    refs = {}
+    failed = 0
+    print("%10s %6s %12s %10s %10s  %s" % ("chunk", "seed", "bytes", "feeds", "MB/s", "result"))
+    for spec in args.chunk_sizes.split(","):
+        size = 0 if spec == "random" else int(spec)
+        for seed in range(args.seeds if not size else 1):
+            total = len(data)
+            if size and args.max_feeds:
+                total = min(total, size * args.max_feeds)
+            if total not in refs:
+                refs[total] = extract(data[:total], codepage, [total])[0]
+            sizes = replay_chunks(size, total, seed)
+            got, elapsed = extract(data[:total], codepage, sizes)
+            problem = diff_outputs(refs[total], got)
+            failed += problem is not None
+            print("%10s %6s %12d %10d %10.1f  %s" % (
+                spec, seed if not size else "-", total, len(sizes), total / elapsed / 1e6,
+                problem or "ok (%d files)" % len(got)))
+    if failed:
+        print("%d replay(s) differ from the whole-stream extraction" % failed)
+        sys.exit(1)
+
+
+async def fake_sockdev(payload, chunk):
+    """Start a local server that behaves like a Hercules printer sockdev.
+
+    It sends ``payload`` to the first client in ``chunk``-sized writes and
+    closes, the way Hercules ends a spool. Returns the asyncio server.
+    """
+    async def handle(reader, writer):
+        for i in range(0, len(payload), chunk):
+            writer.write(payload[i:i + chunk])
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def _bench_daemon(args):
+    import bridge_daemon
+    data, jobs = make_stream(args.total, args.job_size)
+    servers = [await fake_sockdev(data, args.chunk) for _ in range(args.printers)]
+    endpoints = []
+    for n, srv in enumerate(servers):
+        port = srv.sockets[0].getsockname()[1]
+        endpoints.append(bridge_daemon.Endpoint(f"prt{n}", "127.0.0.1", port, "printer"))
+    t0 = time.perf_counter()
+    writer = await bridge_daemon.serve(endpoints, reconnect=False)
+    elapsed = time.perf_counter() - t0
+    for srv in servers:
+        srv.close()
+    written = sum(1 for _ in joblayout.iter_job_files(console_bridge.OUTDIR, "JOB"))
+    total = len(data) * args.printers
+    print("printers=%d jobs=%d/%d bytes=%d elapsed=%.2fs  %.1f MB/s  %.0f jobs/s  queue high-water=%d/%d" % (
+        args.printers, written, jobs * args.printers, total, elapsed, total / elapsed / 1e6,
+        jobs * args.printers / elapsed, writer.high_water, writer.queue.maxsize))
+
+
+def bench_daemon(args):
+    asyncio.run(_bench_daemon(args))
+
+
+def _recv_legacy(s, consume, stats):
+    """Receive loop before the buffer pool: a new bytes object per recv()."""
+    while True:
+        data = s.recv(console_bridge.RECV_SIZE)
+        if not data:
+            return
+        stats["calls"] += 1
+        stats["buffers"] += 1
+        stats["buffer_bytes"] += console_bridge.RECV_SIZE
+        consume(data)
+
+
+def _recv_pooled(s, consume, stats):
+    """console_bridge.recv_one_spool's loop: recv_into pool buffers, adaptive size."""
+    pool = console_bridge.BufferPool()
+    size = console_bridge.RecvSize(pool.sizes)
+    while True:
+        buf = pool.get(size.size)
+        n = s.recv_into(buf)
+        if not n:
+            break
+        stats["calls"] += 1
+        size.update(n)
+        with memoryview(buf) as mv, mv[:n] as data:
+            consume(data)
+        pool.put(buf)
+    stats["buffers"] = pool.allocated
+    stats["buffer_bytes"] = sum(pool.sizes)
+
+
+def bench_recv(args):
+    import tracemalloc
+    data, _ = make_stream(args.total, args.job_size)
+    modes = (("recv", _recv_legacy), ("recv_into", _recv_pooled))
+    # the job index commits would dominate (see "bench.py e2e" for the whole pipeline)
+    console_bridge.jobindex.INDEX_PATH = "off"
+    logging.getLogger("console_bridge").setLevel(args.log_level)
+    print("BRIDGE_RECV_SIZE=%d BRIDGE_SO_RCVBUF=%d, %d bytes in %d-byte sockdev writes, consumer=%s" % (
+        console_bridge.RECV_SIZE, console_bridge.SO_RCVBUF, len(data), args.chunk, args.consumer))
+    print("%-10s %8s %9s %9s %12s %11s" % ("mode", "MB/s", "calls", "buffers", "buffer MB", "peak KiB"))
+    for label, loop in modes:
+        for traced in (False, True):
+            srv = socket.create_server(("127.0.0.1", 0))
+
+            def send():
+                conn, _ = srv.accept()
+                with conn:
+                    for i in range(0, len(data), args.chunk):
+                        conn.sendall(data[i:i + args.chunk])
+
+            t = threading.Thread(target=send, daemon=True)
+            t.start()
+            if args.consumer == "session":
+                session = console_bridge.SpoolSession(name="bench")
+                consume = session.handle
+            else:
+                sink = bytearray()
+
+                def consume(chunk):
+                    # the copy every writer does; cleared like a committed buffer
+                    sink.extend(chunk)
+                    if len(sink) >= 1 << 20:
+                        sink.clear()
+                session = None
+            stats = dict(calls=0, buffers=0, buffer_bytes=0)
+            s = console_bridge.open_sockdev("127.0.0.1", srv.getsockname()[1])
+            if traced:
+                tracemalloc.start()
+            t0 = time.perf_counter()
+            loop(s, consume, stats)
+            elapsed = time.perf_counter() - t0
+            peak = 0
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            s.close()
+            srv.close()
+            t.join()
+            if session is not None:
+                session.close()
+            # throughput from the untraced pass, peak memory from the traced one
+            if not traced:
+                rate = len(data) / elapsed / 1e6
+                continue
+            print("%-10s %8.1f %9d %9d %12.1f %11.0f" % (
+                label, rate, stats["calls"], stats["buffers"], stats["buffer_bytes"] / 1e6, peak / 1024))
+
+
+def _split_legacy(chunks):
+    """console_watch's line splitter before LineSplitter (re-splits the buffer per line)."""
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            yield line.decode("ascii", "ignore").rstrip("\r")
+
+
+def bench_console(args):
+    import console_watch, sockdev_sim
+    for h in list(console_watch.logger.handlers):
+        if not isinstance(h, logging.FileHandler):
+            console_watch.logger.removeHandler(h)
+    rnd = random.Random(0)
+    lines = []
+    n = 0
+    while len(lines) < args.lines:
+        n += 1
+        job = sockdev_sim.Job(n, rnd, (1000, 1000))
+        for event in ("submitted", "started", "ended"):
+            lines += sockdev_sim.console_lines(job, event, time.time())
+        lines += ["12.00.00  IEE%03dI SYSTEM ACTIVITY %d" % (rnd.randrange(1000), n),
+                  "12.00.00           DEVICE 0%03X ONLINE" % rnd.randrange(4096)]
+    data = ("\r\n".join(lines[:args.lines]) + "\r\n").encode("ascii")
+    chunks = [data[i:i + args.chunk] for i in range(0, len(data), args.chunk)]
+    print("%d lines, %d bytes in %d-byte chunks" % (args.lines, len(data), args.chunk))
+
+    def split_new(chunks):
+        splitter = console_watch.LineSplitter()
+        for chunk in chunks:
+            yield from splitter.feed(chunk)
+
+    for label, split in (("split legacy", _split_legacy), ("split LineSplitter", split_new)):
+        t0 = time.perf_counter()
+        count = sum(1 for _ in split(chunks))
+        elapsed = time.perf_counter() - t0
+        print("%-28s %10.0f lines/s (%d lines)" % (label, count / elapsed, count))
+    for raw in ("all", "10", "off"):
+        console_watch.RAW_EVERY = 1 if raw == "all" else 0 if raw == "off" else int(raw)
+        t0 = time.perf_counter()
+        for line in split_new(chunks):
+            console_watch.handle_line(line)
+        elapsed = time.perf_counter() - t0
+        print("%-28s %10.0f lines/s" % ("handle_line CW_RAW_LOG=" + raw, args.lines / elapsed))
+
+
+def bench_writer(args):
+    import spool_writer
+    chunk = os.urandom(args.chunk)
+    policies = [("every write", 0, False), ("group %dms" % args.flush_ms, args.flush_ms, False)]
+    if args.fsync:
+        policies += [("every write+fsync", 0, True), ("group %dms+fsync" % args.flush_ms, args.flush_ms, True)]
+    for label, flush_ms, fsync in policies:
+        spool_writer.STATS.report(reset=True)
+        path = os.path.join(_TMP, "writer.bin")
+        t0 = time.perf_counter()
+        with spool_writer.BufferedStream(path, "wb", flush_ms=flush_ms, fsync=fsync) as s:
+            for _ in range(args.count):
+                s.write(chunk)
+        elapsed = time.perf_counter() - t0
+        r = spool_writer.STATS.report()
+        print("%-22s %9.0f writes/s %8.1f MB/s %7d commits %5d fsyncs" % (
+            label, args.count / elapsed, args.count * args.chunk / elapsed / 1e6, r["commits"], r["fsyncs"]))
+        print("  commit latency:\n    " + spool_writer.STATS.commit_latency.format().replace("\n", "\n    "))
+        os.remove(path)
+
+
+def bench_archive(args):
+    import spool_archive
+    if args.input:
+        with open(args.input, "rb") as f:
+            data = f.read()
+        source = args.input
+    else:
+        data, _ = make_stream(args.total, args.job_size)
+        source = "synthetic (far more compressible than real listings; use --input)"
+    print("input: %s, %d bytes" % (source, len(data)))
+    print("%6s %8s %8s %10s %12s %12s %12s" % ("codec", "chunk", "ratio", "write MB/s", "read4K p50", "read4K p99", "read 1MB"))
+    rnd = random.Random(0)
+    for codec in args.codecs.split(","):
+        for chunk_kb in parse_sizes(args.chunk_kb):
+            adir = tempfile.mkdtemp(dir=_TMP)
+            t0 = time.perf_counter()
+            with spool_archive.ArchiveWriter("bench", archive_dir=adir, codec=codec, chunk_bytes=chunk_kb * 1024,
+                                             flush_seconds=3600) as w:
+                for i in range(0, len(data), 65536):
+                    w.write(data[i:i + 65536])
+            elapsed = time.perf_counter() - t0
+            stored = sum(os.path.getsize(p) for p in spool_archive.segments("bench", adir))
+            lat = []
+            for _ in range(args.reads):
+                start = rnd.randrange(max(len(data) - 4096, 1))
+                t0 = time.perf_counter()
+                got = b"".join(spool_archive.read_range("bench", start, start + 4096, adir))
+                lat.append(time.perf_counter() - t0)
+                assert got == data[start:start + 4096]
+            lat.sort()
+            start = rnd.randrange(max(len(data) - (1 << 20), 1))
+            t0 = time.perf_counter()
+            b"".join(spool_archive.read_range("bench", start, start + (1 << 20), adir))
+            big = time.perf_counter() - t0
+            print("%6s %7dK %8.1f %10.1f %10.2fms %10.2fms %10.2fms" % (
+                codec, chunk_kb, len(data) / max(stored, 1), len(data) / elapsed / 1e6,
+                lat[len(lat) // 2] * 1e3, lat[int(len(lat) * 0.99)] * 1e3, big * 1e3))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)] if values else None
+
+
+def _git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+class ApiLoad(threading.Thread):
+    """Closed-loop GETs on a few API routes at about ``rps`` requests/s; latencies per route."""
+
+    ROUTES = ("/health", "/spools?limit=50", "/jobs?limit=50")
+
+    def __init__(self, port, rps, clients):
+        super().__init__(daemon=True)
+        self.port = port
+        self.interval = clients / rps if rps > 0 else 0
+        self.clients = clients
+        self.latency = {r.split("?")[0]: [] for r in self.ROUTES}
+        self.errors = 0
+        self.stop = threading.Event()
+
+    def client(self, n):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        i = n
+        while not self.stop.is_set():
+            route = self.ROUTES[i % len(self.ROUTES)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", route)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status >= 500:
+                    self.errors += 1
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                continue
+            elapsed = time.perf_counter() - t0
+            self.latency[route.split("?")[0]].append(elapsed)
+            self.stop.wait(max(0.0, self.interval - elapsed))
+
+    def run(self):
+        threads = [threading.Thread(target=self.client, args=(n,), daemon=True) for n in range(self.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+
+def _wait_http(port, path, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def _extracted(index_path):
+    """``{jobid: end_ts}`` of the jobs the bridge finished, from its job index."""
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        try:
+            return dict(db.execute("SELECT jobid, end_ts FROM jobs WHERE end_ts IS NOT NULL AND jobid IS NOT NULL"))
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return {}
+
+
+def _get_loop(port, route, stop, latency, interval=0.0, errors=None):
+    """GET ``route`` until ``stop`` is set, appending each latency (closed loop, ``interval`` apart)."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", route)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 500 and errors is not None:
+                errors.append(resp.status)
+        except (OSError, http.client.HTTPException):
+            if errors is not None:
+                errors.append(None)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            continue
+        elapsed = time.perf_counter() - t0
+        latency.append(elapsed)
+        stop.wait(max(0.0, interval - elapsed))
+
+
+def bench_api(args):
+    """/health latency while clients list a big OUTDIR through /spools (directory listing, no index)."""
+    work = tempfile.mkdtemp(prefix="api-", dir=_TMP)
+    dirs = {k: os.path.join(work, k) for k in ("spool", "logs", "pids")}
+    for d in dirs.values():
+        os.makedirs(d)
+    for n in range(args.files):
+        name = "JOB%05d-BENCH%d-RC0000.txt" % (n, n % 100)
+        with open(os.path.join(joblayout.job_dir(dirs["spool"], name, create=True), name), "wb") as f:
+            f.write(b"x" * 100)
+    port = _free_port()
+    env = dict(os.environ, BRIDGE_OUTDIR=dirs["spool"], BRIDGE_LOGDIR=dirs["logs"], BRIDGE_PIDDIR=dirs["pids"],
+               BRIDGE_READYFILE=os.path.join(dirs["pids"], "console_bridge.ready"), API_PORT=str(port),
+               BRIDGE_INDEX="off", BRIDGE_SUBMIT_DB="off", BRIDGE_JOBSTATE="off",
+               BRIDGE_EVENTS_SOCKET="off", BRIDGE_METRICS_SOCKET="off")
+    here = os.path.dirname(os.path.abspath(__file__))
+    log = open(os.path.join(dirs["logs"], "api.out"), "wb")
+    api = subprocess.Popen([sys.executable, os.path.join(here, "api", "app.py")], cwd=here, env=env,
+                           stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not _wait_http(port, "/health", 30):
+            sys.exit("API did not start; see %s" % dirs["logs"])
+        stop = threading.Event()
+        health, spools, errors = [], [], []
+        threads = [threading.Thread(target=_get_loop, args=(port, "/health", stop, health, 1 / args.health_rps, errors))]
+        threads += [threading.Thread(target=_get_loop, args=(port, "/spools?limit=%d" % args.limit, stop, spools, 0, errors))
+                    for _ in range(args.spools_clients)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        api.terminate()
+        api.wait(10)
+    ms = lambda v, p: round((_pct(v, p) or 0) * 1e3, 2)
+    result = {"version": _git_version(), "files": args.files, "spools_clients": args.spools_clients,
+              "health_n": len(health), "health_p50_ms": ms(health, 50), "health_p99_ms": ms(health, 99),
+              "health_max_ms": round(max(health, default=0) * 1e3, 2),
+              "spools_rps": round(len(spools) / args.seconds, 1), "spools_p50_ms": ms(spools, 50),
+              "spools_p99_ms": ms(spools, 99), "errors": len(errors)}
+    print(json.dumps(result))
+
+
+def bench_e2e(args):
+    """console_bridge + console_watch + API as subprocesses, fed by sockdev_sim."""
+    import sockdev_sim
+    work = tempfile.mkdtemp(prefix="e2e-", dir=_TMP)
+    dirs = {k: os.path.join(work, k) for k in ("spool", "logs", "pids")}
+    for d in dirs.values():
+        os.makedirs(d)
+    sim = sockdev_sim.Simulator(printer_port=0, console_port=0, jobs=args.jobs, rate=args.rate,
+                                job_size=args.job_size, codepage=args.codepage, burst=args.burst,
+                                burst_gap=args.burst_gap, mbps=args.mbps, chunk=args.chunk, seed=args.seed)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(sim.start(), loop).result()
+    api_port = _free_port()
+    env = dict(os.environ, BRIDGE_OUTDIR=dirs["spool"], BRIDGE_LOGDIR=dirs["logs"], BRIDGE_PIDDIR=dirs["pids"],
+               BRIDGE_READYFILE=os.path.join(dirs["pids"], "console_bridge.ready"),
+               BRIDGE_PORT=str(sim.printer_port), CONSOLE_PORT=str(sim.console_port), API_PORT=str(api_port),
+               BRIDGE_EVENTS_SOCKET=os.path.join(dirs["pids"], "events.sock"),
+               BRIDGE_METRICS_SOCKET=os.path.join(dirs["pids"], "metrics.sock"),
+               BRIDGE_CODEPAGE=args.codepage if args.codepage != "ascii" else "auto")
+    here = os.path.dirname(os.path.abspath(__file__))
+    procs = []
+
+    def spawn(name, *cmd):
+        log = open(os.path.join(dirs["logs"], name + ".out"), "wb")
+        procs.append(subprocess.Popen([sys.executable, *cmd], cwd=here, env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    load = None
+    try:
+        spawn("api", os.path.join(here, "api", "app.py"))
+        if not _wait_http(api_port, "/health", 30):
+            sys.exit("API did not start; see %s" % dirs["logs"])
+        spawn("console_watch", "console_watch.py")
+        spawn("console_bridge", "console_bridge.py")
+        load = ApiLoad(api_port, args.api_rps, args.api_clients)
+        load.start()
+        t0 = time.time()
+        manifest = asyncio.run_coroutine_threadsafe(sim.run(wait_console=True), loop).result()
+        sent = time.time() - t0
+        index_path = os.path.join(dirs["spool"], "jobindex.db")
+        deadline = time.time() + args.timeout
+        while len(done := _extracted(index_path)) < len(manifest) and time.time() < deadline:
+            time.sleep(0.2)
+        load.stop.set()
+        load.join()
+        lifecycle = {}
+        conn = http.client.HTTPConnection("127.0.0.1", api_port, timeout=10)
+        conn.request("GET", "/jobs/stats")
+        lifecycle = json.loads(conn.getresponse().read())
+    finally:
+        if load is not None:
+            load.stop.set()
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        asyncio.run_coroutine_threadsafe(sim.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    total = sum(e["bytes"] for e in manifest)
+    lat = [done[e["jobid"]] - e["sent_end"] for e in manifest if e["jobid"] in done]
+    first = manifest[0]["sent_start"] if manifest else t0
+    last = max(done.values()) if done else time.time()
+    window = max(last - first, 1e-9)
+    api = {route: {"n": len(v), "p50_ms": round((_pct(v, 50) or 0) * 1e3, 2), "p99_ms": round((_pct(v, 99) or 0) * 1e3, 2)}
+           for route, v in load.latency.items()}
+    result = {
+        "version": _git_version(), "ts": time.time(),
+        "params": {k: getattr(args, k) for k in ("jobs", "rate", "job_size", "codepage", "burst", "burst_gap", "mbps",
+                                                 "chunk", "api_rps", "api_clients")},
+        "jobs_sent": len(manifest), "jobs_extracted": len(lat), "bytes": total, "send_seconds": round(sent, 3),
+        "mb_per_s": round(total / window / 1e6, 3), "jobs_per_s": round(len(lat) / window, 2),
+        "extract_p50_ms": round((_pct(lat, 50) or 0) * 1e3, 2), "extract_p99_ms": round((_pct(lat, 99) or 0) * 1e3, 2),
+        "api_p99_ms": max((r["p99_ms"] for r in api.values()), default=0), "api": api, "api_errors": load.errors,
+        "console_joined": lifecycle.get("stages", {}).get("total", {}).get("count"),
+    }
+    print("version %s: %d/%d jobs, %.1f MB in %.1fs" % (result["version"], len(lat), len(manifest), total / 1e6, window))
+    print("  sustained %.2f MB/s, %.1f jobs/s; extraction latency p50 %.1f ms, p99 %.1f ms" % (
+        result["mb_per_s"], result["jobs_per_s"], result["extract_p50_ms"], result["extract_p99_ms"]))
+    for route, r in api.items():
+        print("  API %-8s %6d req  p50 %7.2f ms  p99 %7.2f ms" % (route, r["n"], r["p50_ms"], r["p99_ms"]))
+    print("  jobs joined console+printer: %s, API errors: %d" % (result["console_joined"], load.errors))
+
+    regressions = []
+    previous = []
+    if os.path.exists(args.results):
+        with open(args.results) as f:
+            previous = [r for r in map(json.loads, f) if r.get("params") == result["params"]]
+    if previous:
+        prev = previous[-1]
+        print("compared with %s:" % prev["version"])
+        for key, better in (("mb_per_s", 1), ("jobs_per_s", 1), ("extract_p99_ms", -1), ("api_p99_ms", -1)):
+            old, new = prev.get(key) or 0, result[key]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change * better < -args.tolerance
+            print("  %-15s %10.2f -> %10.2f  %+6.1f%%%s" % (key, old, new, change, "  REGRESSION" if worse else ""))
+            if worse:
+                regressions.append(key)
+    with open(args.results, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    if len(lat) < len(manifest):
+        print("%d job(s) not extracted within %ss (logs in %s)" % (len(manifest) - len(lat), args.timeout, dirs["logs"]))
+        sys.exit(1)
+    if regressions:
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("extractor", help="JobLogExtractor.feed throughput by chunk and job size")
+    p.add_argument("--chunk-sizes", default="64,512,4096,65536,1048576")
+    p.add_argument("--job-sizes", default="4096,65536,1048576")
+    p.add_argument("--total", type=int, default=16 * 1024 * 1024, help="bytes of stream per job size")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--codepage", default="ascii", help="encode the stream with this codec (e.g. cp037)")
+    p.set_defaults(func=bench_extractor)
+
+    p = sub.add_parser("replay", help="replay a raw dump at random chunk sizes and check the extraction never changes")
+    p.add_argument("--input", nargs="*", help="captured console_bridge-raw*.bin files, oldest first")
+    p.add_argument("--total", type=int, default=8 * 1024 * 1024, help="synthetic bytes without --input")
+    p.add_argument("--job-size", type=int, default=65536)
+    p.add_argument("--codepage", default="auto")
+    p.add_argument("--chunk-sizes", default="1,7,64,4096,65536,1048576,random",
+                   help="fixed sizes and/or 'random' (each chunk 1 B..1 MiB, log-uniform)")
+    p.add_argument("--seeds", type=int, default=5, help="random replays")
+    p.add_argument("--max-feeds", type=int, default=1000000,
+                   help="replay only a prefix of size * max-feeds bytes for tiny chunks (0 = whole input)")
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser("daemon", help="bridge_daemon load test against local fake sockdev printers")
+    p.add_argument("--printers", type=int, default=4)
+    p.add_argument("--total", type=int, default=32 * 1024 * 1024, help="bytes sent by each printer")
+    p.add_argument("--job-size", type=int, default=65536)
+    p.add_argument("--chunk", type=int, default=4096, help="bytes per sockdev write")
+    p.set_defaults(func=bench_daemon)
+
+    p = sub.add_parser("recv", help="printer receive loop: recv() per chunk vs recv_into the buffer pool")
+    p.add_argument("--total", type=int, default=128 * 1024 * 1024)
+    p.add_argument("--job-size", type=int, default=65536)
+    p.add_argument("--chunk", type=int, default=65536, help="bytes per sockdev write")
+    p.add_argument("--consumer", choices=("copy", "session"), default="copy",
+                   help="copy the chunk like the writers do, or feed a real SpoolSession")
+    p.add_argument("--log-level", default="WARNING", help="console_bridge log level during the run (INFO to include logging)")
+    p.set_defaults(func=bench_recv)
+
+    p = sub.add_parser("console", help="console_watch line splitting and message parsing throughput")
+    p.add_argument("--lines", type=int, default=200000)
+    p.add_argument("--chunk", type=int, default=65536, help="bytes per console read")
+    p.set_defaults(func=bench_console)
+
+    p = sub.add_parser("writer", help="spool_writer throughput and commit latency per flush policy")
+    p.add_argument("--count", type=int, default=20000, help="writes per policy")
+    p.add_argument("--chunk", type=int, default=4096)
+    p.add_argument("--flush-ms", type=int, default=100)
+    p.add_argument("--fsync", action="store_true", help="also measure fsync'd policies")
+    p.set_defaults(func=bench_writer)
+
+    p = sub.add_parser("archive", help="spool_archive compression ratio, write speed and random read latency")
+    p.add_argument("--input", help="real printer output to archive (e.g. a spool or raw dump file)")
+    p.add_argument("--total", type=int, default=32 * 1024 * 1024, help="synthetic bytes without --input")
+    p.add_argument("--job-size", type=int, default=65536)
+    p.add_argument("--codecs", default="zlib,lzma,none")
+    p.add_argument("--chunk-kb", default="64,256,1024")
+    p.add_argument("--reads", type=int, default=200, help="random 4 KiB reads per configuration")
+    p.set_defaults(func=bench_archive)
+
+    p = sub.add_parser("api", help="/health p50/p99 while /spools lists a big OUTDIR under concurrent load")
+    p.add_argument("--files", type=int, default=20000, help="job files created in OUTDIR")
+    p.add_argument("--spools-clients", type=int, default=8, help="concurrent closed-loop /spools clients")
+    p.add_argument("--limit", type=int, default=200, help="/spools page size")
+    p.add_argument("--health-rps", type=float, default=20)
+    p.add_argument("--seconds", type=float, default=15)
+    p.set_defaults(func=bench_api)
+
+    p = sub.add_parser("e2e", help="console_bridge, console_watch and the API against sockdev_sim; compares versions")
+    p.add_argument("--jobs", type=int, default=500)
+    p.add_argument("--rate", type=float, default=0, help="jobs/s sent by the simulator (0 = as fast as read)")
+    p.add_argument("--job-size", default="2048-262144", help="N or MIN-MAX bytes (log-uniform)")
+    p.add_argument("--codepage", default="ascii")
+    p.add_argument("--burst", type=int, default=1)
+    p.add_argument("--burst-gap", type=float, default=0)
+    p.add_argument("--mbps", type=float, default=0, help="printer bandwidth cap (0 = none)")
+    p.add_argument("--chunk", type=int, default=65536, help="bytes per simulated sockdev write")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--api-rps", type=float, default=50, help="API requests/s during the run")
+    p.add_argument("--api-clients", type=int, default=4)
+    p.add_argument("--timeout", type=float, default=120, help="seconds to wait for the extraction after sending")
+    p.add_argument("--results", default="bench-results.jsonl",
+                   help="results of every run (JSON lines); the last run with the same parameters is the baseline")
+    p.add_argument("--tolerance", type=float, default=10, help="percent change reported as a regression")
+    p.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""asyncio bridge daemon: one process serving several Hercules sockdev endpoints.
+
+``BRIDGE_ENDPOINTS`` is a comma separated list of ``[name=]host:port[/kind]``
+entries, ``kind`` being ``printer`` (default) or ``console`` for the hardcopy
+log that ``console_watch.py`` reads, e.g.::
+
+    BRIDGE_ENDPOINTS="127.0.0.1:5000,prt2=127.0.0.1:5001,127.0.0.1:5002/console"
+
+Every printer connection gets its own ``SpoolSession`` (and so its own
+``JobLogExtractor``); a printer without a name keeps the historical file names
+when it is ``BRIDGE_PORT`` and is named after its port otherwise. All disk work
+runs on a single writer thread behind a bounded queue, so a slow disk stops the
+readers (and Hercules, through TCP) instead of growing memory. Readers
+``recv_into`` buffers of a shared ``console_bridge.BufferPool`` and the writer
+thread returns each buffer to the pool once its chunk was handled.
+"""
+import asyncio, os, collections
+from concurrent.futures import ThreadPoolExecutor
+
+import console_bridge
+import metrics
+import retention
+import supervisor
+from console_bridge import logger, SpoolSession, write_pid, remove_stale_temp
+
+ENDPOINTS = os.environ.get("BRIDGE_ENDPOINTS", f"{console_bridge.HOST}:{console_bridge.PORT}")
+# Chunks queued for the writer thread before readers are paused
+QUEUE_CHUNKS = int(os.environ.get("BRIDGE_QUEUE_CHUNKS", "256"))
+# Chunks handed to the writer thread per executor round trip
+WRITER_BATCH = 64
+
+Endpoint = collections.namedtuple("Endpoint", "name host port kind")
+
+
+def parse_endpoints(spec: str):
+    """Parse ``BRIDGE_ENDPOINTS`` into a list of ``Endpoint``."""
+    out = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, addr = item.rpartition("=")
+        addr, _, kind = addr.partition("/")
+        host, _, port = addr.rpartition(":")
+        kind = kind or "printer"
+        if kind not in ("printer", "console") or not host or not port.isdigit():
+            raise ValueError(f"bad endpoint {item!r}; expected [name=]host:port[/printer|console]")
+        port = int(port)
+        if not name and kind == "printer" and port != console_bridge.PORT:
+            name = str(port)
+        out.append(Endpoint(name, host, port, kind))
+    return out
+
+
+class ConsoleSession:
+    """Splits a hardcopy console stream into lines for ``console_watch.handle_line``."""
+
+    def __init__(self):
+        import console_watch
+        self.handle_line = console_watch.handle_line
+        self.splitter = console_watch.LineSplitter()
+
+    def handle(self, data: bytes):
+        for line in self.splitter.feed(data):
+            self.handle_line(line)
+
+    def tick(self):
+        pass
+
+    def close(self):
+        for line in self.splitter.close():
+            self.handle_line(line)
+
+
+class SharedWriter:
+    """Single writer thread shared by every stream, fed through a bounded queue.
+
+    Items are ``(session, data, buf)``; ``data=None`` closes the session and
+    ``data=b""`` is an idle tick (``session.tick()``). ``data`` is a view of
+    the pool buffer ``buf``, given back to ``pool`` after ``session.handle``.
+    Ordering is preserved per stream because one thread processes the queue
+    in order.
+    """
+
+    def __init__(self, maxsize=QUEUE_CHUNKS, batch=WRITER_BATCH, pool=None):
+        self.queue = asyncio.Queue(maxsize)
+        self.batch = batch
+        self.pool = pool or console_bridge.BufferPool()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bridge-writer")
+        # Deepest queue seen; equal to maxsize means readers were paused
+        self.high_water = 0
+
+    async def open(self, factory):
+        """Create a session on the writer thread (it opens files)."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, factory)
+
+    async def put(self, session, data, buf=None):
+        await self.queue.put((session, data, buf))
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await loop.run_in_executor(self.executor, self._process, batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _process(self, batch):
+        for session, data, buf in batch:
+            try:
+                if data is None:
+                    session.close()
+                elif not data:
+                    session.tick()
+                else:
+                    session.handle(data)
+            except Exception:
+                logger.exception("writer error")
+            finally:
+                if buf is not None:
+                    data.release()
+                    self.pool.put(buf)
+
+    async def close(self):
+        await self.queue.join()
+        self.executor.shutdown(wait=True)
+
+
+def session_factory(ep: Endpoint):
+    if ep.kind == "console":
+        return ConsoleSession
+    return lambda: SpoolSession(name=ep.name)
+
+
+async def serve_endpoint(ep: Endpoint, writer: SharedWriter, reconnect=True):
+    """Connect to one sockdev and pump its stream into the shared writer."""
+    factory = session_factory(ep)
+    loop = asyncio.get_running_loop()
+    pool = writer.pool
+    while True:
+        conn = console_bridge.open_sockdev(ep.host, ep.port, blocking=False)
+        try:
+            await loop.sock_connect(conn, (ep.host, ep.port))
+        except OSError:
+            conn.close()
+            # no hay spool aún, reintenta
+            await asyncio.sleep(0.5)
+            continue
+        logger.info("Connected to %s endpoint %s:%s%s", ep.kind, ep.host, ep.port, f" ({ep.name})" if ep.name else "")
+        supervisor.notify("READY", endpoint=f"{ep.host}:{ep.port}")
+        try:
+            session = await writer.open(factory)
+            size = console_bridge.RecvSize(pool.sizes)
+            try:
+                while True:
+                    buf = pool.get(size.size)
+                    try:
+                        n = await asyncio.wait_for(loop.sock_recv_into(conn, buf), console_bridge.IDLE_TICK_SECONDS)
+                    except asyncio.TimeoutError:
+                        pool.put(buf)
+                        # idle stream: let the session close jobs whose END never came
+                        await writer.put(session, b"")
+                        continue
+                    except BaseException:
+                        pool.put(buf)
+                        raise
+                    if not n:
+                        pool.put(buf)
+                        break
+                    size.update(n)
+                    # the writer thread hands buf back to the pool after handling it
+                    await writer.put(session, memoryview(buf)[:n], buf)
+            finally:
+                await writer.put(session, None)
+        except Exception:
+            logger.exception("Unhandled exception on %s:%s; reconnecting", ep.host, ep.port)
+        finally:
+            conn.close()
+        if not reconnect:
+            return
+        await asyncio.sleep(0.2)  # espera breve antes del próximo spool
+
+
+async def serve(endpoints, reconnect=True):
+    """Serve every endpoint until cancelled (or until all close, without ``reconnect``)."""
+    writer = SharedWriter()
+    writer_task = asyncio.create_task(writer.run())
+    try:
+        await asyncio.gather(*(serve_endpoint(ep, writer, reconnect) for ep in endpoints))
+        await writer.close()
+    finally:
+        writer_task.cancel()
+    return writer
+
+
+def main():
+    write_pid()
+    metrics.start_pusher("bridge_daemon")
+    endpoints = parse_endpoints(ENDPOINTS)
+    remove_stale_temp(console_bridge.OUTDIR)
+    retention.start(console_bridge.get_job_index(), console_bridge.OUTDIR)
+    logger.info("Starting bridge daemon for %d endpoint(s): %s", len(endpoints),
+                ", ".join(f"{ep.host}:{ep.port}/{ep.kind}" for ep in endpoints))
+    asyncio.run(serve(endpoints))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Logging setup shared by console_bridge and console_watch.
+
+``setup`` gives a logger its usual stderr and rotating file handlers. With
+``BRIDGE_LOG_MODE=queue`` (default) the logger only puts records on a
+bounded queue and a ``QueueListener`` thread formats and writes them, so a
+slow disk or terminal never stalls the receive loop; a full queue drops the
+record instead of blocking. ``sync`` writes from the calling thread as before.
+
+Records pass a per-level token bucket first (``BRIDGE_LOG_RATE``, lines/s;
+ERROR and above are never limited unless listed). Hot paths do not log per
+chunk: they add to ``SUMMARY`` and one line per ``BRIDGE_LOG_SUMMARY``
+seconds reports the totals, plus the records suppressed or dropped.
+
+``BRIDGE_LOG_FORMAT=json`` writes one JSON object per line (``ts``,
+``level``, ``logger``, ``msg``, ``exc``, and any ``extra`` fields).
+"""
+import os, json, time, queue, atexit, logging, threading, collections
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# "queue" (asíncrono) o "sync"
+MODE = os.environ.get("BRIDGE_LOG_MODE", "queue").lower()
+# "text" o "json"
+FORMAT = os.environ.get("BRIDGE_LOG_FORMAT", "text").lower()
+# Records waiting for the writer thread; beyond that they are dropped
+QUEUE_SIZE = int(os.environ.get("BRIDGE_LOG_QUEUE", "10000"))
+# LEVEL=lines/s, comma separated; "off" disables rate limiting
+RATE = os.environ.get("BRIDGE_LOG_RATE", "DEBUG=200,INFO=200,WARNING=50")
+# Seconds between summary lines (0 = no summaries)
+SUMMARY_SECONDS = float(os.environ.get("BRIDGE_LOG_SUMMARY", "5"))
+# "0" when stdout/stderr already go to the log file (supervisor.py redirects helpers' output)
+STDERR = os.environ.get("BRIDGE_LOG_STDERR", "1") != "0"
+
+TEXT_FORMAT = logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%Y-%m-%dT%H:%M:%S")
+# LogRecord attributes that are not ``extra`` fields
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+               "msg": record.getMessage()}
+        for k, v in vars(record).items():
+            if k not in _RECORD_FIELDS:
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+
+def parse_rate(spec):
+    """``"INFO=100,WARNING=20"`` -> ``{logging.INFO: 100.0, logging.WARNING: 20.0}``."""
+    rates = {}
+    if spec.strip().lower() in ("", "off", "0"):
+        return rates
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if not isinstance(level, int) or not value:
+            raise ValueError(f"bad BRIDGE_LOG_RATE entry {item!r}; expected LEVEL=lines_per_second")
+        rates[level] = float(value)
+    return rates
+
+
+class RateLimit(logging.Filter):
+    """Token bucket per level: up to ``rate`` records/s, bursts of one second's worth."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.tokens = dict(rates)
+        self.last = {level: time.monotonic() for level in rates}
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if rate is None or getattr(record, "summary", False):
+            return True
+        now = time.monotonic()
+        tokens = min(rate, self.tokens[record.levelno] + (now - self.last[record.levelno]) * rate)
+        self.last[record.levelno] = now
+        if tokens < 1:
+            self.tokens[record.levelno] = tokens
+            SUMMARY.add(f"suppressed {record.levelname}")
+            return False
+        self.tokens[record.levelno] = tokens - 1
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full, never blocking."""
+
+    def prepare(self, record):
+        # same process: the listener formats the record, nothing to pickle
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            SUMMARY.add("dropped log records")
+
+
+class Summary:
+    """Counters added on hot paths and reported as one log line per interval.
+
+    ``add`` is a dict update; the reporting thread swaps the dict, so an
+    increment racing with the swap may land in the next interval.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.formatters = {}
+        self.loggers = []
+        self.thread = None
+        self.started = time.monotonic()
+
+    def add(self, key, n=1):
+        self.counts[key] += n
+
+    def format(self, key, fn):
+        """Render counter ``key`` with ``fn(value)`` (e.g. bytes as MB)."""
+        self.formatters[key] = fn
+
+    def report(self):
+        counts, self.counts = self.counts, collections.Counter()
+        now = time.monotonic()
+        elapsed, self.started = now - self.started, now
+        if not counts:
+            return None
+        parts = [self.formatters[k](v) if k in self.formatters else f"{v} {k}" for k, v in counts.items()]
+        return "last %.0fs: %s" % (elapsed, ", ".join(parts))
+
+    def _run(self):
+        while True:
+            time.sleep(SUMMARY_SECONDS)
+            line = self.report()
+            if line:
+                for logger in self.loggers:
+                    logger.info(line, extra={"summary": True})
+
+    def start(self, logger):
+        self.loggers.append(logger)
+        if self.thread is None and SUMMARY_SECONDS > 0:
+            self.thread = threading.Thread(target=self._run, name="log-summary", daemon=True)
+            self.thread.start()
+
+
+SUMMARY = Summary()
+_listeners = []
+
+
+def setup(name, path, max_bytes, backups, level=logging.INFO):
+    """Configure logger ``name`` (stderr and rotating ``path``) once; returns it."""
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+    logger.setLevel(level)
+    fmt = JsonFormatter() if FORMAT == "json" else TEXT_FORMAT
+    handlers = [RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")]
+    if STDERR:
+        handlers.append(logging.StreamHandler())
+    for h in handlers:
+        h.setFormatter(fmt)
+    if MODE == "queue":
+        qh = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+        listener = QueueListener(qh.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+        handlers = [qh]
+    for h in handlers:
+        logger.addHandler(h)
+    rates = parse_rate(RATE)
+    if rates:
+        # en el logger: un solo bucket por nivel, antes de encolar
+        logger.addFilter(RateLimit(rates))
+    # un solo hilo de resumen por proceso, que escribe en el primer logger configurado
+    if not SUMMARY.loggers:
+        SUMMARY.start(logger)
+    return logger
+
+
+@atexit.register
+def _flush():
+    """Write what is still queued before the process exits."""
+    line = SUMMARY.report() if SUMMARY.loggers else None
+    if line:
+        SUMMARY.loggers[0].info(line, extra={"summary": True})
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
@@ -1,5 +1,14 @@
-import socket, time, datetime, os, logging, re
-from logging.handlers import RotatingFileHandler
+import socket, time, datetime, os, logging, re, codecs, functools, collections, itertools
+
+import spool_writer
+import spool_archive
+import jobindex
+import joblayout
+import retention
+import events
+import metrics
+import supervisor
+import bridge_log
 
 HOST = os.environ.get("BRIDGE_HOST", "127.0.0.1")   # Hercules escucha aquí
 PORT = int(os.environ.get("BRIDGE_PORT", "5000"))
@@ -8,23 +17,37 @@ LOGDIR = os.environ.get("BRIDGE_LOGDIR", "/app/logs")
 READY_FILE = os.environ.get("BRIDGE_READYFILE", "/app/pids/console_bridge.ready")
 PIDDIR = os.environ.get("BRIDGE_PIDDIR", "/app/pids")
 PID_FILE = os.environ.get("BRIDGE_PIDFILE", os.path.join(PIDDIR, "console_bridge.pid"))
+# Spool completo: "archive" (segmentos comprimidos, ver spool_archive.py) o "bin" (spool_YYYYMMDD.bin)
+SPOOL_FORMAT = os.environ.get("BRIDGE_SPOOL_FORMAT", "archive")
+# Raw dump rotation: size of console_bridge-raw.bin before it rolls to .1.bin (0 = unbounded)
+RAW_MAX_BYTES = int(os.environ.get("BRIDGE_RAW_MAX_MB", "256")) * 1024 * 1024
+RAW_BACKUPS = int(os.environ.get("BRIDGE_RAW_BACKUPS", "2"))
+# Job bytes held in memory while the JOBID is unknown; beyond that they spill to a temp file
+MAX_PENDING = int(os.environ.get("BRIDGE_MAX_PENDING_KB", "1024")) * 1024
+# A job still without JOBID after this many spilled bytes is abandoned (0 = never)
+MAX_SPILL = int(os.environ.get("BRIDGE_MAX_SPILL_MB", "64")) * 1024 * 1024
+# A job with no new data for this long is closed as truncated (lost END; 0 = never)
+JOB_IDLE_SECONDS = float(os.environ.get("BRIDGE_JOB_IDLE_SECONDS", "300"))
+# How often idle connections check JOB_IDLE_SECONDS
+IDLE_TICK_SECONDS = 30
+# "auto" detecta ASCII/EBCDIC una vez por conexión; también "ascii" o un codec EBCDIC (cp037, cp500, ...)
+CODEPAGE = os.environ.get("BRIDGE_CODEPAGE", "auto")
+# Largest recv_into per call; the size adapts between RECV_MIN and this (see RecvSize)
+RECV_SIZE = int(os.environ.get("BRIDGE_RECV_SIZE", "65536"))
+RECV_MIN = min(4096, RECV_SIZE)
+# Kernel receive buffer requested for sockdev connections (0 = system default)
+SO_RCVBUF = int(os.environ.get("BRIDGE_SO_RCVBUF", str(2 * RECV_SIZE)))
 
 os.makedirs(PIDDIR, exist_ok=True)
 
 os.makedirs(OUTDIR, exist_ok=True)
 os.makedirs(LOGDIR, exist_ok=True)
 
-# logger
-logger = logging.getLogger("console_bridge")
-if not logger.handlers:
-    logger.setLevel(logging.INFO)
-    fmt = logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%Y-%m-%dT%H:%M:%S")
-    sh = logging.StreamHandler()
-    sh.setFormatter(fmt)
-    fh = RotatingFileHandler(os.path.join(LOGDIR, "console_bridge.log"), maxBytes=2*1024*1024, backupCount=3, encoding="utf-8")
-    fh.setFormatter(fmt)
-    logger.addHandler(sh)
-    logger.addHandler(fh)
+# logger (queue-based by default, see bridge_log.py)
+logger = bridge_log.setup("console_bridge", os.path.join(LOGDIR, "console_bridge.log"), 2*1024*1024, 3)
+# per-chunk and per-job activity goes into the periodic summary line instead
+SUMMARY = bridge_log.SUMMARY
+SUMMARY.format("bytes received", lambda n: "%.1f MB received" % (n / 1e6))
 
 
 def sanitize_filename_component(s: str) -> str:
@@ -43,20 +66,160 @@ def sanitize_filename_component(s: str) -> str:
     return sanitized[:64]
 
 
-def unique_path(path: str) -> str:
-    """Return a path that does not already exist by appending -1, -2, ... if needed.
+def job_filename(jobid, jobname, rc=None) -> str:
+    """Joblog file name: ``JOBID-JOBNAME.txt``, with ``-RCxxxx`` once the RC is known."""
+    safe_jobname = sanitize_filename_component(jobname)
+    if rc:
+        return f"{jobid}-{safe_jobname}-RC{rc}.txt"
+    return f"{jobid}-{safe_jobname}.txt"
+
+
+# Temp files of jobs in progress: dot-prefixed, so no JOB* listing or glob sees them
+_temp_seq = itertools.count()
+TEMP_RE = re.compile(r"^\.job-(\d+)-\d+\.part$")
+
+
+def temp_job_path(outdir: str) -> str:
+    return os.path.join(outdir, f".job-{os.getpid()}-{next(_temp_seq)}.part")
+
+
+def remove_stale_temp(outdir: str) -> int:
+    """Delete job temp files left by bridge processes that are gone (crash, kill)."""
+    removed = 0
+    with os.scandir(outdir) as it:
+        for entry in it:
+            m = TEMP_RE.match(entry.name)
+            if not m or int(m.group(1)) == os.getpid():
+                continue
+            try:
+                os.kill(int(m.group(1)), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                # vivo, de otro usuario
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                continue
+    if removed:
+        logger.warning("Removed %d unfinished job file(s) left in %s", removed, outdir)
+    return removed
+
+
+def _codec_available(name: str) -> bool:
+    try:
+        codecs.lookup(name)
+        return True
+    except LookupError:
+        return False
+
+
+# EBCDIC codepages tried by auto-detection, in order (cp1047 is not shipped by every Python)
+EBCDIC_CODEPAGES = tuple(cp for cp in ("cp037", "cp1047", "cp500") if _codec_available(cp))
+# Bytes sampled before deciding ASCII vs EBCDIC when no START marker shows up
+DETECT_SAMPLE = 64 * 1024
+# Longest whitespace run (and job number) accepted inside a marker. Bounding
+# them bounds every marker, so JobLogExtractor.OVERLAP can always hold one
+# that ``recv`` cut in two and the result never depends on chunk sizes.
+MARKER_SPACE = 32
+MARKER_DIGITS = 9
+
+
+@functools.lru_cache(maxsize=None)
+def ebcdic_markers(codepage: str):
+    """Return the extractor marker regexes pre-encoded for an EBCDIC codepage.
 
-    Keeps the original extension when adding the suffix.
+    The ASCII patterns use ``\\s``, ``\\d`` and ASCII character classes, so each
+    piece is rebuilt from its characters encoded in ``codepage``. Returns
+    ``(start_re, end_re, jobid_re, rc_re, table)`` where ``table`` is a
+    ``bytes.translate`` table mapping the codepage to ASCII (EBCDIC NL becomes
+    LF, anything outside ASCII becomes '?').
     """
-    if not os.path.exists(path):
-        return path
-    base, ext = os.path.splitext(path)
-    i = 1
-    while True:
-        candidate = f"{base}-{i}{ext}"
-        if not os.path.exists(candidate):
-            return candidate
-        i += 1
+    def lit(s):
+        return re.escape(s.encode(codepage))
+
+    def cls(chars):
+        return b"[" + b"".join(re.escape(bytes([b])) for b in sorted(set(chars.encode(codepage)))) + b"]"
+
+    space = cls(" \t\n\r\f\v\x85")
+    ws = space + b"{1,%d}" % MARKER_SPACE
+    ws0 = space + b"{0,%d}" % MARKER_SPACE
+    digits = cls("0123456789") + b"+"
+    start_re = re.compile(lit("****A") + ws + lit("START") + ws + lit("JOB") + ws
+                          + cls("0123456789") + b"{1,%d}" % MARKER_DIGITS + ws
+                          + b"(" + cls("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789#@$") + b"+)")
+    end_re = re.compile(lit("****A") + ws + lit("END"))
+    jobid_re = re.compile(lit("JES2.") + b"(" + lit("JOB") + digits + b")")
+    rc_re = re.compile(lit("RC=") + ws0 + b"(" + cls("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789") + b"{4})")
+
+    decoded = bytes(range(256)).decode(codepage).replace("\x85", "\n")
+    table = "".join(c if ord(c) < 128 else "?" for c in decoded).encode("ascii")
+    return start_re, end_re, jobid_re, rc_re, table
+
+
+def detect_codepage(sample: bytes, final: bool = False):
+    """Decide whether a printer stream is ASCII or EBCDIC from its first bytes.
+
+    Returns "ascii", one of ``EBCDIC_CODEPAGES`` or None while undecided. A START
+    marker settles it; otherwise, once ``DETECT_SAMPLE`` bytes were seen (or
+    with ``final``), the most frequent space byte (0x20 vs 0x40) decides.
+    """
+    if JobLogExtractor.START_PATTERN_RE.search(sample):
+        M_CODEPAGE.labels("ascii", "marker").inc()
+        return "ascii"
+    for cp in EBCDIC_CODEPAGES:
+        if ebcdic_markers(cp)[0].search(sample):
+            M_CODEPAGE.labels(cp, "marker").inc()
+            return cp
+    if len(sample) < DETECT_SAMPLE and not final:
+        return None
+    # sin marcador: se decide por el byte de espacio más frecuente
+    cp = EBCDIC_CODEPAGES[0] if EBCDIC_CODEPAGES and sample.count(b"\x40") > sample.count(b"\x20") else "ascii"
+    M_CODEPAGE.labels(cp, "fallback").inc()
+    return cp
+
+
+# How often each extractor limit fired (process-wide)
+EXTRACTOR_STATS = collections.Counter()
+
+# Metrics (see metrics.py; served by the API at /metrics)
+M_RECEIVED = metrics.counter("bridge_received_bytes_total", "Bytes received from printer sockdevs", ("printer",))
+M_RECV_SIZE = metrics.histogram("bridge_recv_size_bytes", "Size of each chunk received from a printer",
+                                ("printer",), buckets=metrics.SIZE_BUCKETS)
+M_RECV_BUFFERS = metrics.counter("bridge_recv_buffers_allocated_total",
+                                 "Receive buffers allocated (a recycled buffer is not counted again)")
+M_EXTRACT = metrics.histogram("bridge_extractor_seconds", "JobLogExtractor time per received chunk")
+M_JOBS_STARTED = metrics.counter("bridge_jobs_started_total", "START separators seen")
+M_JOBS_ENDED = metrics.counter("bridge_jobs_ended_total", "Jobs closed (END, idle timeout or connection closed)")
+M_RENAME_FAILURES = metrics.counter("bridge_rename_failures_total", "Joblogs that could not be published under their final name")
+M_CODEPAGE = metrics.counter("bridge_codepage_detections_total",
+                             "Printer stream codepage decisions, by a START marker or by the space byte fallback",
+                             ("codepage", "method"))
+M_LIMITS = metrics.counter("bridge_extractor_limits_total", "Extractor memory and idle limits hit (see EXTRACTOR_STATS)",
+                           ("limit",))
+
+
+def count_limit(limit, n=1):
+    EXTRACTOR_STATS[limit] += n
+    M_LIMITS.labels(limit).inc(n)
+
+_job_index = None
+
+
+def get_job_index():
+    """Shared ``jobindex.JobIndex`` for this process (None if disabled or unusable)."""
+    global _job_index
+    if _job_index is None and jobindex.INDEX_PATH.lower() != "off":
+        try:
+            _job_index = jobindex.open_index()
+        except Exception:
+            logger.exception("Failed to open job index %s; continuing without it", jobindex.INDEX_PATH)
+            jobindex.INDEX_PATH = "off"
+    return _job_index
+
 
 def write_pid():
     try:
@@ -76,24 +239,161 @@ def write_ready():
     except Exception:
         logger.exception("Failed to write ready file %s", READY_FILE)
 
+def open_sockdev(host, port, blocking=True):
+    """TCP socket to a sockdev with ``SO_RCVBUF`` applied (before connecting, so
+    the window scale is negotiated for it). Non-blocking sockets are returned
+    unconnected, for ``loop.sock_connect``."""
+    s = socket.socket()
+    if SO_RCVBUF:
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SO_RCVBUF)
+        except OSError:
+            logger.exception("Failed to set SO_RCVBUF=%d", SO_RCVBUF)
+    logger.debug("SO_RCVBUF for %s:%s: %d (asked %d)", host, port,
+                 s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), SO_RCVBUF)
+    if blocking:
+        try:
+            s.connect((host, port))
+        except BaseException:
+            s.close()
+            raise
+    else:
+        s.setblocking(False)
+    return s
+
+
+def recv_sizes(lo=RECV_MIN, hi=RECV_SIZE):
+    """Receive size classes: ``lo`` doubling up to ``hi``."""
+    sizes = [lo]
+    while sizes[-1] < hi:
+        sizes.append(min(sizes[-1] * 2, hi))
+    return sizes
+
+
+class BufferPool:
+    """Preallocated ``bytearray`` receive buffers, one free list per size class.
+
+    Every consumer of a chunk (spool, raw dump, extractor, console splitter)
+    copies what it keeps into its own buffer, so a buffer goes back to the
+    pool as soon as the chunk was handled. ``get`` runs on the receiving
+    thread only; ``put`` may come from another thread (``deque`` is safe).
+    """
+
+    def __init__(self, sizes=None, prealloc=1):
+        self.sizes = sizes or recv_sizes()
+        self.free = {size: collections.deque() for size in self.sizes}
+        self.allocated = 0
+        for size in self.sizes:
+            for _ in range(prealloc):
+                self.free[size].append(self._new(size))
+
+    def _new(self, size):
+        self.allocated += 1
+        M_RECV_BUFFERS.inc()
+        return bytearray(size)
+
+    def get(self, size):
+        try:
+            return self.free[size].pop()
+        except IndexError:
+            return self._new(size)
+
+    def put(self, buf):
+        free = self.free.get(len(buf))
+        if free is not None:
+            free.append(buf)
+
+
+class RecvSize:
+    """Adaptive receive size over the pool's size classes.
+
+    Grows one class after ``GROW_AFTER`` reads in a row fill the buffer (the
+    sender is ahead: fewer, bigger reads) and shrinks one after
+    ``SHRINK_AFTER`` reads under a quarter of it (idle printer: small buffers
+    in the writer queue).
+    """
+    GROW_AFTER = 2
+    SHRINK_AFTER = 16
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.i = len(sizes) - 1
+        self.size = sizes[self.i]
+        self.full = self.small = 0
+
+    def update(self, n):
+        if n >= self.size:
+            self.full, self.small = self.full + 1, 0
+            if self.full >= self.GROW_AFTER and self.i < len(self.sizes) - 1:
+                self.i += 1
+                self.full = 0
+        elif n < self.size // 4:
+            self.full, self.small = 0, self.small + 1
+            if self.small >= self.SHRINK_AFTER and self.i > 0:
+                self.i -= 1
+                self.small = 0
+        else:
+            self.full = self.small = 0
+        self.size = self.sizes[self.i]
+
+
 class JobLogExtractor:
     """
     Extrae bloques de JOB LOG usando expresiones regulares para los marcadores
     de inicio y fin. Extrae el JOBNAME del marcador de inicio y el JOBID del
     cuerpo del log para nombrar los ficheros de salida.
+
+    The stream is scanned incrementally from ``self.pos``: each byte is searched
+    once, and only for the markers the current state can act on (START while
+    idle; END, plus JOBID/RC until known, while recording). Consumed bytes are
+    dropped from the front of ``self.buf`` without copying and only an
+    ``OVERLAP`` tail is kept back so a marker cut by ``recv`` is re-scanned.
+
+    With an EBCDIC ``codepage`` the markers are matched on the raw bytes with
+    the patterns from ``ebcdic_markers`` and only the job body is translated
+    to ASCII on its way to disk.
+
+    A job is written to a dot-prefixed temp file in ``outdir`` (see
+    ``temp_job_path``) and appears under its ``JOBID-JOBNAME[-RCxxxx].txt``
+    name, in its JOBID directory (``joblayout``), only on END, by one atomic
+    ``publish_job``: readers never see a half-written joblog and the RC found
+    midway needs no rename.
     """
 
     # Expresiones regulares para detectar inicio y fin de un job
-    # Manejan espacios variables (\\s+)
-    START_PATTERN_RE = re.compile(b"\\*\\*\\*\\*A\\s+START\\s+JOB\\s+\\d+\\s+([A-Z0-9#@$]+)")
-    END_PATTERN_RE = re.compile(b"\\*\\*\\*\\*A\\s+END")
+    # Manejan espacios variables (hasta MARKER_SPACE)
+    START_PATTERN_RE = re.compile(b"\\*\\*\\*\\*A\\s{1,%d}START\\s{1,%d}JOB\\s{1,%d}\\d{1,%d}\\s{1,%d}([A-Z0-9#@$]+)"
+                                  % (MARKER_SPACE, MARKER_SPACE, MARKER_SPACE, MARKER_DIGITS, MARKER_SPACE))
+    END_PATTERN_RE = re.compile(b"\\*\\*\\*\\*A\\s{1,%d}END" % MARKER_SPACE)
     # Expresión regular para extraer el JOBID de líneas como 'JES2.JOB00001...'
     JOBID_PATTERN_RE = re.compile(b"JES2\\.(JOB\\d+)")
     # Expresión regular para extraer RC en formato 'RC= 12AB' (igual y espacio y 4 alfanum)
-    RC_PATTERN_RE = re.compile(b"RC=\\s*([A-Za-z0-9]{4})")
+    RC_PATTERN_RE = re.compile(b"RC=\\s{0,%d}([A-Za-z0-9]{4})" % MARKER_SPACE)
 
-    def __init__(self, outdir=OUTDIR):
+    # Bytes kept unscanned at the end of the buffer; must exceed the longest
+    # marker prefix (START up to its jobname: 4 * MARKER_SPACE + MARKER_DIGITS + 13).
+    # Matches that may still grow (jobname, JOBID digits) are held back instead.
+    OVERLAP = 256
+
+    def __init__(self, outdir=OUTDIR, codepage="ascii", index=None, spool=None, archive=None):
+        self.codepage = codepage
+        # Índice de jobs (jobindex.JobIndex) y spool de origen para sus filas
+        self.index = index
+        self.spool = spool
+        # spool_archive.ArchiveWriter of the stream, told where each job lies
+        self.archive = archive
+        # Tabla bytes.translate EBCDIC -> ASCII (None para streams ASCII)
+        self.table = None
+        if codepage != "ascii":
+            (self.START_PATTERN_RE, self.END_PATTERN_RE, self.JOBID_PATTERN_RE,
+             self.RC_PATTERN_RE, self.table) = ebcdic_markers(codepage)
         self.buf = bytearray()
+        # Offset in self.buf where the next marker scan starts
+        self.pos = 0
+        # Offset in self.buf of the first job byte not yet written to disk
+        self.emit = 0
+        # Stream offset of self.buf[0] (bytes dropped from the buffer so far)
+        self.base = 0
         self.recording = False
         self.current_f = None
         self.current_path = None
@@ -103,235 +403,472 @@ class JobLogExtractor:
         self.jobname = None
         self.jobid = None
         self.rc = None
+        # Job bookkeeping for the index row
+        self.index_id = None
+        self.job_start = None
+        self.job_start_ts = None
+        self.job_bytes = 0
+        # Temp file holding job bytes while the JOBID is unknown (see MAX_PENDING)
+        self.spill_f = None
+        self.spill_path = None
+        # monotonic time of the last chunk fed (for JOB_IDLE_SECONDS)
+        self.last_data = time.monotonic()
 
     def _reset_state(self):
         """Resetea el estado para el siguiente job."""
         if self.current_f:
+            # never published (open failed midway): the partial job is dropped
             try:
                 self.current_f.close()
-            except IOError as e:
-                logger.error("Error closing joblog file: %s", e)
-        
+                os.remove(self.current_path)
+            except OSError as e:
+                logger.error("Error removing unfinished joblog %s: %s", self.current_path, e)
+        if self.spill_f:
+            # job ended or abandoned without JOBID: its bytes are dropped like before spilling
+            self._drop_spill()
+
         self.recording = False
         self.current_f = None
         self.current_path = None
         self.jobname = None
         self.jobid = None
         self.rc = None
+        self.index_id = None
+        self.job_start = None
+        self.job_start_ts = None
+        self.job_bytes = 0
+
+    def _index_call(self, method, *args, **kwargs):
+        """Update the job index; failures are logged and never stop extraction."""
+        if self.index is None:
+            return None
+        try:
+            return getattr(self.index, method)(*args, **kwargs)
+        except Exception:
+            logger.exception("job index %s failed", method)
+            return None
+
+    def _event(self, type, **fields):
+        """Publish a job event for the API's push streams (see events.py)."""
+        events.publish(type, jobname=self.jobname, jobid=self.jobid, spool=self.spool, **fields)
+
+    def _finish_job(self, end_offset):
+        """Publish the joblog, record the end of the job in the index and announce it."""
+        if not self.recording:
+            # abandoned while writing its last bytes (_spill, _open_job): nothing to announce
+            return
+        file = self._publish() if self.current_f else None
+        if self.index_id is not None:
+            self._index_call("job_ended", self.index_id, self.job_bytes, end_offset=end_offset)
+            self._index_call("text_done", self.index_id)
+        if self.archive is not None and self.job_start is not None:
+            try:
+                self.archive.add_job(self.job_start, end_offset, jobid=self.jobid, jobname=self.jobname,
+                                     rc=self.rc, file=file, ts=self.job_start_ts)
+            except Exception:
+                logger.exception("archive job entry failed")
+        self._event("job.end", rc=self.rc, size=self.job_bytes, file=file)
+        M_JOBS_ENDED.inc()
+        SUMMARY.add("jobs")
+        logger.info("Job %s-%s ended RC=%s: %s (%d bytes)", self.jobid, self.jobname, self.rc, file, self.job_bytes)
+
+    def _publish(self):
+        """Close the temp file and give it its final name (with the RC); returns that name."""
+        tmp, f = self.current_path, self.current_f
+        self.current_f = None
+        try:
+            f.close()
+            name = job_filename(self.jobid, self.jobname, self.rc)
+            path = joblayout.publish_job(tmp, os.path.join(joblayout.job_dir(self.outdir, name, create=True), name),
+                                         self.index_id)
+        except OSError:
+            logger.exception("Failed to publish joblog %s", tmp)
+            M_RENAME_FAILURES.inc()
+            self.current_path = None
+            return None
+        self.current_path = path
+        logger.debug("Published spool file: %s", path)
+        if self.index_id is not None:
+            self._index_call("job_renamed", self.index_id, os.path.basename(path), self.rc)
+        return os.path.basename(path)
+
+    def _drop_spill(self):
+        try:
+            self.spill_f.close()
+            os.remove(self.spill_path)
+        except OSError as e:
+            logger.error("Error removing spill file %s: %s", self.spill_path, e)
+        self.spill_f = None
+        self.spill_path = None
+
+    def _spill(self, upto):
+        """Move pending job bytes ``self.emit:upto`` from memory to the spill file."""
+        if self.spill_f is None:
+            self.spill_path = temp_job_path(self.outdir)
+            self.spill_f = spool_writer.open_stream(self.spill_path, "wb", kind="job")
+            count_limit("spilled_jobs")
+            logger.warning("No JOBID after %d bytes for job %s; spilling to %s",
+                           upto - self.emit, self.jobname, self.spill_path)
+        data = self.buf[self.emit:upto]
+        self.spill_f.write(data.translate(self.table) if self.table else data)
+        count_limit("spilled_bytes", upto - self.emit)
+        self.job_bytes += upto - self.emit
+        self.emit = upto
+        if MAX_SPILL and self.job_bytes > MAX_SPILL:
+            count_limit("abandoned_jobs")
+            logger.warning("Abandoning job %s: no JOBID in %d bytes", self.jobname, self.job_bytes)
+            self._reset_state()
+
+    def _open_job(self):
+        """Open the job's temp file once the JOBID is known (the spill file, if any)."""
+        if self.spill_f:
+            # ya es un temporal en outdir: se sigue escribiendo en él
+            path, self.current_f = self.spill_path, self.spill_f
+            self.spill_f = None
+            self.spill_path = None
+            logger.debug("JOBID found for spilled job; keeping %s", path)
+        else:
+            path = temp_job_path(self.outdir)
+            try:
+                self.current_f = spool_writer.open_stream(path, "wb", kind="job")
+            except IOError as e:
+                logger.error("Failed to create joblog file %s: %s", path, e)
+                self._reset_state() # Resetear si falla la creación del archivo
+                return
+        self.current_path = path
+        logger.debug("Creating spool file: %s", path)
+        # the row keeps the temp name (hidden from listings) until _publish renames it
+        self.index_id = self._index_call(
+            "job_started", os.path.basename(path), self.jobid, self.jobname, self.rc,
+            start_ts=self.job_start_ts, spool=self.spool, start_offset=self.job_start)
+        if self.job_bytes and self.index_id is not None:
+            # spilled bytes were never indexed
+            try:
+                self.current_f.flush()
+                with open(path, "rb") as f:
+                    while data := f.read(1 << 20):
+                        self._index_call("index_text", self.index_id, data)
+            except IOError as e:
+                logger.error("Failed to index spilled bytes of %s: %s", path, e)
+
+    def _write_body(self, upto):
+        """Write job bytes ``self.emit:upto`` to the open joblog (copy-free for ASCII)."""
+        if self.jobid and not self.current_f:
+            self._open_job()
+        if not self.current_f:
+            if self.recording and upto - self.emit > MAX_PENDING:
+                self._spill(upto)
+            return
+        if upto <= self.emit:
+            return
+        if self.table:
+            data = self.buf[self.emit:upto].translate(self.table)
+            self.current_f.write(data)
+        else:
+            with memoryview(self.buf) as mv:
+                self.current_f.write(mv[self.emit:upto])
+            data = None
+        if self.index_id is not None:
+            # Line offsets and full-text index (split and inserted on jobindex's thread)
+            self._index_call("index_text", self.index_id, data if data is not None else self.buf[self.emit:upto])
+        self.job_bytes += upto - self.emit
+        self.emit = upto
+
+    def _scan(self, final=False):
+        """Process every complete marker from ``self.pos`` on.
+
+        With ``final`` the buffer is known to be complete (connection closed),
+        so markers touching its end are accepted and nothing is held back.
+        """
+        buf = self.buf
+        size = len(buf)
+        # A match touching the end of the buffer may still grow (JOBID digits,
+        # jobname) with the next chunk; ``hold`` keeps it for the next scan.
+        hold = size
+        while True:
+            if not self.recording:
+                m = self.START_PATTERN_RE.search(buf, self.pos)
+                if m and (m.end() < size or final):
+                    # Encontramos un inicio de job
+                    self.recording = True
+                    self.jobname = m.group(1).decode(self.codepage, errors='ignore')
+                    logger.debug("Detected START for jobname: %s", self.jobname)
+                    self._event("job.start")
+                    M_JOBS_STARTED.inc()
+                    self.pos = self.emit = m.end()
+                    self.job_start = self.base + m.end()
+                    self.job_start_ts = time.time()
+                    continue
+                if m:
+                    hold = m.start()
+                break
+
+            end_m = self.END_PATTERN_RE.search(buf, self.pos)
+            stop = end_m.start() if end_m else size
+            if not self.jobid:
+                m = self.JOBID_PATTERN_RE.search(buf, self.pos, stop)
+                if m and (m.end() < size or final):
+                    self.jobid = m.group(1).decode(self.codepage, errors='ignore')
+                    logger.debug("Extracted JOBID: %s for jobname: %s", self.jobid, self.jobname)
+                    self._event("job.id")
+                elif m:
+                    hold = m.start()
+            if not self.rc:
+                m = self.RC_PATTERN_RE.search(buf, self.pos, stop)
+                if m:
+                    # goes into the name when the job is published on END
+                    self.rc = m.group(1).decode(self.codepage, errors='ignore')
+                    logger.debug("Extracted RC: %s for job: %s", self.rc, self.jobid)
+                    self._event("job.rc", rc=self.rc)
+            if not end_m:
+                break
+            logger.debug("Detected END for job: %s-%s", self.jobid, self.jobname)
+            # Escribimos los datos hasta justo antes del marcador de fin
+            self._write_body(end_m.start())
+            if self.recording:
+                if not self.jobid:
+                    count_limit("jobs_without_jobid")
+                    logger.warning("END without JOBID for job %s; its output is dropped", self.jobname)
+                self._finish_job(self.base + end_m.start())
+            # Reseteamos estado para el próximo job
+            self._reset_state()
+            self.pos = end_m.end()
+
+        limit = size if final else min(hold, max(self.pos, size - self.OVERLAP))
+        self.pos = max(self.pos, limit)
+        if self.recording:
+            self._write_body(limit)
+            keep = self.emit
+        else:
+            keep = self.pos
+        if keep:
+            # Deleting from the front of a bytearray just moves its start pointer
+            del buf[:keep]
+            self.base += keep
+            self.pos -= keep
+            self.emit = max(self.emit - keep, 0)
 
     def feed(self, chunk: bytes):
         """Alimenta el extractor con nuevos bytes del stream."""
         if not chunk:
             return
-        self.buf.extend(chunk)
+        now = time.monotonic()
+        # a gap this long means the END of the job in progress was lost
+        self.check_idle(now)
+        self.last_data = now
+        self.buf += chunk
+        self._scan()
 
-        while True:
-            if not self.recording:
-                match = self.START_PATTERN_RE.search(self.buf)
-                if not match:
-                    # Si no hay inicio, descartamos el buffer para no consumir memoria infinita
-                    # Dejamos una pequeña cola por si el patrón llega cortado
-                    if len(self.buf) > 200:
-                        self.buf = self.buf[-200:]
-                    break
-                
-                # Encontramos un inicio de job
-                self.recording = True
-                # Capturamos el Job Name del grupo 1 de la regex
-                self.jobname = match.group(1).decode('ascii', errors='ignore')
-                logger.info("Detected START for jobname: %s", self.jobname)
-
-                # Eliminamos del buffer todo hasta el final del match
-                self.buf = self.buf[match.end():]
-                # Continuamos el bucle para procesar el resto del buffer
-                continue
+    def check_idle(self, now=None):
+        """Close the job in progress as truncated when no data came for ``JOB_IDLE_SECONDS``."""
+        now = time.monotonic() if now is None else now
+        if not (self.recording and JOB_IDLE_SECONDS and now - self.last_data > JOB_IDLE_SECONDS):
+            return False
+        count_limit("idle_timeouts")
+        logger.warning("No data for %.0fs inside job %s-%s; closing it as truncated",
+                       now - self.last_data, self.jobid, self.jobname)
+        self._flush_buffer()
+        return True
 
-            else: # Estamos grabando (self.recording es True)
-                # Primero, buscamos el JOBID si aún no lo tenemos
-                if self.jobname and not self.jobid:
-                    id_match = self.JOBID_PATTERN_RE.search(self.buf)
-                    if id_match:
-                        # JOBID encontrado
-                        self.jobid = id_match.group(1).decode('ascii', errors='ignore')
-                        logger.info("Extracted JOBID: %s for jobname: %s", self.jobid, self.jobname)
-                        
-                        # Ahora que tenemos ambos, creamos el archivo
-                        # Attempt to find RC in the buffer as well (may be present before file creation)
-                        rc_match = self.RC_PATTERN_RE.search(self.buf)
-                        if rc_match:
-                            try:
-                                self.rc = rc_match.group(1).decode('ascii', errors='ignore')
-                                logger.info("Extracted RC: %s for job: %s", self.rc, self.jobid)
-                            except Exception:
-                                self.rc = None
-
-                        # Sanitize jobname component to make a safe filename
-                        safe_jobname = sanitize_filename_component(self.jobname)
-                        # Build filename; if RC available, append '-RCxxxx'
-                        if self.rc:
-                            filename = f"{self.jobid}-{safe_jobname}-RC{self.rc}.txt"
-                        else:
-                            filename = f"{self.jobid}-{safe_jobname}.txt"
-                        path = os.path.join(self.outdir, filename)
-                        # Ensure we don't clobber an existing file
-                        path = unique_path(path)
-                        try:
-                            self.current_f = open(path, "wb")
-                            # remember current path so we can rename later if RC appears
-                            self.current_path = path
-                            logger.info("Creating spool file: %s", path)
-                            # Escribimos lo que teníamos en el buffer hasta ahora
-                            self.current_f.write(self.buf)
-                            self.buf = bytearray()
-                        except IOError as e:
-                            logger.error("Failed to create joblog file %s: %s", path, e)
-                            self._reset_state() # Resetear si falla la creación del archivo
-                        
-                # Si ya tenemos un archivo abierto, comprobamos si llega el final del job
-                end_match = self.END_PATTERN_RE.search(self.buf)
-                if not end_match:
-                    # Aún no hay fin. Si el archivo ya está abierto, escribimos el buffer.
-                    # Also look for RC token while recording; if we find it after file creation, rename file
-                    if self.current_f and not self.rc:
-                        rc_match2 = self.RC_PATTERN_RE.search(self.buf)
-                        if rc_match2:
-                            try:
-                                found_rc = rc_match2.group(1).decode('ascii', errors='ignore')
-                                logger.info("Found RC after file creation: %s for job %s", found_rc, self.jobid)
-                                # attempt to rename the file to include RC
-                                if self.current_path:
-                                    safe_jobname = sanitize_filename_component(self.jobname)
-                                    newname = f"{self.jobid}-{safe_jobname}-RC{found_rc}.txt"
-                                    newpath = os.path.join(self.outdir, newname)
-                                    # If target exists, pick a unique path
-                                    newpath = unique_path(newpath)
-                                    try:
-                                        # close current file, rename, reopen in append mode
-                                        try:
-                                            self.current_f.close()
-                                        except Exception:
-                                            pass
-                                        os.rename(self.current_path, newpath)
-                                        self.current_path = newpath
-                                        self.current_f = open(newpath, 'ab')
-                                        self.rc = found_rc
-                                        logger.info("Renamed spool to include RC: %s", newpath)
-                                    except Exception:
-                                        logger.exception("Failed to rename spool file to include RC")
-                            except Exception:
-                                logger.exception("Error extracting RC after file creation")
-                    
-                    if self.current_f:
-                        self.current_f.write(self.buf)
-                        self.buf = bytearray()
-                    break # Salimos y esperamos más datos
-                else:
-                    # Encontramos el final del job
-                    logger.info("Detected END for job: %s-%s", self.jobid, self.jobname)
-                    # Escribimos los datos hasta justo antes del marcador de fin
-                    if self.current_f:
-                        self.current_f.write(self.buf[:end_match.start()])
-                    
-                    # Guardamos el resto del buffer para la siguiente iteración
-                    self.buf = self.buf[end_match.end():]
-                    
-                    # Reseteamos estado para el próximo job
-                    self._reset_state()
-                    # Volvemos a empezar el bucle por si hay otro job en el buffer
-                    continue
+    def _flush_buffer(self):
+        """Treat the buffer as complete: process it, close any job in progress, drop it."""
+        self._scan(final=True)
+        if self.recording:
+            # job cut short (connection closed or idle): index what we got
+            if not self.jobid:
+                count_limit("jobs_without_jobid")
+            self._finish_job(self.base + len(self.buf))
+        self.base += len(self.buf)
+        self.buf = bytearray()
+        self.pos = 0
+        self.emit = 0
+        self._reset_state()
 
     def close(self):
         """Cierra cualquier fichero pendiente al finalizar la conexión."""
         logger.info("Connection closed. Closing any pending job files.")
-        if self.recording and self.current_f:
-            # Si quedaba algo en el buffer, lo escribimos
-            if self.buf:
-                self.current_f.write(self.buf)
-            self.buf = bytearray()
-        self._reset_state()
+        self._flush_buffer()
 
 
-def recv_one_spool():
-    s = socket.socket()
-    logger.info("Attempting connect to %s:%s", HOST, PORT)
-    s.connect((HOST, PORT))  # Cliente conecta al listener de Hercules
-    # Archivo con el spool completo (por compatibilidad)
-    fname = datetime.datetime.now().strftime(f"{OUTDIR}/spool_%Y%m%d.bin")
-    logger.info("Conectado; guardando spool completo en %s", fname)
+class SpoolSession:
+    """Estado de una conexión de impresora: spool completo, volcado raw y extractor.
 
-    extractor = JobLogExtractor(outdir=OUTDIR)
+    ``name`` distinguishes several printers served by one process; the default
+    (empty) name keeps the historical ``spool`` and ``console_bridge-raw.bin``
+    file names. The full spool goes to a new ``spool_archive`` stream per
+    session (or, with ``BRIDGE_SPOOL_FORMAT=bin``, is appended to
+    ``spool_YYYYMMDD.bin``); the raw dump rotates at ``BRIDGE_RAW_MAX_MB``.
+    """
 
-    ready_written = False
+    def __init__(self, name="", outdir=None, logdir=None, codepage=None):
+        outdir = outdir or OUTDIR
+        logdir = logdir or LOGDIR
+        codepage = codepage or CODEPAGE
+        self.name = name
+        self.outdir = outdir
+        # Archivo con el spool completo (por compatibilidad)
+        prefix = f"spool_{name}" if name else "spool"
+        self.archive = None
+        if SPOOL_FORMAT == "archive":
+            stream = spool_archive.new_stream_id(prefix)
+            self.archive = self.f = spool_archive.ArchiveWriter(stream)
+            self.fname = self.f.name
+        else:
+            self.fname = os.path.join(outdir, datetime.datetime.now().strftime(f"{prefix}_%Y%m%d.bin"))
+            # append: a second session on the same day must not overwrite the first
+            self.f = spool_writer.open_stream(self.fname, "ab", kind="spool")
+        self.raw_path = os.path.join(logdir, f"console_bridge-raw-{name}.bin" if name else "console_bridge-raw.bin")
+        logger.info("Conectado; guardando spool completo en %s", self.fname)
+        self.rawf = spool_writer.open_stream(self.raw_path, "ab", kind="raw")
+        self.raw_size = os.path.getsize(self.raw_path)
+        # With BRIDGE_CODEPAGE=auto the extractor is created once the codepage is known
+        self.index = get_job_index()
+        self.extractor = None if codepage == "auto" else self._new_extractor(codepage)
+        self.pending = bytearray()
+        self.chunk_no = 0
+        self.bytes_written = 0
+        printer = name or "default"
+        self.m_received = M_RECEIVED.labels(printer)
+        self.m_recv_size = M_RECV_SIZE.labels(printer)
 
-    try:
-        raw_path = os.path.join(LOGDIR, "console_bridge-raw.bin")
-        with open(fname, "wb") as f, open(raw_path, "ab") as rawf:
-            chunk_no = 0
-            bytes_written = 0
-            while True:
-                data = s.recv(65536)
-                if not data:  # Hercules cierra al terminar un spool
-                    logger.info("recv returned 0 bytes (connection closed)")
-                    break
-                chunk_no += 1
-                logger.info("Received chunk %d: %d bytes", chunk_no, len(data))
-                # write ready file on first real data
-                if not ready_written and len(data) > 0:
-                    write_ready()
-                    ready_written = True
-                # Guardar spool completo
-                f.write(data)
-                bytes_written += len(data)
-                # Also append raw bytes to a dedicated debug file
-                try:
-                    rawf.write(data)
-                    rawf.flush()
-                except Exception:
-                    logger.exception("failed to write raw dump")
-                # Alimentar extractor para que cree archivos por cada JOB LOG
-                try:
-                    # First try binary search (ASCII-compatible)
-                    extractor.feed(data)
-                except Exception:
-                    logger.exception("extractor error (binary)")
-                # If no joblog files were produced in binary mode, try decoding as EBCDIC
+    def _new_extractor(self, codepage):
+        return JobLogExtractor(outdir=self.outdir, codepage=codepage, index=self.index,
+                               spool=os.path.basename(self.fname), archive=self.archive)
+
+    def _rotate_raw(self):
+        """Roll console_bridge-raw.bin to .1.bin, .1 to .2, ... keeping RAW_BACKUPS files."""
+        self.rawf.close()
+        stem, ext = os.path.splitext(self.raw_path)
+        for n in range(RAW_BACKUPS, 0, -1):
+            src = f"{stem}.{n - 1}{ext}" if n > 1 else self.raw_path
+            if os.path.exists(src):
+                os.replace(src, f"{stem}.{n}{ext}")
+        if not RAW_BACKUPS:
+            os.remove(self.raw_path)
+        self.rawf = spool_writer.open_stream(self.raw_path, "ab", kind="raw")
+        self.raw_size = 0
+
+    def _start_extractor(self, final=False):
+        """Create the extractor once ``self.pending`` reveals the codepage."""
+        codepage = detect_codepage(self.pending, final=final)
+        if codepage is None:
+            return
+        logger.info("Printer stream codepage%s: %s", f" ({self.name})" if self.name else "", codepage)
+        self.extractor = self._new_extractor(codepage)
+        self.extractor.feed(self.pending)
+        self.pending = bytearray()
+
+    def handle(self, data: bytes):
+        """Process one received chunk (bytes or a view of a pool buffer, copied before returning)."""
+        self.chunk_no += 1
+        SUMMARY.add("chunks")
+        SUMMARY.add("bytes received", len(data))
+        self.m_received.inc(len(data))
+        self.m_recv_size.observe(len(data))
+        # write ready file on first real data
+        if self.chunk_no == 1:
+            write_ready()
+        # Guardar spool completo
+        self.f.write(data)
+        self.bytes_written += len(data)
+        # Also append raw bytes to a dedicated debug file (group-committed, see spool_writer)
+        try:
+            if RAW_MAX_BYTES and self.raw_size + len(data) > RAW_MAX_BYTES and self.raw_size:
+                self._rotate_raw()
+            self.rawf.write(data)
+            self.raw_size += len(data)
+        except Exception:
+            logger.exception("failed to write raw dump")
+        # Alimentar extractor para que cree archivos por cada JOB LOG
+        try:
+            with M_EXTRACT.time():
+                if self.extractor is None:
+                    self.pending += data
+                    self._start_extractor()
+                else:
+                    self.extractor.feed(data)
+        except Exception:
+            logger.exception("extractor error")
+
+    def tick(self):
+        """Called periodically while the connection is idle (see ``JobLogExtractor.check_idle``)."""
+        try:
+            if self.extractor is not None:
+                self.extractor.check_idle()
+        except Exception:
+            logger.exception("extractor error")
+
+    def close(self):
+        """Flush the extractor and close the session files."""
+        logger.info("Total bytes written to spool: %d", self.bytes_written)
+        if EXTRACTOR_STATS:
+            logger.info("Extractor limits so far: %s", dict(EXTRACTOR_STATS))
+        try:
+            # cerrar extractor para volcar cualquier resto pendiente
+            if self.extractor is None and self.pending:
+                self._start_extractor(final=True)
+            if self.extractor is not None:
+                self.extractor.close()
+        finally:
+            self.f.close()
+            self.rawf.close()
+        # if nothing was written, remove empty file
+        if self.bytes_written == 0:
+            # archive streams write nothing until data arrives; a day's .bin may hold earlier sessions
+            if self.archive is None and os.path.exists(self.fname) and os.path.getsize(self.fname) == 0:
                 try:
-                    # cheap check: if the textual pattern exists when decoding with common EBCDIC codepages
-                    for enc in ("cp037", "cp1047", "cp500"):
-                        try:
-                            decoded = data.decode(enc, errors="ignore")
-                        except Exception:
-                            decoded = None
-                        if decoded and extractor.START_PATTERN_STR in decoded:
-                            try:
-                                extractor.feed_text(decoded)
-                            except Exception:
-                                logger.exception("extractor error (text)")
-                            break
+                    os.remove(self.fname)
+                    logger.info("Removed empty spool file %s", self.fname)
                 except Exception:
-                    logger.exception("extractor error (ebcdic attempts)")
-            logger.info("Total bytes written to spool: %d", bytes_written)
-            # if nothing was written, remove empty file
-            if bytes_written == 0:
+                    logger.exception("Failed to remove empty spool %s", self.fname)
+        else:
+            logger.info("Spool recibido y guardado en %s", self.fname)
+
+
+def recv_one_spool(pool=None):
+    logger.info("Attempting connect to %s:%s", HOST, PORT)
+    s = open_sockdev(HOST, PORT)  # Cliente conecta al listener de Hercules
+    supervisor.notify("READY")
+    # wake up now and then to close jobs whose END never arrives
+    s.settimeout(IDLE_TICK_SECONDS)
+    pool = pool or BufferPool()
+    size = RecvSize(pool.sizes)
+    try:
+        session = SpoolSession()
+        try:
+            while True:
+                # handle() copies the chunk, so the same buffer is reused for every read
+                buf = pool.get(size.size)
                 try:
-                    f.close()
-                    os.remove(fname)
-                    logger.info("Removed empty spool file %s", fname)
-                except Exception:
-                    logger.exception("Failed to remove empty spool %s", fname)
+                    try:
+                        n = s.recv_into(buf)
+                    except socket.timeout:
+                        session.tick()
+                        continue
+                    if not n:  # Hercules cierra al terminar un spool
+                        logger.info("recv returned 0 bytes (connection closed)")
+                        break
+                    size.update(n)
+                    with memoryview(buf) as mv, mv[:n] as data:
+                        session.handle(data)
+                finally:
+                    pool.put(buf)
+        finally:
+            session.close()
     finally:
-        # cerrar extractor para volcar cualquier resto pendiente
-        extractor.close()
         s.close()
-    logger.info("Spool recibido y guardado en %s", fname)
 
 
 def main():
     write_pid()
+    metrics.start_pusher("console_bridge")
     logger.info("Starting console_bridge main loop connecting to %s:%s", HOST, PORT)
+    remove_stale_temp(OUTDIR)
+    retention.start(get_job_index(), OUTDIR)
+    pool = BufferPool()
     while True:
         try:
-            recv_one_spool()
+            recv_one_spool(pool)
             time.sleep(0.2)  # espera breve antes del próximo spool
         except ConnectionRefusedError:
             logger.debug("Connection refused; retrying in 0.5s")
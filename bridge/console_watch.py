@@ -1,13 +1,32 @@
 # console_watch.py
 import socket, time, re, datetime, os, logging
-from logging.handlers import RotatingFileHandler
 
-HOST, PORT = "127.0.0.1", 5002
-re_submit = re.compile(r"\$HASP100\s+(\S+)\s+JOB\s+\((JOB\d+)\)\s+SUBMITTED")
-re_ended  = re.compile(r"\$HASP395\s+(\S+)\s+ENDED")
+import bridge_log
+import events
+import metrics
+import supervisor
+
+HOST = os.environ.get("CW_HOST", "127.0.0.1")
+PORT = int(os.environ.get("CONSOLE_PORT", "5002"))
+# Línea de fin de IPL; se notifica al supervisor (MVS_INIT) para arrancar el bridge
+INIT_LINE = os.environ.get("CW_INIT_LINE", "MVS038J MVS 3.8j TK5 system initialization complete")
+# Hardcopy lines written to console_watch.log as "[CONS] ...": "all", "off", or N for one line in N.
+# Recognized job messages are logged either way.
+RAW_LOG = os.environ.get("CW_RAW_LOG", "all").strip().lower()
+RAW_EVERY = 1 if RAW_LOG == "all" else 0 if RAW_LOG == "off" else max(int(RAW_LOG), 1)
+
+# Message ID: $HASPnnn or IBM's ccc[c]nnn[n]t (IEF403I, IEA995I, MVS038J, ...)
+MSGID = re.compile(r"(?<![\w$])(\$HASP\d{3}|[A-Z]{3,4}\d{3,4}[A-Z]?)(?!\w)")
+# Components counted in bridge_console_messages_total; the rest go to "other"
+COMPONENTS = frozenset(("$HASP", "IEF", "IEA", "IEC", "IEE", "IEW", "IFA", "IGD", "IKJ", "IOS", "IST", "MVS"))
+
+M_LINES = metrics.counter("bridge_console_lines_total", "Hardcopy console lines read")
+M_CONSOLE_JOBS = metrics.counter("bridge_console_jobs_total", "JES2 job messages seen on the console", ("event",))
+M_MESSAGES = metrics.counter("bridge_console_messages_total", "Console messages with an ID, by component",
+                             ("component",))
 
 # Logger setup: console + rotating file
-LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
+LOG_DIR = os.environ.get("BRIDGE_LOGDIR", os.path.join(os.path.dirname(__file__), "logs"))
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_PATH = os.path.join(LOG_DIR, "console_watch.log")
 
@@ -18,14 +37,7 @@ PID_FILE = os.path.join(PIDDIR, "console_watch.pid")
 
 logger = logging.getLogger("console_watch")
 if not logger.handlers:
-    logger.setLevel(logging.INFO)
-    fmt = logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%Y-%m-%dT%H:%M:%S")
-    sh = logging.StreamHandler()
-    sh.setFormatter(fmt)
-    fh = RotatingFileHandler(LOG_PATH, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8")
-    fh.setFormatter(fmt)
-    logger.addHandler(sh)
-    logger.addHandler(fh)
+    logger = bridge_log.setup("console_watch", LOG_PATH, 5 * 1024 * 1024, 5)
 
     def write_pid():
         try:
@@ -41,19 +53,142 @@ if not logger.handlers:
         except Exception:
             logger.exception("Failed to remove pid file %s", PID_FILE)
 
+class LineSplitter:
+    """Splits a byte stream into text lines in linear time.
+
+    Only the bytes after the previous ``feed`` are searched for a newline, and
+    every complete line of a chunk is decoded and split in one pass.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        # bytes of buf already known to hold no newline
+        self.scanned = 0
+
+    def feed(self, chunk):
+        """Complete lines in ``chunk`` (plus what was pending), without their line ends."""
+        buf = self.buf
+        buf += chunk
+        end = buf.rfind(b"\n", self.scanned)
+        if end < 0:
+            self.scanned = len(buf)
+            return []
+        lines = buf[:end].decode("ascii", "ignore").split("\n")
+        del buf[:end + 1]
+        self.scanned = 0
+        return [l[:-1] if l.endswith("\r") else l for l in lines]
+
+    def close(self):
+        """The unterminated last line, if any."""
+        # al cerrar la conexión, si queda fragmento, devolverlo como última línea
+        rest = self.buf.decode("ascii", "ignore").rstrip("\r\n")
+        self.buf = bytearray()
+        self.scanned = 0
+        return [rest] if rest else []
+
+
 def iter_lines(sock):
-    buf = b""
+    splitter = LineSplitter()
     while True:
         chunk = sock.recv(65536)
         if not chunk:
-            # al cerrar la conexión, si queda fragmento, devolverlo como última línea
-            if buf:
-                yield buf.decode("ascii", "ignore").rstrip("\r\n")
+            yield from splitter.close()
             break
-        buf += chunk
-        while b"\n" in buf:
-            line, buf = buf.split(b"\n", 1)
-            yield line.decode("ascii", "ignore").rstrip("\r")
+        yield from splitter.feed(chunk)
+
+
+# Parsers for the text after a message ID: (event type, fields) or None
+def _hasp100(rest):
+    # "$HASP100 NAME JOB (JOB00012) SUBMITTED"
+    t = rest.split()
+    if len(t) >= 4 and t[1] == "JOB" and t[2].startswith("(JOB") and t[2].endswith(")") and t[3] == "SUBMITTED":
+        return "console.submitted", {"jobname": t[0], "jobid": t[2][1:-1]}
+    return None
+
+
+def _jobname_then(word, event):
+    def parse(rest):
+        t = rest.split(None, 2)
+        if len(t) >= 2 and t[1] == word:
+            return event, {"jobname": t[0]}
+        return None
+    return parse
+
+
+def _ief450i(rest):
+    # "IEF450I NAME STEP - ABEND=S0C4 U0000 REASON=00000004"
+    t = rest.split()
+    code = next((w[6:] for w in t if w.startswith("ABEND=")), None)
+    if t and code:
+        return "console.abend", {"jobname": t[0], "step": t[1] if len(t) > 1 and t[1] != "-" else None,
+                                 "code": code}
+    return None
+
+
+MESSAGES = {
+    "$HASP100": _hasp100,
+    "$HASP373": _jobname_then("STARTED", "console.started"),
+    "$HASP395": _jobname_then("ENDED", "console.ended"),
+    "IEF450I": _ief450i,
+}
+# event type -> log format and bridge_console_jobs_total label
+EVENT_LOG = {
+    "console.submitted": ("SUBMITTED %(jobname)s -> %(jobid)s", "submitted"),
+    "console.started": ("STARTED %(jobname)s", "started"),
+    "console.ended": ("ENDED %(jobname)s", "ended"),
+    "console.abend": ("ABEND %(jobname)s %(step)s %(code)s", "abend"),
+}
+
+_component_counters = {}
+_raw_count = 0
+
+
+def parse_line(line):
+    """``(msgid, event type, fields)`` of one hardcopy line; missing parts are None.
+
+    A console or route prefix, or a reply ID, may come before the message
+    ID: the first known message on the line wins, else the first ID.
+    """
+    first = None
+    for m in MSGID.finditer(line):
+        msgid = m.group(1)
+        first = first or msgid
+        parser = MESSAGES.get(msgid)
+        parsed = parser(line[m.end():]) if parser else None
+        if parsed is not None:
+            return msgid, parsed[0], parsed[1]
+    return first, None, None
+
+
+def count_message(msgid):
+    component = "$HASP" if msgid.startswith("$") else msgid[:3]
+    counter = _component_counters.get(component)
+    if counter is None:
+        counter = _component_counters[component] = M_MESSAGES.labels(component if component in COMPONENTS else "other")
+    counter.inc()
+
+
+def handle_line(line):
+    """Log one hardcopy line and publish it, with the job event it carries, as structured events."""
+    global _raw_count
+    M_LINES.inc()
+    if RAW_EVERY:
+        _raw_count += 1
+        if _raw_count >= RAW_EVERY:
+            _raw_count = 0
+            logger.info("[CONS] %s", line)
+    msgid, event, fields = parse_line(line)
+    events.publish("console.line", line=line, msgid=msgid)
+    if INIT_LINE and INIT_LINE in line:
+        supervisor.notify("MVS_INIT")
+    if msgid is None:
+        return
+    count_message(msgid)
+    if event is not None:
+        fmt, label = EVENT_LOG[event]
+        logger.info(fmt, fields)
+        events.publish(event, msgid=msgid, **fields)
+        M_CONSOLE_JOBS.labels(label).inc()
 
 def run_watch_loop():
     logger.info("[watch] conectando a %s:%s ...", HOST, PORT)
@@ -62,15 +197,9 @@ def run_watch_loop():
             s = socket.socket()
             s.connect((HOST, PORT))
             logger.info("conectado a %s:%s", HOST, PORT)
+            supervisor.notify("READY")
             for line in iter_lines(s):
-                # DEBUG: ver todo lo que emite la hardcopy
-                logger.info("[CONS] %s", line)
-                if m := re_submit.search(line):
-                    jobname, jobid = m.group(1), m.group(2)
-                    logger.info("SUBMITTED %s -> %s", jobname, jobid)
-                if m := re_ended.search(line):
-                    jobname = m.group(1)
-                    logger.info("ENDED %s", jobname)
+                handle_line(line)
             s.close()
             logger.info("[watch] EOF (cerró 030E). Reintentando...")
             time.sleep(0.3)
@@ -83,6 +212,7 @@ def run_watch_loop():
 
 if __name__ == '__main__':
     write_pid()
+    metrics.start_pusher("console_watch")
     try:
         run_watch_loop()
     finally:
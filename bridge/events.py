@@ -0,0 +1,294 @@
+"""Job event bus shared by the bridge processes and the API.
+
+Producers (``JobLogExtractor`` and ``console_watch``) call ``publish``, which
+queues the event for a sender thread; it writes one JSON line per event to a
+stream connection on the Unix socket the API listens on
+(``BRIDGE_EVENTS_SOCKET``), so a burst waits in the socket buffer instead of
+being lost. ``publish`` never blocks: an event is dropped, and counted in
+``DROPPED`` and ``bridge_events_dropped_total``, only when no API is running
+or its queue is full. ``console.line`` (every hardcopy line) has its own
+smaller queue, sent after the job and console events, so console chatter can
+never push those out.
+
+The API owns an ``EventBus``: it numbers incoming events, keeps the last
+``BRIDGE_EVENTS_BACKLOG`` of them so a client reconnecting with
+``Last-Event-ID`` gets what it missed, and fans each event out to every
+subscriber queue. Event types::
+
+    job.start   jobname                      START separator seen
+    job.id      jobname, jobid               JES2 JOBID found
+    job.rc      jobname, jobid, rc           RC found
+    job.end     jobname, jobid, rc, file, size
+    console.submitted  jobname, jobid, msgid $HASP100
+    console.started    jobname, msgid        $HASP373
+    console.ended      jobname, msgid        $HASP395
+    console.abend      jobname, step, code, msgid   IEF450I
+    console.line       line, msgid           every hardcopy line (msgid None without one)
+"""
+import os, json, time, socket, errno, queue, asyncio, threading, atexit, collections, logging
+
+import metrics
+
+PIDDIR = os.environ.get("BRIDGE_PIDDIR", "/app/pids")
+# Socket del bus de eventos; "off" desactiva la publicación
+EVENTS_SOCKET = os.environ.get("BRIDGE_EVENTS_SOCKET", os.path.join(PIDDIR, "events.sock"))
+# Events kept for Last-Event-ID resume
+BACKLOG = int(os.environ.get("BRIDGE_EVENTS_BACKLOG", "1024"))
+# Events queued per subscriber before it is considered stalled and dropped
+SUBSCRIBER_QUEUE = 256
+# Largest event line accepted from producers
+MAX_EVENT = 65536
+# Events waiting for the sender thread: job/console events, and console.line
+QUEUE_SIZE = 10000
+LINE_QUEUE_SIZE = 1000
+# Send buffer of the producer connection, and seconds between connection attempts
+SNDBUF = 1 << 20
+RECONNECT_SECONDS = 1.0
+# Types sent on the lossy queue
+BULK_TYPES = ("console.line",)
+
+M_DROPPED = metrics.counter("bridge_events_dropped_total", "Events not delivered to the API", ("queue",))
+
+logger = logging.getLogger("console_bridge")
+
+_sender = None
+_sender_lock = threading.Lock()
+# Events not delivered because no listener was there or a queue was full
+DROPPED = 0
+
+
+def enabled(path=None):
+    path = EVENTS_SOCKET if path is None else path
+    return bool(path) and path.lower() != "off"
+
+
+def _dropped(queue_name, n=1):
+    global DROPPED
+    DROPPED += n
+    M_DROPPED.labels(queue_name).inc(n)
+
+
+class Sender:
+    """Daemon thread writing queued events to one stream connection to the API."""
+
+    def __init__(self, path):
+        self.path = path
+        self.events = queue.Queue(QUEUE_SIZE)
+        self.lines = queue.Queue(LINE_QUEUE_SIZE)
+        # set whenever something is queued
+        self.wake = threading.Event()
+        self.sock = None
+        self.retry_at = 0.0
+        self.thread = threading.Thread(target=self.run, name="events-send", daemon=True)
+        self.thread.start()
+
+    def put(self, event):
+        bulk = event["type"] in BULK_TYPES
+        try:
+            (self.lines if bulk else self.events).put_nowait(event)
+        except queue.Full:
+            _dropped("line" if bulk else "event")
+            return False
+        self.wake.set()
+        return True
+
+    def _next(self):
+        for q in (self.events, self.lines):
+            try:
+                return q.get_nowait()
+            except queue.Empty:
+                pass
+        return None
+
+    def _connect(self):
+        if time.monotonic() < self.retry_at:
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            # ENOENT/ECONNREFUSED: el API no está levantado
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                logger.warning("cannot connect to the event socket %s: %s", self.path, e)
+            self.retry_at = time.monotonic() + RECONNECT_SECONDS
+            return False
+        self.sock = sock
+        return True
+
+    def _send(self, event):
+        data = (json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8")
+        if self.sock is None and not self._connect():
+            return False
+        try:
+            self.sock.sendall(data)
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                logger.warning("event send failed: %s", e)
+            self.sock.close()
+            self.sock = None
+            return False
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            while (event := self._next()) is not None:
+                try:
+                    sent = self._send(event)
+                except Exception:
+                    logger.exception("event send failed")
+                    sent = False
+                if not sent:
+                    _dropped("line" if event["type"] in BULK_TYPES else "event")
+
+    def pending(self):
+        return self.events.qsize() + self.lines.qsize()
+
+    def flush(self, timeout=2.0):
+        """Wait up to ``timeout`` seconds for the queues to drain (at exit)."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def _get_sender(path):
+    global _sender
+    with _sender_lock:
+        if _sender is None or _sender.path != path:
+            _sender = Sender(path)
+            atexit.register(_sender.flush)
+        return _sender
+
+
+def publish(type, path=None, **fields):
+    """Queue one event for the API's bus; never blocks, never raises."""
+    path = EVENTS_SOCKET if path is None else path
+    if not enabled(path):
+        return False
+    event = {"type": type, "ts": time.time(), **fields}
+    try:
+        return (_sender if _sender is not None and _sender.path == path else _get_sender(path)).put(event)
+    except Exception:
+        logger.exception("event publish failed")
+        _dropped("event")
+        return False
+
+
+class EventBus:
+    """In-process fan-out with a numbered ring buffer (asyncio, single loop)."""
+
+    def __init__(self, backlog=BACKLOG, queue_size=SUBSCRIBER_QUEUE):
+        # Ids start at the current time in ms so they keep growing across API
+        # restarts and an old Last-Event-ID replays the whole new backlog.
+        self.last_id = int(time.time() * 1000)
+        self.ring = collections.deque(maxlen=backlog)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        # Callbacks run for every event on the loop (e.g. the job submitter)
+        self.handlers = []
+        self.published = 0
+        self.evicted = 0
+
+    def publish(self, event: dict):
+        """Number ``event``, remember it and push it to every subscriber."""
+        self.last_id += 1
+        event = dict(event, id=self.last_id)
+        self.ring.append(event)
+        self.published += 1
+        for handler in self.handlers:
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("event handler failed")
+        for q in list(self.subscribers):
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                # A stalled client must not hold events for everybody else
+                self.subscribers.discard(q)
+                self.evicted += 1
+                # Make room for the sentinel that tells it to reconnect
+                q.get_nowait()
+                q.put_nowait(None)
+        return event
+
+    def subscribe(self, last_id=None, types=None):
+        """Return ``(queue, missed)``: a live queue plus backlog events after ``last_id``.
+
+        A ``None`` read from the queue means the subscriber fell behind and
+        was dropped; it should reconnect with its last seen id.
+        """
+        q = asyncio.Queue(self.queue_size)
+        self.subscribers.add(q)
+        missed = []
+        if last_id is not None:
+            missed = [e for e in self.ring if e["id"] > last_id]
+        if types:
+            missed = [e for e in missed if matches(e, types)]
+        return q, missed
+
+    def unsubscribe(self, q):
+        self.subscribers.discard(q)
+
+    def stats(self):
+        return {"last_id": self.last_id, "published": self.published, "subscribers": len(self.subscribers),
+                "backlog": len(self.ring), "evicted": self.evicted}
+
+
+def matches(event, types):
+    """True when the event type equals or is under one of ``types`` ("job" matches "job.end")."""
+    t = event.get("type", "")
+    return any(t == p or t.startswith(p + ".") for p in types)
+
+
+def format_sse(event, name=True):
+    """Serialize one event as an SSE frame (``event:`` is its type when ``name``)."""
+    head = f"id: {event['id']}\n"
+    if name:
+        head += f"event: {event['type']}\n"
+    return head + "data: " + json.dumps(event, separators=(",", ":")) + "\n\n"
+
+
+async def listen(bus: EventBus, path=None):
+    """Accept producer connections on ``path`` and publish their events on ``bus`` until cancelled."""
+    path = EVENTS_SOCKET if path is None else path
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    data = await reader.readline()
+                except ValueError:
+                    # línea mayor que MAX_EVENT: el resto de la conexión ya no está alineado
+                    logger.warning("event line over %d bytes; closing the producer connection", MAX_EVENT)
+                    return
+                if not data:
+                    return
+                try:
+                    event = json.loads(data)
+                except ValueError:
+                    logger.warning("ignoring malformed event line (%d bytes)", len(data))
+                    continue
+                if isinstance(event, dict) and "type" in event:
+                    bus.publish(event)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(on_connection, path, limit=MAX_EVENT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -0,0 +1,238 @@
+"""Directory listings with file metadata, kept in memory for the API.
+
+A ``DirCache`` holds ``name -> (size, mtime)`` for the regular files of one
+directory. On Linux an inotify watch (through libc, no extra package) marks
+the names that changed, and only those are stat()ed again on the next
+lookup; a queue overflow or a lost watch rescans the whole directory.
+Without inotify (``BRIDGE_API_INOTIFY=0``, other systems, watch limit
+reached) the directory is rescanned when its mtime changes or the listing is
+older than ``BRIDGE_API_DIR_TTL`` seconds: files only growing do not touch
+the directory mtime, so their sizes may lag by up to that long.
+
+``version()`` changes with every change seen, for ETags.
+"""
+import os, stat, time, struct, ctypes, ctypes.util, threading, fnmatch, errno, logging
+
+# "0" para desactivar inotify y usar solo el mtime del directorio
+USE_INOTIFY = os.environ.get("BRIDGE_API_INOTIFY", "1") != "0"
+# Fallback: seconds a listing is served without rescanning an unchanged directory
+DIR_TTL = float(os.environ.get("BRIDGE_API_DIR_TTL", "5"))
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+_EVENT = struct.Struct("iIII")
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class Inotify:
+    """One inotify descriptor read by a daemon thread; calls ``callback(mask, name)`` per event."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.callbacks = {}
+        self.thread = threading.Thread(target=self._run, name="api-inotify", daemon=True)
+        self.thread.start()
+
+    def watch(self, path, callback):
+        wd = self._add(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        self.callbacks[wd] = callback
+        return wd
+
+    def unwatch(self, wd):
+        if self.callbacks.pop(wd, None) is not None:
+            self._rm(self.fd, wd)
+
+    def _run(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except InterruptedError:
+                continue
+            except OSError:
+                return
+            pos = 0
+            while pos + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b"\0")
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # cola desbordada: todos los directorios a releer
+                    for cb in list(self.callbacks.values()):
+                        cb(mask, None)
+                    continue
+                cb = self.callbacks.pop(wd, None) if mask & IN_IGNORED else self.callbacks.get(wd)
+                if cb is not None:
+                    try:
+                        cb(mask, os.fsdecode(name) if name else None)
+                    except Exception:
+                        logger.exception("inotify callback failed")
+
+
+_inotify = None
+_inotify_lock = threading.Lock()
+
+
+def get_inotify():
+    """Process-wide ``Inotify``, None when unavailable or turned off."""
+    global _inotify, USE_INOTIFY
+    with _inotify_lock:
+        if _inotify is None and USE_INOTIFY:
+            try:
+                _inotify = Inotify()
+            except (OSError, AttributeError):
+                logger.warning("inotify unavailable; directory listings are refreshed by mtime")
+                USE_INOTIFY = False
+        return _inotify
+
+
+class DirCache:
+    """``name -> (size, mtime)`` of the regular files in ``path``; thread-safe."""
+
+    def __init__(self, path, ttl=DIR_TTL):
+        self.path = str(path)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = None
+        self.dirty = set()
+        self.wd = None
+        self.generation = 0
+        self.boot = time.time_ns()
+        self.scanned = 0.0
+        self.dir_mtime = None
+        self.scans = 0
+        self.closed = False
+
+    def _on_event(self, mask, name):
+        with self.lock:
+            self.generation += 1
+            if name is None or mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                # releer todo en la próxima consulta
+                self.entries = None
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self.wd = None
+            elif self.entries is not None:
+                self.dirty.add(name)
+
+    def _watch(self):
+        inotify = get_inotify()
+        if inotify is None or self.wd is not None:
+            return
+        try:
+            self.wd = inotify.watch(self.path, self._on_event)
+            # lo anterior al watch no generó eventos
+            self.entries = None
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.warning("inotify watch limit reached; %s is refreshed by mtime", self.path)
+            self.wd = None
+
+    def _scan(self):
+        entries = {}
+        with os.scandir(self.path) as it:
+            for e in it:
+                try:
+                    if e.is_file():
+                        st = e.stat()
+                        entries[e.name] = (st.st_size, st.st_mtime)
+                except OSError:
+                    # borrado entre scandir y stat
+                    continue
+        self.scans += 1
+        return entries
+
+    def _refresh(self):
+        """Bring ``self.entries`` up to date; caller holds ``self.lock``."""
+        if self.wd is None and not self.closed:
+            self._watch()
+        if self.wd is None:
+            # sin inotify: el mtime del directorio cambia con cada alta, baja o rename
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self.entries, self.dir_mtime = {}, None
+                return
+            if (self.entries is None or mtime != self.dir_mtime
+                    or time.monotonic() - self.scanned > self.ttl):
+                entries = self._scan()
+                if entries != self.entries:
+                    self.generation += 1
+                self.entries = entries
+                self.dir_mtime = mtime
+                self.scanned = time.monotonic()
+            return
+        if self.entries is None:
+            self.dirty.clear()
+            try:
+                self.entries = self._scan()
+            except FileNotFoundError:
+                self.entries = {}
+            return
+        for name in self.dirty:
+            self._restat(name)
+        self.dirty.clear()
+
+    def _restat(self, name):
+        try:
+            st = os.stat(os.path.join(self.path, name))
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            self.entries.pop(name, None)
+            return None
+        self.entries[name] = (st.st_size, st.st_mtime)
+        return self.entries[name]
+
+    def files(self, pattern="*"):
+        """``{name: (size, mtime)}`` of the files matching ``pattern``."""
+        with self.lock:
+            self._refresh()
+            if pattern == "*":
+                return dict(self.entries)
+            return {n: v for n, v in self.entries.items() if fnmatch.fnmatchcase(n, pattern)}
+
+    def stat(self, name):
+        """``(size, mtime)`` of one file, None if it is not a regular file of this directory."""
+        if not name or "/" in name or name in (".", ".."):
+            return None
+        with self.lock:
+            self._refresh()
+            found = self.entries.get(name)
+            if found is None:
+                # recién creado y su evento aún no leído
+                found = self._restat(name)
+            return found
+
+    def version(self):
+        with self.lock:
+            self._refresh()
+            return f"{self.boot:x}-{self.generation}"
+
+    def close(self):
+        with self.lock:
+            if self.wd is not None and _inotify is not None:
+                _inotify.unwatch(self.wd)
+            self.wd = None
+            self.entries = None
+            self.closed = True
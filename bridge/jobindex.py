@@ -0,0 +1,571 @@
+"""Persistent job index (SQLite) kept next to the extracted joblogs.
+
+``JobLogExtractor`` inserts one row per job when its file is created and
+updates it on rename (RC) and END, so the API can list and filter jobs from
+indexed columns instead of globbing and stat()ing ``OUTDIR`` on every request.
+
+Job text goes to a trigram full-text table (``joblines``, SQLite FTS5) fed
+line by line by a background thread, so ``search`` finds any substring of
+three or more characters across the whole history without reading files.
+
+Rebuild the index from an existing spool directory with::
+
+    python3 jobindex.py rebuild [OUTDIR]
+"""
+import os, re, sys, time, sqlite3, threading, queue, logging, itertools
+
+import joblayout
+
+OUTDIR = os.environ.get("BRIDGE_OUTDIR", "/app/spool")
+# Ruta de la base de datos; "off" desactiva el índice
+INDEX_PATH = os.environ.get("BRIDGE_INDEX", os.path.join(OUTDIR, "jobindex.db"))
+
+# Full-text index of job lines: "on" (default) or "off"
+SEARCH = os.environ.get("BRIDGE_SEARCH", "on").lower() not in ("off", "0", "false", "no")
+
+# Ficheros que se indexan: joblogs del extractor (JOBnnnnn-NAME[-RCxxxx].txt) y legacy joblog_*
+INDEXED_PREFIXES = ("JOB", "joblog_")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,      -- file name (its directory in OUTDIR follows from it, see joblayout)
+    jobid TEXT,
+    jobname TEXT,
+    rc TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime REAL NOT NULL,
+    start_ts REAL,
+    end_ts REAL,
+    spool TEXT,                     -- spool file the job was received in
+    start_offset INTEGER,           -- byte offsets of the job body in that spool
+    end_offset INTEGER,
+    lines INTEGER                   -- line count, known once the job ended
+);
+CREATE INDEX IF NOT EXISTS jobs_mtime ON jobs (mtime);
+CREATE INDEX IF NOT EXISTS jobs_jobid ON jobs (jobid COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS jobs_jobname ON jobs (jobname COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS jobs_rc ON jobs (rc);
+-- Byte offset of every LINE_STEP-th line of each job file (line 1, 1+LINE_STEP, ...)
+CREATE TABLE IF NOT EXISTS lineoffsets (
+    job INTEGER NOT NULL,           -- jobs.id
+    line INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (job, line)
+) WITHOUT ROWID;
+-- Change counter behind the API's ETags: bumped by every write to jobs
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+CREATE TRIGGER IF NOT EXISTS jobs_version_ins AFTER INSERT ON jobs
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+CREATE TRIGGER IF NOT EXISTS jobs_version_upd AFTER UPDATE ON jobs
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+CREATE TRIGGER IF NOT EXISTS jobs_version_del AFTER DELETE ON jobs
+    BEGIN UPDATE meta SET value = value + 1 WHERE key = 'version'; END;
+"""
+
+# One row per job line; rowid = jobs.id << LINE_BITS | line number (1-based), so a
+# job's lines are a contiguous rowid range (context reads, deletes) and ORDER BY
+# rowid DESC lists newest jobs first.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS joblines USING fts5(text, tokenize='trigram');
+"""
+LINE_BITS = 24
+# Last line number whose text fits in a job's rowid range; later lines are not searchable
+MAX_TEXT_LINES = (1 << LINE_BITS) - 1
+# Lines between two entries of lineoffsets: a line window read skips at most this many lines
+LINE_STEP = 256
+# Shortest query the trigram index can answer
+MIN_SEARCH = 3
+
+logger = logging.getLogger("console_bridge")
+
+# Sort keys accepted by list_jobs -> SQL expression (ties broken by id, so order is stable)
+SORT_KEYS = {
+    "mtime": "mtime",
+    "size": "size",
+    "jobid": "COALESCE(jobid, '')",
+    "jobname": "COALESCE(jobname, '')",
+    "rc": "COALESCE(rc, '')",
+    "name": "name",
+}
+
+_JOBID_RE = re.compile(r"^JOB\d+$")
+
+
+def parse_job_filename(name: str):
+    """Return ``(job_id, job_name, job_rc)`` from names like ``JOB00001-NAME-RC0000.txt``."""
+    job_id = job_name = job_rc = None
+    stem = os.path.splitext(name)[0]
+    parts = stem.split('-')
+    # Expect filenames like: JOB00001-NAME-RC0000 (third segment is RC)
+    if parts and _JOBID_RE.match(parts[0]):
+        job_id = parts[0]
+        if len(parts) >= 2:
+            job_name = parts[1].split('.')[0].strip()
+        if len(parts) >= 3:
+            third = parts[2]
+            # normalize RC: if starts with 'RC' strip that prefix
+            job_rc = third[2:] if third.upper().startswith('RC') else third
+    elif _JOBID_RE.match(stem):
+        job_id = stem
+    return job_id, job_name, job_rc
+
+
+class JobIndex:
+    """Thread-safe wrapper around the ``jobs`` table (one connection, one lock)."""
+
+    def __init__(self, path=INDEX_PATH, readonly=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # WAL lets the API read while the bridge writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+            self._migrate()
+        self.db.row_factory = sqlite3.Row
+        self.search_enabled = False
+        if SEARCH:
+            try:
+                if not readonly:
+                    self.db.executescript(SEARCH_SCHEMA)
+                self.search_enabled = self.db.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'joblines'").fetchone() is not None
+            except sqlite3.OperationalError as e:
+                # SQLite sin FTS5/trigram: el API cae al escaneo de ficheros
+                logger.warning("full-text job search unavailable: %s", e)
+        self.feeder = None
+
+    def _migrate(self):
+        """Add columns introduced after an index file was created."""
+        cols = {r[1] for r in self.db.execute("PRAGMA table_info(jobs)")}
+        if "lines" not in cols:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN lines INTEGER")
+            self.db.commit()
+
+    def close(self):
+        if self.feeder:
+            self.feeder.flush()
+        with self.lock:
+            self.db.close()
+
+    @staticmethod
+    def _line_range(rowid):
+        return rowid << LINE_BITS, ((rowid + 1) << LINE_BITS) - 1
+
+    def _drop_lines(self, where, args):
+        """Delete the indexed text and line offsets of the jobs selected by ``where`` (lock held, in a transaction)."""
+        for (rowid,) in self.db.execute(f"SELECT id FROM jobs WHERE {where}", args).fetchall():
+            self.db.execute("DELETE FROM lineoffsets WHERE job = ?", (rowid,))
+            if self.search_enabled:
+                self.db.execute("DELETE FROM joblines WHERE rowid BETWEEN ? AND ?", self._line_range(rowid))
+
+    def job_started(self, name, jobid, jobname, rc=None, start_ts=None, spool=None, start_offset=None):
+        """Insert (or replace) the row for a newly created job file; returns its id."""
+        now = time.time()
+        with self.lock, self.db:
+            self._drop_lines("name = ?", (name,))
+            cur = self.db.execute(
+                "INSERT OR REPLACE INTO jobs (name, jobid, jobname, rc, size, mtime, start_ts, spool, start_offset)"
+                " VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                (name, jobid, jobname, rc, now, start_ts or now, spool, start_offset))
+            return cur.lastrowid
+
+    def job_renamed(self, rowid, name, rc):
+        with self.lock, self.db:
+            # A stale row may still hold the name (file removed behind our back)
+            self._drop_lines("name = ? AND id != ?", (name, rowid))
+            self.db.execute("DELETE FROM jobs WHERE name = ? AND id != ?", (name, rowid))
+            self.db.execute("UPDATE jobs SET name = ?, rc = ? WHERE id = ?", (name, rc, rowid))
+
+    def job_ended(self, rowid, size, end_offset=None, end_ts=None):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET size = ?, mtime = ?, end_ts = ?, end_offset = ? WHERE id = ?",
+                (size, now, end_ts or now, end_offset, rowid))
+
+    def finished_size(self):
+        """Total bytes of the finished job files (what retention's size budget counts)."""
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM jobs WHERE end_ts IS NOT NULL").fetchone()[0]
+
+    def oldest_jobs(self, limit, after=None):
+        """Finished jobs oldest first (``id``, ``name``, ``size``, ``mtime``); ``after`` is the last ``(mtime, id)``."""
+        sql = "SELECT id, name, size, mtime FROM jobs WHERE end_ts IS NOT NULL"
+        args = []
+        if after is not None:
+            sql += " AND (mtime, id) > (?, ?)"
+            args.extend(after)
+        sql += " ORDER BY mtime, id LIMIT ?"
+        args.append(int(limit))
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql, args)]
+
+    def remove_jobs(self, rowids):
+        """Delete the rows, line offsets and indexed text of jobs whose files are gone."""
+        if not rowids:
+            return
+        with self.lock, self.db:
+            marks = ",".join("?" * len(rowids))
+            self._drop_lines(f"id IN ({marks})", list(rowids))
+            self.db.execute(f"DELETE FROM jobs WHERE id IN ({marks})", list(rowids))
+
+    def remove_names(self, names):
+        """Same as ``remove_jobs`` for the rows of the given file names."""
+        if not names:
+            return
+        with self.lock, self.db:
+            marks = ",".join("?" * len(names))
+            self._drop_lines(f"name IN ({marks})", list(names))
+            self.db.execute(f"DELETE FROM jobs WHERE name IN ({marks})", list(names))
+
+    def list_jobs(self, prefix="JOB", job_name=None, job_id=None, job_name_prefix=None,
+                  rc_min=None, rc_max=None, since_mtime=None, until_mtime=None,
+                  sort="mtime", order="desc", limit=None, after=None):
+        """Rows whose file name starts with ``prefix`` as dicts.
+
+        Filters map to indexed columns: exact ``job_name``/``job_id`` and
+        ``job_name_prefix`` (case-insensitive), ``rc_min``/``rc_max`` (string
+        range, so RCs compare as 4-digit codes), ``since_mtime`` (exclusive)
+        and ``until_mtime``. ``after`` is the ``(sort key, id)`` of the last
+        row of the previous page (keyset pagination); see ``row_cursor``.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"unknown sort key {sort!r}")
+        key = SORT_KEYS[sort]
+        desc = order.lower() == "desc"
+        sql = "SELECT * FROM jobs WHERE name >= ? AND name < ?"
+        args = [prefix, prefix + "\uffff"]
+        if job_name:
+            sql += " AND jobname = ? COLLATE NOCASE"
+            args.append(job_name.strip())
+        if job_id:
+            sql += " AND jobid = ? COLLATE NOCASE"
+            args.append(job_id.strip())
+        if job_name_prefix:
+            # Range instead of LIKE so the NOCASE jobname index is always usable
+            sql += " AND jobname >= ? COLLATE NOCASE AND jobname < ? COLLATE NOCASE"
+            args.extend([job_name_prefix.strip(), job_name_prefix.strip() + "\uffff"])
+        if rc_min is not None:
+            sql += " AND rc >= ?"
+            args.append(rc_min)
+        if rc_max is not None:
+            sql += " AND rc <= ?"
+            args.append(rc_max)
+        if since_mtime is not None:
+            sql += " AND mtime > ?"
+            args.append(since_mtime)
+        if until_mtime is not None:
+            sql += " AND mtime <= ?"
+            args.append(until_mtime)
+        if after is not None:
+            sql += f" AND ({key}, id) {'<' if desc else '>'} (?, ?)"
+            args.extend(after)
+        direction = "DESC" if desc else "ASC"
+        sql += f" ORDER BY {key} {direction}, id {direction}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql, args)]
+
+    @staticmethod
+    def row_cursor(row, sort="mtime"):
+        """``after`` value that continues a listing right after ``row``."""
+        value = row[sort] if sort in ("mtime", "size", "name") else (row[sort] or "")
+        return (value, row["id"])
+
+    def index_text(self, rowid, data):
+        """Queue job text (ASCII/UTF-8 bytes, any chunking) for the line offsets and full-text index.
+
+        ``data`` is kept as is until indexed: pass a copy, not a live buffer.
+        """
+        if rowid is None:
+            return
+        if self.feeder is None:
+            self.feeder = LineFeeder(self)
+        self.feeder.put(rowid, data)
+
+    def text_done(self, rowid):
+        """The job has no more text: index its last, unterminated line."""
+        if self.feeder is not None and rowid is not None:
+            self.feeder.put(rowid, None)
+
+    def add_lines(self, rowid, first_line, lines, offsets=()):
+        """Insert ``lines`` of job ``rowid`` numbered from ``first_line`` and ``(line, offset)`` checkpoints."""
+        base = rowid << LINE_BITS
+        # past MAX_TEXT_LINES the rowids would fall in the next job's range
+        lines = lines[:max(MAX_TEXT_LINES - first_line + 1, 0)]
+        with self.lock, self.db:
+            if lines and self.search_enabled:
+                self.db.executemany("INSERT OR REPLACE INTO joblines (rowid, text) VALUES (?, ?)",
+                                    ((base + first_line + i, text) for i, text in enumerate(lines)))
+            if offsets:
+                self.db.executemany("INSERT OR REPLACE INTO lineoffsets (job, line, offset) VALUES (?, ?, ?)",
+                                    ((rowid, line, offset) for line, offset in offsets))
+
+    def set_line_count(self, rowid, lines):
+        with self.lock, self.db:
+            self.db.execute("UPDATE jobs SET lines = ? WHERE id = ?", (lines, rowid))
+
+    def line_checkpoint(self, name, line):
+        """``(line count or None, (checkpoint line, byte offset))`` for reading ``name`` from ``line``.
+
+        The checkpoint is the nearest indexed line at or before ``line``
+        (``(1, 0)`` when the file has no offsets yet).
+        """
+        with self.lock:
+            row = self.db.execute("SELECT id, lines FROM jobs WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None, (1, 0)
+            cp = self.db.execute(
+                "SELECT line, offset FROM lineoffsets WHERE job = ? AND line <= ? ORDER BY line DESC LIMIT 1",
+                (row["id"], line)).fetchone()
+        return row["lines"], (tuple(cp) if cp else (1, 0))
+
+    def search(self, text, limit=100, context=0, prefix=None):
+        """Lines containing ``text`` (case-insensitive), newest job first.
+
+        Returns dicts with the job row fields plus ``line``, ``text`` and,
+        with ``context``, the ``before``/``after`` lines.
+        """
+        if not self.search_enabled:
+            raise ValueError("full-text search is not enabled")
+        if len(text) < MIN_SEARCH:
+            raise ValueError(f"search text must have at least {MIN_SEARCH} characters")
+        phrase = '"' + text.replace('"', '""') + '"'
+        mask = (1 << LINE_BITS) - 1
+        out = []
+        jobs = {}
+        last = None
+        # One page of matches per lock hold, so the LineFeeder can write in between
+        while len(out) < limit:
+            page = max(limit - len(out), 64)
+            with self.lock:
+                if last is None:
+                    rows = self.db.execute("SELECT rowid, text FROM joblines WHERE joblines MATCH ? "
+                                           "ORDER BY rowid DESC LIMIT ?", (phrase, page)).fetchall()
+                else:
+                    rows = self.db.execute("SELECT rowid, text FROM joblines WHERE joblines MATCH ? AND rowid < ? "
+                                           "ORDER BY rowid DESC LIMIT ?", (phrase, last, page)).fetchall()
+                for rowid, line_text in rows:
+                    job_rowid = rowid >> LINE_BITS
+                    if job_rowid not in jobs:
+                        row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_rowid,)).fetchone()
+                        jobs[job_rowid] = dict(row) if row and (not prefix or row["name"].startswith(prefix)) else None
+                    job = jobs[job_rowid]
+                    if job is None:
+                        continue
+                    hit = dict(job, line=rowid & mask, text=line_text)
+                    if context:
+                        around = dict(self.db.execute(
+                            "SELECT rowid, text FROM joblines WHERE rowid BETWEEN ? AND ?",
+                            (max(rowid - context, job_rowid << LINE_BITS), rowid + context)).fetchall())
+                        hit["before"] = [around[r] for r in range(rowid - context, rowid) if r in around]
+                        hit["after"] = [around[r] for r in range(rowid + 1, rowid + context + 1) if r in around]
+                    out.append(hit)
+                    if len(out) >= limit:
+                        break
+            if len(rows) < page:
+                break
+            last = rows[-1][0]
+        return out
+
+    def version(self):
+        """Change counter of the jobs table, or None for an index without one."""
+        with self.lock:
+            try:
+                row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            except sqlite3.OperationalError:
+                return None
+        return row[0] if row else None
+
+    def rebuild(self, outdir=OUTDIR):
+        """Re-create every row from the job files found in ``outdir``; returns the row count."""
+        with self.lock:
+            # Keep what only the extractor knows (row id, stream offsets, start time) for files still present
+            known = {r["name"]: r for r in self.db.execute(
+                "SELECT id, name, start_ts, spool, start_offset, end_offset, lines FROM jobs")}
+        rows = {}
+        # OUTDIR first: a name also present in its JOBID directory is served from there (joblayout)
+        for entry in joblayout.iter_job_files(outdir, INDEXED_PREFIXES):
+            st = entry.stat()
+            job_id, job_name, job_rc = parse_job_filename(entry.name)
+            prev = known.get(entry.name)
+            extra = (prev["id"], prev["start_ts"], prev["spool"], prev["start_offset"], prev["end_offset"],
+                     prev["lines"]) if prev else (None,) * 6
+            rows[entry.name] = (entry.name, job_id, job_name, job_rc, st.st_size, st.st_mtime, st.st_mtime) + extra
+        # Files new to the index get ids above every old one: an id SQLite picked itself
+        # could be one a later row keeps, or a deleted job's with its lines still stored
+        next_id = max((r["id"] for r in known.values()), default=0) + 1
+        new_ids = []
+        for name, row in rows.items():
+            if row[7] is None:
+                rows[name] = row[:7] + (next_id,) + row[8:]
+                new_ids.append(next_id)
+                next_id += 1
+        rows = list(rows.values())
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM jobs")
+            self.db.executemany(
+                "INSERT INTO jobs (name, jobid, jobname, rc, size, mtime, end_ts, id, start_ts, spool, start_offset, end_offset, lines)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+            # Lines of files that are gone, and any left under the ids just assigned
+            self.db.execute("DELETE FROM lineoffsets WHERE job NOT IN (SELECT id FROM jobs)")
+            if self.search_enabled:
+                self.db.execute(f"DELETE FROM joblines WHERE (rowid >> {LINE_BITS}) NOT IN (SELECT id FROM jobs)")
+            for rowid in new_ids:
+                self.db.execute("DELETE FROM lineoffsets WHERE job = ?", (rowid,))
+                if self.search_enabled:
+                    self.db.execute("DELETE FROM joblines WHERE rowid BETWEEN ? AND ?", self._line_range(rowid))
+        self.index_missing_text(outdir)
+        return len(rows)
+
+    def add_jobs(self, rows):
+        """Insert or replace many finished jobs in one transaction (see ``reextract.py``).
+
+        ``rows`` are dicts with the ``jobs`` columns ``name``, ``jobid``,
+        ``jobname``, ``rc``, ``size``, ``mtime``, ``start_ts``, ``end_ts``,
+        ``spool``, ``start_offset`` and ``end_offset``.
+        """
+        with self.lock, self.db:
+            for row in rows:
+                self._drop_lines("name = ?", (row["name"],))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO jobs (name, jobid, jobname, rc, size, mtime, start_ts, end_ts, spool, start_offset, end_offset)"
+                " VALUES (:name, :jobid, :jobname, :rc, :size, :mtime, :start_ts, :end_ts, :spool, :start_offset, :end_offset)",
+                rows)
+
+    def index_missing_text(self, outdir=OUTDIR):
+        """Index the lines of jobs that have none yet (files written without the bridge)."""
+        with self.lock:
+            jobs = self.db.execute("SELECT id, name FROM jobs WHERE lines IS NULL").fetchall()
+        for rowid, name in jobs:
+            try:
+                with open(joblayout.find_job_file(outdir, name) or os.path.join(outdir, name), "rb") as f:
+                    while data := f.read(1 << 20):
+                        self.index_text(rowid, data)
+            except OSError as e:
+                logger.warning("cannot index text of %s: %s", name, e)
+                continue
+            self.text_done(rowid)
+        if self.feeder:
+            self.feeder.flush()
+
+
+class LineFeeder:
+    """Background thread splitting job text into lines for ``joblines`` and ``lineoffsets``.
+
+    The extractor only queues the bytes it wrote; splitting, decoding and the
+    inserts happen here, batched per job and queue drain. The
+    queue is bounded, so a slow index pushes back on the extractor instead of
+    growing memory.
+    """
+
+    QUEUE_ITEMS = 1024
+    # Lines per INSERT batch
+    BATCH = 5000
+
+    def __init__(self, index):
+        self.index = index
+        self.queue = queue.Queue(self.QUEUE_ITEMS)
+        # rowid -> [next line number, unterminated tail, file offset of that tail, text capped]
+        self.partial = {}
+        self.thread = threading.Thread(target=self.run, name="jobindex-lines", daemon=True)
+        self.thread.start()
+
+    def put(self, rowid, data):
+        self.queue.put((rowid, data))
+
+    def flush(self):
+        """Wait until everything queued so far is in the index."""
+        self.queue.join()
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.QUEUE_ITEMS:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._process(items)
+            except Exception:
+                logger.exception("job text indexing failed")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def _process(self, items):
+        # rowid -> [first line, texts, (line, offset) checkpoints]
+        batches = {}
+        text = self.index.search_enabled
+        for rowid, data in items:
+            state = self.partial.setdefault(rowid, [1, b"", 0, False])
+            done = data is None
+            lines = (state[1] + (b"\n" if done and state[1] else data or b"")).split(b"\n")
+            state[1] = lines.pop()
+            if lines:
+                batch = batches.setdefault(rowid, [state[0], [], []])
+                if text and not state[3]:
+                    room = MAX_TEXT_LINES - state[0] + 1
+                    if len(lines) > room:
+                        # el resto del job sigue con offsets y número de líneas, pero no se busca
+                        state[3] = True
+                        logger.warning("job %d has more than %d lines; the rest of its text is not indexed",
+                                       rowid, MAX_TEXT_LINES)
+                    batch[1].extend(l.rstrip(b"\r").decode("utf-8", "replace") for l in lines[:room])
+                # line numbers n with (n - 1) % LINE_STEP == 0 get a checkpoint
+                first = -(state[0] - 1) % LINE_STEP
+                if first < len(lines):
+                    starts = list(itertools.accumulate((len(l) + 1 for l in lines), initial=state[2]))
+                    batch[2].extend((state[0] + i, starts[i]) for i in range(first, len(lines), LINE_STEP))
+                state[2] += sum(map(len, lines)) + len(lines)
+                state[0] += len(lines)
+                if len(batch[1]) >= self.BATCH:
+                    self._insert(rowid, *batches.pop(rowid))
+            if done:
+                self._insert(rowid, *batches.pop(rowid, (0, [], [])))
+                self.index.set_line_count(rowid, state[0] - 1)
+                del self.partial[rowid]
+        for rowid, batch in batches.items():
+            self._insert(rowid, *batch)
+
+    def _insert(self, rowid, first, lines, offsets):
+        if lines or offsets:
+            self.index.add_lines(rowid, first, lines, offsets)
+
+
+def open_index(path=INDEX_PATH, readonly=False):
+    """Return a ``JobIndex`` for ``path``, or None when the index is turned off."""
+    if not path or path.lower() == "off":
+        return None
+    return JobIndex(path, readonly=readonly)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the bridge job index")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("rebuild", help="re-create the index from the job files in a spool directory")
+    p.add_argument("outdir", nargs="?", default=OUTDIR)
+    p.add_argument("--index", default=None, help="index path (default: BRIDGE_INDEX or OUTDIR/jobindex.db)")
+    args = parser.parse_args(argv)
+    if args.cmd == "rebuild":
+        path = args.index or (INDEX_PATH if args.outdir == OUTDIR else os.path.join(args.outdir, "jobindex.db"))
+        index = JobIndex(path)
+        t0 = time.time()
+        n = index.rebuild(args.outdir)
+        index.close()
+        print(f"indexed {n} job files from {args.outdir} into {path} in {time.time() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
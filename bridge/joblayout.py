@@ -0,0 +1,183 @@
+"""Where the joblogs live inside OUTDIR.
+
+Joblogs are kept in one subdirectory per JOBID range: ``JOB00123-NAME-RC0000.txt``
+goes to ``OUTDIR/JOB001xx/`` (``BRIDGE_SHARD_DIGITS`` trailing digits per
+directory, default 2 = 100 JOBIDs). The directory follows from the name, so
+a name is found with one stat however many jobs are kept, and a recycled
+JOBID lands next to its earlier copies, where ``publish_job`` keeps names
+unique. Files without a JOBID (``joblog_*``) stay in ``OUTDIR`` itself, and
+so do joblogs written before this layout until they are moved with::
+
+    python3 joblayout.py migrate [OUTDIR]
+
+Lookups fall back to ``OUTDIR``, so unmoved files are still served.
+``BRIDGE_LAYOUT=flat`` writes every joblog to ``OUTDIR`` as before.
+"""
+import os, re, sys, time, errno, itertools, logging
+
+OUTDIR = os.environ.get("BRIDGE_OUTDIR", "/app/spool")
+# "sharded" (un directorio por rango de JOBID) o "flat"
+LAYOUT = os.environ.get("BRIDGE_LAYOUT", "sharded").lower()
+# JOBID digits replaced by "x" in the directory name (10 ** SHARD_DIGITS JOBIDs per directory)
+SHARD_DIGITS = int(os.environ.get("BRIDGE_SHARD_DIGITS", "2"))
+
+SHARD_RE = re.compile(r"^JOB\d*x+$")
+_JOBID_RE = re.compile(r"^JOB(\d+)(?=[-.]|$)")
+
+# Suffix for a joblog whose name is taken (JOBID reused after a JES2 cold start) when
+# the job has no index row id: milliseconds at start, +1 per use, so it keeps growing across restarts
+_name_seq = itertools.count(time.time_ns() // 1_000_000)
+# Directories already created by this process
+_made = set()
+# os.link errors meaning the filesystem has no hard links (anything else is a real failure)
+_NO_LINK_ERRNOS = {errno.EPERM, errno.EXDEV, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+logger = logging.getLogger("console_bridge")
+
+
+def shard_of(name: str) -> str:
+    """Subdirectory of OUTDIR for job file ``name`` ("" = OUTDIR itself)."""
+    if LAYOUT == "flat" or SHARD_DIGITS <= 0:
+        return ""
+    m = _JOBID_RE.match(name)
+    if not m or len(m.group(1)) <= SHARD_DIGITS:
+        return ""
+    return "JOB" + m.group(1)[:-SHARD_DIGITS] + "x" * SHARD_DIGITS
+
+
+def job_dir(outdir: str, name: str, create=False) -> str:
+    """Directory job file ``name`` belongs in (created with ``create``)."""
+    shard = shard_of(name)
+    d = os.path.join(outdir, shard) if shard else outdir
+    if create and d not in _made:
+        os.makedirs(d, exist_ok=True)
+        _made.add(d)
+    return d
+
+
+def find_job_file(outdir: str, name: str):
+    """Path of job file ``name``: its directory first, then OUTDIR (not migrated); None if missing."""
+    for d in dict.fromkeys((job_dir(outdir, name), outdir)):
+        path = os.path.join(d, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def job_dirs(outdir: str):
+    """OUTDIR followed by its JOBID directories."""
+    try:
+        with os.scandir(outdir) as it:
+            shards = sorted(e.path for e in it if SHARD_RE.match(e.name) and e.is_dir())
+    except FileNotFoundError:
+        return [outdir]
+    return [outdir] + shards
+
+
+def iter_job_files(outdir: str, prefixes=("JOB", "joblog_")):
+    """``os.DirEntry`` of every job file under ``outdir`` whose name starts with ``prefixes``."""
+    for d in job_dirs(outdir):
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.name.startswith(prefixes) and entry.is_file():
+                        yield entry
+        except FileNotFoundError:
+            # directorio borrado entre el listado y el scandir
+            continue
+
+
+def _link_new(src: str, dst: str) -> bool:
+    """Make ``dst`` name the file ``src`` unless ``dst`` exists; one syscall, no probing."""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        return False
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        # sin enlaces duros (vfat, algunos montajes): reservar el nombre y reemplazarlo
+        try:
+            os.close(os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            return False
+        try:
+            os.replace(src, dst)
+        except OSError:
+            # no dejar publicado un fichero vacío
+            os.unlink(dst)
+            raise
+        return True
+    os.unlink(src)
+    return True
+
+
+def publish_job(tmp: str, path: str, seq=None) -> str:
+    """Publish the finished job file ``tmp`` as ``path`` atomically, never replacing a file.
+
+    A taken name becomes ``base-<seq>.ext``: the job index row id when given,
+    else the next value of a monotonic counter. Returns the path used.
+    """
+    if _link_new(tmp, path):
+        return path
+    base, ext = os.path.splitext(path)
+    if seq is not None and _link_new(tmp, f"{base}-{seq}{ext}"):
+        return f"{base}-{seq}{ext}"
+    while True:
+        candidate = f"{base}-{next(_name_seq)}{ext}"
+        if _link_new(tmp, candidate):
+            return candidate
+
+
+def migrate(outdir=OUTDIR):
+    """Move the joblogs found directly in ``outdir`` into their JOBID directories.
+
+    Safe while the bridge runs (each move is a no-clobber link plus unlink).
+    Returns ``(moved, renamed)``: a file whose name was already taken in its
+    directory gets a suffix, and the job index must then be rebuilt.
+    """
+    moved = renamed = 0
+    with os.scandir(outdir) as it:
+        entries = [e for e in it if shard_of(e.name) and e.is_file()]
+    for entry in entries:
+        dst = os.path.join(job_dir(outdir, entry.name, create=True), entry.name)
+        try:
+            path = publish_job(entry.path, dst)
+        except OSError as e:
+            logger.error("cannot move %s: %s", entry.path, e)
+            continue
+        moved += 1
+        if path != dst:
+            renamed += 1
+            logger.warning("%s already existed; moved as %s", dst, os.path.basename(path))
+    return moved, renamed
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the joblog layout of a spool directory")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("migrate", help="move joblogs from OUTDIR into their JOBID directories")
+    p.add_argument("outdir", nargs="?", default=OUTDIR)
+    p.add_argument("--index", default=None, help="index path (default: BRIDGE_INDEX or OUTDIR/jobindex.db)")
+    args = parser.parse_args(argv)
+    if args.cmd == "migrate":
+        if not shard_of("JOB00001"):
+            print("BRIDGE_LAYOUT is flat: nothing to migrate")
+            return 1
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        t0 = time.time()
+        moved, renamed = migrate(args.outdir)
+        print(f"moved {moved} joblog(s) into JOBID directories of {args.outdir} in {time.time() - t0:.2f}s")
+        if renamed:
+            import jobindex
+            path = args.index or (jobindex.INDEX_PATH if args.outdir == OUTDIR else os.path.join(args.outdir, "jobindex.db"))
+            index = jobindex.open_index(path) if os.path.exists(path) else None
+            if index is not None:
+                n = index.rebuild(args.outdir)
+                index.close()
+                print(f"{renamed} renamed on collision; rebuilt {path} ({n} job files)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Search joblogs and the raw dump, and read line windows of large files.
+
+Literal queries of ``jobindex.MIN_SEARCH`` or more characters are answered by
+the job index's trigram table. Regular expressions, shorter queries, the raw
+dump and trees without an index fall back to ``scan_file``, which streams a
+file in ``BLOCK`` reads and only splits out the lines that match.
+"""
+import os, re, glob, collections
+
+import jobindex
+import joblayout
+
+# Bytes read per step of a streaming scan
+BLOCK = 1 << 20
+# A "line" longer than this is cut so one scan never holds more than that in memory
+MAX_LINE = 16 << 20
+
+
+def decode(line: bytes) -> str:
+    return line.rstrip(b"\r").decode("utf-8", "replace")
+
+
+def compile_query(q: str, regex=False):
+    """Bytes pattern for ``scan_file``: case-insensitive, ``^``/``$`` per line."""
+    pattern = q.encode("utf-8") if regex else re.escape(q.encode("utf-8"))
+    return re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+
+
+def _before(data, start, n, tail):
+    """Up to ``n`` lines ending right before ``data[start]``, topped up from ``tail``."""
+    out = []
+    end = start - 1
+    while len(out) < n and end >= 0:
+        ls = data.rfind(b"\n", 0, end) + 1
+        out.append(decode(data[ls:end]))
+        end = ls - 1
+    out.reverse()
+    if len(out) < n and tail:
+        out = list(tail)[-(n - len(out)):] + out
+    return out
+
+
+def _after(data, start, cut, n):
+    out = []
+    while len(out) < n and start < cut:
+        le = data.find(b"\n", start, cut)
+        le = cut if le < 0 else le
+        out.append(decode(data[start:le]))
+        start = le + 1
+    return out
+
+
+def scan_file(path, pattern, context=0, limit=100, size=None):
+    """Lines of ``path`` matching the bytes ``pattern``, as a list of hits.
+
+    Each hit has the 1-based ``line``, its byte ``offset`` in the file, its
+    ``text`` and, with ``context``, the ``before``/``after`` lines. Memory
+    stays around ``BLOCK`` whatever the file size. With ``size`` only the
+    first ``size`` bytes are read, as if the file ended there.
+    """
+    hits = []
+    # hits still collecting 'after' lines from the next block
+    waiting = []
+    tail = collections.deque(maxlen=context)
+    line_no = 1
+    offset = 0
+    carry = b""
+    left = size
+    with open(path, "rb") as f:
+        while len(hits) < limit or waiting:
+            block = f.read(BLOCK if left is None else min(BLOCK, left))
+            if left is not None:
+                left -= len(block)
+            data = carry + block
+            if not data:
+                break
+            cut = len(data) if not block or len(data) > MAX_LINE else data.rfind(b"\n") + 1
+            if cut <= 0:
+                carry = data
+                continue
+            for hit in waiting:
+                hit["after"] += _after(data, 0, cut, context - len(hit["after"]))
+            waiting = [h for h in waiting if len(h["after"]) < context]
+            pos = counted = 0
+            while len(hits) < limit:
+                m = pattern.search(data, pos, cut)
+                if not m:
+                    break
+                ls = data.rfind(b"\n", 0, m.start()) + 1
+                le = data.find(b"\n", m.start(), cut)
+                le = cut if le < 0 else le
+                line_no += data.count(b"\n", counted, ls)
+                counted = ls
+                hit = {"line": line_no, "offset": offset + ls, "text": decode(data[ls:le])}
+                if context:
+                    hit["before"] = _before(data, ls, context, tail)
+                    hit["after"] = _after(data, le + 1, cut, context)
+                    if len(hit["after"]) < context and block:
+                        waiting.append(hit)
+                hits.append(hit)
+                # una coincidencia por línea
+                pos = le + 1
+                if pos >= cut:
+                    break
+            line_no += data.count(b"\n", counted, cut)
+            if context:
+                tail.extend(_before(data, cut, context, None))
+            offset += cut
+            carry = data[cut:]
+            if not block:
+                break
+    return hits
+
+
+def iter_line_window(path, start=1, end=None, checkpoint=None):
+    """Yield the raw bytes of lines ``start``..``end`` (1-based, inclusive) of ``path``.
+
+    ``checkpoint`` is a known ``(line, byte offset)`` at or before ``start``
+    (see ``JobIndex.line_checkpoint``), so only the lines after it are
+    skipped. Reads ``BLOCK`` bytes at a time; ``end=None`` reads to EOF.
+    """
+    line, offset = checkpoint or (1, 0)
+    if line > start:
+        line, offset = 1, 0
+    with open(path, "rb") as f:
+        if offset:
+            # a stale checkpoint (file rewritten) must land right after a newline
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                line, offset = 1, 0
+        f.seek(offset)
+        while block := f.read(BLOCK):
+            pos = 0
+            if line < start:
+                newlines = block.count(b"\n")
+                if newlines < start - line:
+                    line += newlines
+                    continue
+                while line < start:
+                    pos = block.index(b"\n", pos) + 1
+                    line += 1
+            if end is None:
+                yield block[pos:]
+                continue
+            p = pos
+            while line <= end and (nl := block.find(b"\n", p)) >= 0:
+                p = nl + 1
+                line += 1
+            if line > end:
+                yield block[pos:p]
+                return
+            yield block[pos:]
+
+
+def job_hit(row, hit):
+    """Search hit for a job file (``row`` as in ``jobindex`` or a parsed file name)."""
+    out = {"file-name": row["name"], "job-id": row.get("jobid"), "job-name": row.get("jobname"),
+           "job-rc": row.get("rc"), "line": hit["line"], "text": hit["text"]}
+    for k in ("offset", "before", "after"):
+        if k in hit:
+            out[k] = hit[k]
+    return out
+
+
+def _job_files(outdir, index):
+    """Job files newest first (from the index when available)."""
+    if index is not None:
+        for row in index.list_jobs(prefix=""):
+            if row["name"].startswith(jobindex.INDEXED_PREFIXES):
+                yield row
+        return
+    files = []
+    for entry in joblayout.iter_job_files(outdir, jobindex.INDEXED_PREFIXES):
+        try:
+            files.append((entry.stat().st_mtime, entry.name))
+        except OSError:
+            continue
+    files.sort(reverse=True)
+    for _, name in files:
+        job_id, job_name, job_rc = jobindex.parse_job_filename(name)
+        yield {"name": name, "jobid": job_id, "jobname": job_name, "rc": job_rc}
+
+
+def search_joblogs(q, outdir, index=None, regex=False, limit=100, context=0):
+    """Return ``(mode, hits)``; mode is "index" or "scan"."""
+    if not regex and index is not None and index.search_enabled and len(q) >= jobindex.MIN_SEARCH:
+        # jobs still being written have a temp name and are left out
+        hits = index.search(q, limit=limit, context=context, prefix=jobindex.INDEXED_PREFIXES)
+        return "index", [job_hit(row, row) for row in hits]
+    pattern = compile_query(q, regex)
+    hits = []
+    for row in _job_files(outdir, index):
+        path = joblayout.find_job_file(outdir, row["name"])
+        if path is None:
+            continue
+        try:
+            found = scan_file(path, pattern, context, limit - len(hits))
+        except OSError:
+            # borrado entre el listado y la lectura
+            continue
+        hits.extend(job_hit(row, h) for h in found)
+        if len(hits) >= limit:
+            break
+    return "scan", hits
+
+
+def raw_dumps(logdir):
+    """Raw dump files (every printer), current file first."""
+    return sorted(glob.glob(os.path.join(glob.escape(logdir), "console_bridge-raw*.bin")),
+                  key=lambda p: (os.path.basename(p) != "console_bridge-raw.bin", p))
+
+
+def search_raw(q, logdir, regex=False, limit=100, context=0, size=None):
+    """Hits of ``q`` in the raw dumps, newest first (``size``: bytes read per dump)."""
+    pattern = compile_query(q, regex)
+    hits = []
+    for path in raw_dumps(logdir):
+        for h in scan_file(path, pattern, context, limit - len(hits), size):
+            hits.append(dict(h, file=os.path.basename(path)))
+        if len(hits) >= limit:
+            break
+    return hits
@@ -0,0 +1,260 @@
+"""End-to-end job lifecycle, joining console events with printer output.
+
+The API feeds every event of its bus to a ``JobTracker``: console_watch
+reports a job submitted ($HASP100, with its JOBID), started ($HASP373) and
+ended ($HASP395), the extractor reports its output being printed (``job.id``)
+and finished (``job.end``, with RC and file). The console only names the job
+on $HASP373/$HASP395, so those go to the oldest open job of that name.
+
+Jobs are kept in memory by JOBID, least recently updated evicted first
+beyond ``BRIDGE_JOBSTATE_MAX``. Changed jobs are appended as JSON lines to
+``BRIDGE_JOBSTATE`` once per ``FLUSH_SECONDS``; the file is rewritten when
+it holds too many stale lines, and read back on start. Per job::
+
+    queue_seconds  started - submitted     (waiting for an initiator)
+    run_seconds    ended - started
+    print_seconds  printed - ended         (output through the 1403 and the extractor)
+"""
+import os, json, time, collections, logging
+
+import metrics
+
+OUTDIR = os.environ.get("BRIDGE_OUTDIR", "/app/spool")
+# Fichero de estado; "off" lo deja solo en memoria
+JOBSTATE_PATH = os.environ.get("BRIDGE_JOBSTATE", os.path.join(OUTDIR, "jobstate.jsonl"))
+# Jobs kept (LRU)
+CAPACITY = int(os.environ.get("BRIDGE_JOBSTATE_MAX", "10000"))
+# Seconds between appends of changed jobs
+FLUSH_SECONDS = 1.0
+
+# timestamp fields in lifecycle order, and the state a job is in once each is set
+STAGES = (("submitted_ts", "submitted"), ("started_ts", "running"), ("ended_ts", "ended"),
+          ("print_ts", "printing"), ("printed_ts", "printed"))
+DURATIONS = (("queue", "submitted_ts", "started_ts"), ("run", "started_ts", "ended_ts"),
+             ("print", "ended_ts", "printed_ts"), ("total", "submitted_ts", "printed_ts"))
+
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+M_STAGE = metrics.histogram("bridge_job_stage_seconds", "Time jobs spend in each lifecycle stage",
+                            ("stage",), buckets=STAGE_BUCKETS)
+M_TRACKED = metrics.gauge("bridge_jobs_tracked", "Jobs in the lifecycle table")
+
+logger = logging.getLogger("console_bridge")
+
+
+def state_of(job):
+    state = "unknown"
+    for field, name in STAGES:
+        if job.get(field) is not None:
+            state = name
+    return state
+
+
+def with_durations(job):
+    """Copy of ``job`` with its state and the stage durations known so far."""
+    out = dict(job, state=state_of(job))
+    for name, a, b in DURATIONS:
+        if job.get(a) is not None and job.get(b) is not None:
+            out[f"{name}_seconds"] = round(job[b] - job[a], 3)
+    return out
+
+
+def percentiles(values, ps=(50, 95, 99)):
+    values = sorted(values)
+    if not values:
+        return dict.fromkeys((f"p{p}" for p in ps), None)
+    return {f"p{p}": round(values[min(len(values) - 1, len(values) * p // 100)], 3) for p in ps}
+
+
+class JobTracker:
+    """JOBID -> lifecycle timestamps; single-threaded (the API's event loop)."""
+
+    def __init__(self, path=JOBSTATE_PATH, capacity=CAPACITY):
+        self.path = None if not path or path.lower() == "off" else path
+        self.capacity = capacity
+        self.jobs = collections.OrderedDict()
+        # jobname -> JOBIDs not ended yet, oldest first, for $HASP373/$HASP395
+        self.open = collections.defaultdict(list)
+        self.dirty = set()
+        self.lines = 0
+        if self.path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    self.lines += 1
+                    try:
+                        job = json.loads(line)
+                    except ValueError:
+                        # línea cortada por una caída
+                        continue
+                    self.jobs[job["jobid"]] = job
+                    self.jobs.move_to_end(job["jobid"])
+        except FileNotFoundError:
+            return
+        while len(self.jobs) > self.capacity:
+            self.jobs.popitem(last=False)
+        for jobid, job in self.jobs.items():
+            if job.get("jobname") and self._is_open(job):
+                self.open[job["jobname"]].append(jobid)
+        M_TRACKED.set(len(self.jobs))
+        logger.info("job lifecycle: %d job(s) loaded from %s", len(self.jobs), self.path)
+
+    def _job(self, jobid, jobname=None, new=False):
+        """The record of ``jobid`` (created if missing), moved to the MRU end."""
+        job = self.jobs.get(jobid)
+        if job is None or new:
+            if job is not None:
+                # JOBID reutilizado tras un arranque en frío de JES2
+                self._close(job)
+            job = self.jobs[jobid] = {"jobid": jobid, "jobname": jobname}
+            if jobname:
+                self.open[jobname].append(jobid)
+            while len(self.jobs) > self.capacity:
+                _, old = self.jobs.popitem(last=False)
+                self._close(old)
+                self.dirty.discard(old["jobid"])
+            M_TRACKED.set(len(self.jobs))
+        self.jobs.move_to_end(jobid)
+        job["updated_ts"] = time.time()
+        if jobname and not job.get("jobname"):
+            job["jobname"] = jobname
+            self.open[jobname].append(jobid)
+        self.dirty.add(jobid)
+        return job
+
+    @staticmethod
+    def _is_open(job):
+        """Whether ``job`` may still get $HASP373/$HASP395 (the rule ``on_event`` closes jobs by)."""
+        if job.get("ended_ts") is not None:
+            return False
+        # printed without $HASP100: the console never saw it
+        return job.get("printed_ts") is None or job.get("submitted_ts") is not None
+
+    def _close(self, job):
+        ids = self.open.get(job.get("jobname"))
+        if ids and job["jobid"] in ids:
+            ids.remove(job["jobid"])
+            if not ids:
+                del self.open[job["jobname"]]
+
+    def _by_name(self, jobname, skip_started=False):
+        """Oldest open job named ``jobname`` (not yet started, with ``skip_started``)."""
+        for jobid in self.open.get(jobname, ()):
+            if not skip_started or self.jobs[jobid].get("started_ts") is None:
+                return self.jobs[jobid]
+        return None
+
+    def _stamp(self, job, field, ts):
+        if job.get(field) is None:
+            job[field] = ts
+            for name, a, b in DURATIONS:
+                if b == field and job.get(a) is not None and name != "total":
+                    M_STAGE.labels(name).observe(max(0.0, ts - job[a]))
+
+    def on_event(self, event):
+        """EventBus handler."""
+        t = event.get("type", "")
+        ts = event.get("ts") or time.time()
+        jobid, jobname = event.get("jobid"), event.get("jobname")
+        if t == "console.submitted" and jobid:
+            job = self.jobs.get(jobid)
+            self._stamp(self._job(jobid, jobname, new=job is not None and job.get("submitted_ts") is not None),
+                        "submitted_ts", ts)
+        elif t == "console.started" and jobname:
+            job = self._by_name(jobname, skip_started=True)
+            if job is not None:
+                self._stamp(self._job(job["jobid"]), "started_ts", ts)
+        elif t == "console.ended" and jobname:
+            job = self._by_name(jobname)
+            if job is not None:
+                job = self._job(job["jobid"])
+                self._stamp(job, "ended_ts", ts)
+                self._close(job)
+        elif t == "job.id" and jobid:
+            self._stamp(self._job(jobid, jobname), "print_ts", ts)
+        elif t in ("job.rc", "job.end") and jobid:
+            job = self._job(jobid, jobname)
+            if event.get("rc"):
+                job["rc"] = event["rc"]
+            if t == "job.end":
+                job["file"] = event.get("file")
+                self._stamp(job, "printed_ts", ts)
+                # job que la consola no vio: no esperará $HASP395
+                if not self._is_open(job):
+                    self._close(job)
+
+    def pending(self):
+        """``(text, rewrite)`` to save for the jobs changed since the last call, or None.
+
+        Runs with the tracker (on the loop); ``save`` does the disk work and
+        may run on another thread. ``rewrite`` when the file is mostly stale.
+        """
+        if not self.path or not self.dirty:
+            self.dirty.clear()
+            return None
+        if self.lines + len(self.dirty) > 2 * max(self.capacity, len(self.jobs)):
+            rows, rewrite = list(self.jobs.values()), True
+            self.lines = len(rows)
+        else:
+            rows, rewrite = [self.jobs[j] for j in self.jobs if j in self.dirty], False
+            self.lines += len(rows)
+        self.dirty.clear()
+        return "".join(json.dumps(job, separators=(",", ":")) + "\n" for job in rows), rewrite
+
+    def save(self, text, rewrite=False):
+        """Append ``text`` to the file, or replace the file with it (temp file + rename)."""
+        if not rewrite:
+            with open(self.path, "a") as f:
+                f.write(text)
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def flush(self):
+        """``pending`` + ``save`` in the caller's thread; returns the lines written."""
+        data = self.pending()
+        if data is None:
+            return 0
+        self.save(*data)
+        return data[0].count("\n")
+
+    def get(self, jobid):
+        job = self.jobs.get(jobid)
+        return with_durations(job) if job else None
+
+    def list(self, state=None, jobname=None, limit=100):
+        """Most recently updated jobs first."""
+        out = []
+        for job in reversed(self.jobs.values()):
+            if jobname and job.get("jobname") != jobname:
+                continue
+            job = with_durations(job)
+            if state and job["state"] != state:
+                continue
+            out.append(job)
+            if len(out) >= limit:
+                break
+        return out
+
+    def stats(self, since=None):
+        """Jobs per state and stage duration percentiles (jobs updated after ``since``)."""
+        counts = collections.Counter()
+        durations = collections.defaultdict(list)
+        for job in self.jobs.values():
+            if since and (job.get("updated_ts") or 0) < since:
+                continue
+            counts[state_of(job)] += 1
+            for name, a, b in DURATIONS:
+                if job.get(a) is not None and job.get(b) is not None:
+                    durations[name].append(job[b] - job[a])
+        stages = {}
+        for name, _, _ in DURATIONS:
+            stages[name] = dict(percentiles(durations[name]), count=len(durations[name]))
+        # la etapa con mayor p95 es el cuello de botella
+        slowest = max((s for s in ("queue", "run", "print") if stages[s]["count"]),
+                      key=lambda s: stages[s]["p95"], default=None)
+        return {"jobs": len(self.jobs), "states": dict(counts), "stages": stages, "bottleneck": slowest}
@@ -0,0 +1,373 @@
+"""Prometheus-style metrics shared by the bridge processes and the API.
+
+Metrics are cheap to update from hot paths: every thread increments its own
+cell (no lock, no contended read-modify-write) and cells are only summed
+when a snapshot is taken. Each bridge process calls ``start_pusher`` and a
+daemon thread sends its snapshot every ``BRIDGE_METRICS_PUSH`` seconds as one
+JSON datagram to the Unix socket the API listens on
+(``BRIDGE_METRICS_SOCKET``, as ``events.py`` does for events). The API keeps
+the last snapshot of each process and serves all of them, plus its own, at
+``/metrics`` in the text exposition format with a ``process`` label.
+"""
+import os, json, time, socket, errno, asyncio, bisect, threading, logging
+
+PIDDIR = os.environ.get("BRIDGE_PIDDIR", "/app/pids")
+# Socket de métricas; "off" desactiva el envío
+METRICS_SOCKET = os.environ.get("BRIDGE_METRICS_SOCKET", os.path.join(PIDDIR, "metrics.sock"))
+# Seconds between snapshots sent by each bridge process
+PUSH_SECONDS = float(os.environ.get("BRIDGE_METRICS_PUSH", "5"))
+# Snapshots older than this are dropped (process gone)
+STALE_SECONDS = 300
+# Largest snapshot datagram accepted
+MAX_SNAPSHOT = 256 * 1024
+
+# Latency buckets (seconds) and size buckets (bytes)
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+logger = logging.getLogger("console_bridge")
+
+
+class _Cells:
+    """Per-thread lists of numbers; only the owning thread writes its list."""
+
+    def __init__(self, width):
+        self.width = width
+        self.local = threading.local()
+        self.cells = []
+        self.lock = threading.Lock()
+
+    def cell(self):
+        try:
+            return self.local.cell
+        except AttributeError:
+            cell = [0] * self.width
+            with self.lock:
+                self.cells.append(cell)
+            self.local.cell = cell
+            return cell
+
+    def total(self):
+        with self.lock:
+            cells = list(self.cells)
+        return [sum(c[i] for c in cells) for i in range(self.width)]
+
+
+class Counter:
+    """Monotonic counter (``inc``); a Gauge also accepts negative steps and ``set``."""
+
+    type = "counter"
+
+    def __init__(self):
+        self.cells = _Cells(1)
+
+    def inc(self, n=1):
+        self.cells.cell()[0] += n
+
+    def value(self):
+        return self.cells.total()[0]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def __init__(self, fn=None):
+        super().__init__()
+        self.fn = fn
+        self.base = 0
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def set(self, value):
+        self.base = value - super().value()
+
+    def value(self):
+        if self.fn is not None:
+            return self.fn()
+        return self.base + super().value()
+
+
+class Histogram:
+    """Cumulative-bucket histogram; ``observe(value)`` or ``with h.time():``."""
+
+    type = "histogram"
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        # one count per bucket plus +Inf, then sum and count
+        self.cells = _Cells(len(self.buckets) + 3)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def value(self):
+        t = self.cells.total()
+        return {"buckets": t[:-2], "sum": t[-2], "count": t[-1]}
+
+
+class _Timer:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+
+
+class Family:
+    """A metric name with its label names; ``labels(...)`` returns the child for some values."""
+
+    def __init__(self, name, help, labelnames, factory, buckets=None):
+        self.name = name
+        self.buckets = buckets
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+        self.type = factory().type
+        if not self.labelnames:
+            self.children[()] = factory()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    # sin etiquetas la familia se usa directamente
+    def inc(self, n=1):
+        self.children[()].inc(n)
+
+    def dec(self, n=1):
+        self.children[()].dec(n)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def snapshot(self):
+        out = {"type": self.type, "help": self.help, "samples": []}
+        if self.buckets is not None:
+            out["buckets"] = list(self.buckets)
+        for values, child in list(self.children.items()):
+            out["samples"].append([dict(zip(self.labelnames, values)), child.value()])
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name, help, labelnames, factory, buckets=None):
+        with self.lock:
+            fam = self.families.get(name)
+            if fam is None:
+                fam = self.families[name] = Family(name, help, labelnames, factory, buckets)
+            return fam
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(name, help, labelnames, Counter)
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self._get(name, help, labelnames, lambda: Gauge(fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        return self._get(name, help, labelnames, lambda: Histogram(buckets), tuple(buckets))
+
+    def snapshot(self):
+        """``{name: {"type", "help", "samples": [[labels, value], ...]}}``."""
+        with self.lock:
+            families = list(self.families.values())
+        out = {}
+        for fam in families:
+            try:
+                out[fam.name] = fam.snapshot()
+            except Exception:
+                logger.exception("metric %s failed", fam.name)
+        return out
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def _open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+gauge("process_open_fds", "Open file descriptors of the process", fn=_open_fds)
+gauge("process_start_time_seconds", "Start time of the process (Unix time)").set(time.time())
+
+
+def enabled(path=None):
+    path = METRICS_SOCKET if path is None else path
+    return bool(path) and path.lower() != "off"
+
+
+def push(process, path=None, sock=None):
+    """Send this process' snapshot to the API once; never raises."""
+    path = METRICS_SOCKET if path is None else path
+    data = json.dumps({"process": process, "pid": os.getpid(), "ts": time.time(),
+                       "metrics": REGISTRY.snapshot()}, separators=(",", ":")).encode("utf-8")
+    if len(data) > MAX_SNAPSHOT:
+        logger.warning("metrics snapshot of %d bytes not sent (max %d)", len(data), MAX_SNAPSHOT)
+        return False
+    own = sock is None
+    sock = sock or socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(data, path)
+        return True
+    except OSError as e:
+        # ENOENT/ECONNREFUSED: el API no está levantado
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN, errno.ENOBUFS):
+            logger.warning("metrics push failed: %s", e)
+        return False
+    finally:
+        if own:
+            sock.close()
+
+
+def start_pusher(process, path=None, interval=None):
+    """Push snapshots of this process every ``interval`` seconds from a daemon thread."""
+    path = METRICS_SOCKET if path is None else path
+    interval = PUSH_SECONDS if interval is None else interval
+    if not enabled(path) or interval <= 0:
+        return None
+
+    def run():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        while True:
+            try:
+                push(process, path, sock)
+            except Exception:
+                logger.exception("metrics push failed")
+            time.sleep(interval)
+
+    t = threading.Thread(target=run, name="metrics-push", daemon=True)
+    t.start()
+    return t
+
+
+class Store:
+    """Last snapshot received from each bridge process (owned by the API)."""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def add(self, snap):
+        self.snapshots[snap["process"]] = snap
+
+    def current(self, now=None):
+        now = time.time() if now is None else now
+        for name, snap in list(self.snapshots.items()):
+            if now - snap["ts"] > STALE_SECONDS:
+                del self.snapshots[name]
+        return dict(self.snapshots)
+
+
+async def listen(store: Store, path=None):
+    """Receive snapshots on ``path`` into ``store`` until cancelled."""
+    path = METRICS_SOCKET if path is None else path
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+
+    def on_readable():
+        while True:
+            try:
+                data = sock.recv(MAX_SNAPSHOT)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                snap = json.loads(data)
+            except ValueError:
+                logger.warning("ignoring malformed metrics datagram (%d bytes)", len(data))
+                continue
+            if isinstance(snap, dict) and "process" in snap and "metrics" in snap:
+                store.add(snap)
+
+    loop.add_reader(sock.fileno(), on_readable)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render(snapshots):
+    """Text exposition of ``{process: snapshot}``; every sample gets a ``process`` label."""
+    merged = {}
+    for process, snap in sorted(snapshots.items()):
+        for name, fam in snap["metrics"].items():
+            entry = merged.setdefault(name, {"type": fam["type"], "help": fam["help"],
+                                             "buckets": fam.get("buckets"), "samples": []})
+            for labels, value in fam["samples"]:
+                entry["samples"].append((dict(labels, process=process), value))
+    lines = []
+    for name in sorted(merged):
+        fam = merged[name]
+        lines.append(f"# HELP {name} {fam['help']}")
+        lines.append(f"# TYPE {name} {fam['type']}")
+        for labels, value in fam["samples"]:
+            if fam["type"] != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            acc = 0
+            for bound, n in zip(list(fam["buckets"]) + [float("inf")], value["buckets"]):
+                acc += n
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=_number(bound)))} {acc}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,289 @@
+"""Re-extract joblogs from raw dumps or daily spool files, in parallel.
+
+Use it after changing the markers or fixing the extractor to regenerate the
+history, e.g.::
+
+    python3 reextract.py /app/logs/console_bridge-raw.2.bin /app/logs/console_bridge-raw.1.bin
+    python3 reextract.py --outdir /tmp/spool.new --workers 8 /app/spool/spool_2024*.bin
+
+Each input is memory-mapped and cut into ``--segment-mb`` pieces. A piece
+starts at a START separator whose previous marker is an END, so the live
+extractor would be idle there too. Every piece runs through the same
+``JobLogExtractor`` in a process pool and writes into its own work
+directory. The parent then publishes the files into ``OUTDIR`` in stream
+order with ``joblayout.publish_job``, like the bridge: a name already taken
+(by the live bridge or an earlier job of the run) gets a unique suffix and no
+file is ever replaced, and each piece's job rows go to the index in one
+transaction. Pieces and the files they published are journaled, so running
+the same command again after an interruption removes the files of the piece
+it stopped in and resumes there.
+"""
+import argparse, collections, json, mmap, os, shutil, sys, time, logging
+from concurrent.futures import ProcessPoolExecutor
+
+import console_bridge
+import events
+import jobindex
+import joblayout
+from console_bridge import logger
+
+# Bytes handed to the extractor per feed()
+FEED = 1 << 20
+# First look-behind window when checking the marker before a START
+LOOKBEHIND = 64 * 1024
+WORK = ".reextract"
+
+
+class JobRows:
+    """Stands in for ``JobIndex`` in a worker: keeps the rows in memory for the parent."""
+
+    search_enabled = False
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.rows = []
+
+    def job_started(self, name, jobid, jobname, rc=None, start_ts=None, spool=None, start_offset=None):
+        self.rows.append({"file": name, "jobid": jobid, "jobname": jobname, "rc": rc, "size": 0,
+                          "start_ts": start_ts, "end_ts": None, "spool": self.spool,
+                          "start_offset": start_offset, "end_offset": None})
+        return len(self.rows) - 1
+
+    def job_renamed(self, rowid, name, rc):
+        self.rows[rowid].update(file=name, rc=rc)
+
+    def job_ended(self, rowid, size, end_offset=None, end_ts=None):
+        self.rows[rowid].update(size=size, end_offset=end_offset, end_ts=end_ts or time.time())
+
+    def index_text(self, rowid, data):
+        pass
+
+    def text_done(self, rowid):
+        pass
+
+
+def _last_marker(data, lo, hi, start_re, end_re):
+    """``"START"``, ``"END"`` or None: the last marker found in ``data[lo:hi]``."""
+    last = None
+    for kind, regex in (("START", start_re), ("END", end_re)):
+        for m in regex.finditer(data, lo, hi):
+            if m.end() <= hi and (last is None or m.start() > last[0]):
+                last = (m.start(), kind)
+    return last and last[1]
+
+
+def job_boundary(data, offset, start_re, end_re):
+    """First offset >= ``offset`` where the extractor is idle and a job starts (``len(data)`` if none).
+
+    That is a START separator whose previous marker is an END (or none):
+    whatever the state before that END, the extractor is idle after it.
+    """
+    if offset <= 0:
+        return 0
+    while (m := start_re.search(data, offset)) is not None:
+        window = LOOKBEHIND
+        while True:
+            lo = max(0, m.start() - window)
+            kind = _last_marker(data, lo, m.start(), start_re, end_re)
+            if kind or lo == 0:
+                break
+            window *= 4
+        if kind != "START":
+            return m.start()
+        offset = m.start() + 1
+    return len(data)
+
+
+def _init_worker(verbose):
+    # historical jobs must not show up as live events in the API
+    events.EVENTS_SOCKET = "off"
+    if not verbose:
+        logger.setLevel(logging.WARNING)
+
+
+def extract_piece(task):
+    """Worker: run ``JobLogExtractor`` over one piece of an input; returns its job rows."""
+    path, lo, hi, codepage, workdir = task["path"], task["lo"], task["hi"], task["codepage"], task["workdir"]
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    rows = JobRows(os.path.basename(path))
+    ex = console_bridge.JobLogExtractor(outdir=workdir, codepage=codepage, index=rows)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = job_boundary(mm, lo, ex.START_PATTERN_RE, ex.END_PATTERN_RE)
+        end = job_boundary(mm, hi, ex.START_PATTERN_RE, ex.END_PATTERN_RE) if hi < len(mm) else len(mm)
+        # offsets stored in the index are stream offsets, as for a live session
+        ex.base = start
+        with memoryview(mm) as mv:
+            for pos in range(start, end, FEED):
+                ex.feed(mv[pos:min(pos + FEED, end)])
+            ex.close()
+    return {"start": start, "end": end, "rows": rows.rows}
+
+
+class Journal:
+    """Pieces already published into OUTDIR and indexed (JSON lines).
+
+    Every published file gets a line first; a piece's final line lists them
+    all. Files of a piece without its final line are in ``partial``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self.partial = collections.defaultdict(list)
+        self.f = None
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line cut by the interruption
+                        continue
+                    if "file" in entry:
+                        self.partial[(entry["input"], entry["piece"])].append(entry["file"])
+                    else:
+                        self.done[(entry["input"], entry["piece"])] = entry["names"]
+        except FileNotFoundError:
+            pass
+        for key in self.done:
+            self.partial.pop(key, None)
+
+    def _write(self, entry):
+        if self.f is None:
+            self.f = open(self.path, "a")
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
+
+    def placed(self, key, piece, name):
+        """Record a file published for a piece not finished yet."""
+        self._write({"input": key, "piece": piece, "file": name})
+
+    def add(self, key, piece, names):
+        """Record a finished piece and the job file names it published."""
+        self._write({"input": key, "piece": piece, "names": names})
+        os.fsync(self.f.fileno())
+        self.done[(key, piece)] = names
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def input_key(path, codepage, piece_bytes):
+    """Resume key of an input: a changed file (or plan) starts over."""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{codepage}:{piece_bytes}"
+
+
+def detect(path):
+    with open(path, "rb") as f:
+        return console_bridge.detect_codepage(f.read(console_bridge.DETECT_SAMPLE), final=True)
+
+
+def place(outdir, workdir, row):
+    """Publish one extracted file into ``outdir`` without replacing any file; returns its path."""
+    name = console_bridge.job_filename(row["jobid"], row["jobname"], row["rc"])
+    return joblayout.publish_job(os.path.join(joblayout.job_dir(workdir, row["file"]), row["file"]),
+                                 os.path.join(joblayout.job_dir(outdir, name, create=True), name))
+
+
+def remove_partial(outdir, journal, index=None):
+    """Delete the files published by pieces an interrupted run did not finish (and their rows)."""
+    names = [name for files in journal.partial.values() for name in files]
+    for name in names:
+        path = joblayout.find_job_file(outdir, name)
+        if path:
+            os.remove(path)
+    if names and index is not None:
+        index.remove_names(names)
+    if names:
+        logger.info("Removed %d file(s) of unfinished pieces", len(names))
+    journal.partial.clear()
+
+
+def run(inputs, outdir, index=None, workers=None, piece_bytes=256 << 20, codepage="auto", verbose=False):
+    """Re-extract ``inputs`` into ``outdir``; returns ``(jobs, bytes)`` processed in this run."""
+    work = os.path.join(outdir, WORK)
+    os.makedirs(work, exist_ok=True)
+    journal = Journal(os.path.join(work, "journal.jsonl"))
+    remove_partial(outdir, journal, index)
+    # work directories left by an interrupted run
+    for entry in os.scandir(work):
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+    plan = []
+    skipped = 0
+    for path in inputs:
+        cp = detect(path) if codepage == "auto" else codepage
+        key = input_key(path, cp, piece_bytes)
+        size = os.path.getsize(path)
+        for piece, lo in enumerate(range(0, size, piece_bytes)):
+            if (key, piece) in journal.done:
+                skipped += 1
+                continue
+            plan.append({"path": path, "lo": lo, "hi": min(lo + piece_bytes, size), "codepage": cp,
+                         "key": key, "piece": piece, "workdir": os.path.join(work, f"{len(plan)}")})
+    if skipped:
+        logger.info("Resuming: %d piece(s) already done", skipped)
+    jobs = total = 0
+    t0 = time.time()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(verbose,)) as pool:
+        # results are consumed in stream order so names and index rows match a sequential run
+        for task, result in zip(plan, pool.map(extract_piece, plan)):
+            names = []
+            for row in result["rows"]:
+                path = place(outdir, task["workdir"], row)
+                final = os.path.basename(path)
+                journal.placed(task["key"], task["piece"], final)
+                names.append(final)
+                row.update(name=final, mtime=os.path.getmtime(path))
+            if index is not None:
+                index.add_jobs(result["rows"])
+            journal.add(task["key"], task["piece"], names)
+            shutil.rmtree(task["workdir"], ignore_errors=True)
+            jobs += len(names)
+            total += result["end"] - result["start"]
+            logger.info("%s [%d:%d]: %d job(s), %.1f MB/s overall", os.path.basename(task["path"]),
+                        result["start"], result["end"], len(names), total / max(time.time() - t0, 1e-9) / 1e6)
+    journal.close()
+    if index is not None:
+        # line offsets and full-text rows of the new files (single writer)
+        index.index_missing_text(outdir)
+    return jobs, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="raw dumps or spool_*.bin files, oldest first")
+    parser.add_argument("--outdir", default=console_bridge.OUTDIR)
+    parser.add_argument("--index", default=None,
+                        help="index path, or 'off' (default: BRIDGE_INDEX or OUTDIR/jobindex.db)")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPU count)")
+    parser.add_argument("--segment-mb", type=int, default=256, help="bytes of input per piece")
+    parser.add_argument("--codepage", default="auto", help="ascii, an EBCDIC codec or auto (per input)")
+    parser.add_argument("--restart", action="store_true", help="forget the resume journal of OUTDIR")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every job")
+    args = parser.parse_args(argv)
+
+    if args.restart:
+        shutil.rmtree(os.path.join(args.outdir, WORK), ignore_errors=True)
+    index_path = args.index or (jobindex.INDEX_PATH if args.outdir == console_bridge.OUTDIR
+                                else os.path.join(args.outdir, "jobindex.db"))
+    os.makedirs(args.outdir, exist_ok=True)
+    index = jobindex.open_index(index_path)
+    t0 = time.time()
+    try:
+        jobs, total = run(args.inputs, args.outdir, index, args.workers, args.segment_mb << 20,
+                          args.codepage, args.verbose)
+    finally:
+        if index is not None:
+            index.close()
+    elapsed = time.time() - t0
+    print(f"extracted {jobs} job(s) from {total / 1e6:.1f} MB into {args.outdir} in {elapsed:.1f}s "
+          f"({total / max(elapsed, 1e-9) / 1e6:.1f} MB/s)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
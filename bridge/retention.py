@@ -0,0 +1,164 @@
+"""Age and size budgets for the joblogs in OUTDIR, enforced in the background.
+
+The bridge calls ``start``: a daemon thread wakes every
+``BRIDGE_RETENTION_SECONDS`` and deletes finished joblogs, oldest first, that
+are older than ``BRIDGE_JOBLOG_KEEP_DAYS`` or beyond ``BRIDGE_JOBLOG_MAX_MB``
+in total (0 = no limit; with both at 0 no thread is started). Candidates come
+from the job index in ``mtime`` order, so a pass reads no directory; without
+an index the JOBID directories (``joblayout``) are walked instead.
+
+Files and their index rows (line offsets and full-text lines included) go
+``BATCH`` jobs at a time with a short pause in between, so the index lock is
+never held long enough to stall the receive loop. The bytes of an expired
+joblog stay in the compressed spool archive until its own retention
+(``BRIDGE_ARCHIVE_KEEP_DAYS``) drops them: ``/archive/{stream}/jobs/{jobid}``.
+With ``BRIDGE_SPOOL_FORMAT=bin`` there is no archive: they are only left in
+the daily ``spool_YYYYMMDD.bin`` files, uncompressed, for as long as those
+are kept.
+
+One pass by hand::
+
+    python3 retention.py [OUTDIR]
+"""
+import os, sys, time, threading, logging
+
+import joblayout
+import jobindex
+import metrics
+
+OUTDIR = os.environ.get("BRIDGE_OUTDIR", "/app/spool")
+# Días que se guardan los joblogs (0 = sin límite de edad)
+KEEP_DAYS = float(os.environ.get("BRIDGE_JOBLOG_KEEP_DAYS", "0"))
+# Total size of the joblogs kept (0 = no size cap)
+MAX_BYTES = int(os.environ.get("BRIDGE_JOBLOG_MAX_MB", "0")) * 1024 * 1024
+# Seconds between passes
+INTERVAL = float(os.environ.get("BRIDGE_RETENTION_SECONDS", "600"))
+# Jobs deleted per index transaction, and the pause after each batch
+BATCH = 100
+PAUSE = 0.05
+
+M_EXPIRED = metrics.counter("bridge_joblogs_expired_total", "Joblogs deleted by retention")
+M_EXPIRED_BYTES = metrics.counter("bridge_joblogs_expired_bytes_total", "Bytes of the joblogs deleted by retention")
+
+logger = logging.getLogger("console_bridge")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def expire_indexed(index, outdir, cutoff, max_bytes):
+    """One pass driven by the job index; returns ``(jobs, bytes)`` deleted."""
+    total = index.finished_size()
+    jobs = freed = 0
+    after = None
+    while True:
+        rows = index.oldest_jobs(BATCH, after)
+        if not rows:
+            break
+        done = []
+        for row in rows:
+            # ordenado por mtime: si este no caduca, ninguno posterior
+            if not (cutoff and row["mtime"] < cutoff) and not (max_bytes and total > max_bytes):
+                break
+            if row["name"].startswith(jobindex.INDEXED_PREFIXES):
+                path = joblayout.find_job_file(outdir, row["name"])
+                if path:
+                    _remove(path)
+            elif row["name"].startswith("."):
+                # publish failed: the job kept its temp file in OUTDIR (console_bridge.temp_job_path)
+                _remove(os.path.join(outdir, row["name"]))
+            done.append(row["id"])
+            total -= row["size"]
+            freed += row["size"]
+        index.remove_jobs(done)
+        jobs += len(done)
+        if len(done) < len(rows):
+            break
+        after = (rows[-1]["mtime"], rows[-1]["id"])
+        time.sleep(PAUSE)
+    return jobs, freed
+
+
+def expire_files(outdir, cutoff, max_bytes):
+    """Same as expire_indexed from a walk of the job directories (no index)."""
+    files = []
+    for entry in joblayout.iter_job_files(outdir):
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    jobs = freed = 0
+    for mtime, size, path in files:
+        if not (cutoff and mtime < cutoff) and not (max_bytes and total > max_bytes):
+            break
+        _remove(path)
+        total -= size
+        freed += size
+        jobs += 1
+        if jobs % BATCH == 0:
+            time.sleep(PAUSE)
+    return jobs, freed
+
+
+def run_once(index=None, outdir=OUTDIR, keep_days=None, max_bytes=None, now=None):
+    """Enforce the budgets once; returns ``(jobs, bytes)`` deleted."""
+    keep_days = KEEP_DAYS if keep_days is None else keep_days
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    cutoff = (now or time.time()) - keep_days * 86400 if keep_days else None
+    if index is not None:
+        jobs, freed = expire_indexed(index, outdir, cutoff, max_bytes)
+    else:
+        jobs, freed = expire_files(outdir, cutoff, max_bytes)
+    if jobs:
+        M_EXPIRED.inc(jobs)
+        M_EXPIRED_BYTES.inc(freed)
+        logger.info("Joblog retention removed %d job(s), %.1f MB", jobs, freed / 1e6)
+    return jobs, freed
+
+
+def start(index=None, outdir=OUTDIR, interval=None):
+    """Run ``run_once`` every ``interval`` seconds from a daemon thread (None when no budget is set)."""
+    interval = INTERVAL if interval is None else interval
+    if not (KEEP_DAYS or MAX_BYTES) or interval <= 0:
+        return None
+
+    def run():
+        while True:
+            try:
+                run_once(index, outdir)
+            except Exception:
+                logger.exception("joblog retention failed")
+            time.sleep(interval)
+
+    t = threading.Thread(target=run, name="joblog-retention", daemon=True)
+    t.start()
+    return t
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Delete joblogs beyond the retention budgets once")
+    parser.add_argument("outdir", nargs="?", default=OUTDIR)
+    parser.add_argument("--keep-days", type=float, default=None, help="default: BRIDGE_JOBLOG_KEEP_DAYS")
+    parser.add_argument("--max-mb", type=int, default=None, help="default: BRIDGE_JOBLOG_MAX_MB")
+    parser.add_argument("--index", default=None, help="index path (default: BRIDGE_INDEX or OUTDIR/jobindex.db)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    path = args.index or (jobindex.INDEX_PATH if args.outdir == OUTDIR else os.path.join(args.outdir, "jobindex.db"))
+    index = jobindex.open_index(path) if os.path.exists(path) else None
+    max_bytes = None if args.max_mb is None else args.max_mb * 1024 * 1024
+    jobs, freed = run_once(index, args.outdir, args.keep_days, max_bytes)
+    if index is not None:
+        index.close()
+    print(f"removed {jobs} joblog(s), {freed / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
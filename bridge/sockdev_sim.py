@@ -0,0 +1,300 @@
+"""Local stand-in for the Hercules sockdevs the bridge connects to.
+
+Listens like the TK5 1403 printers: ``--printer-port`` (5000) gets the job
+listings, ``--console-port`` (5002) the hardcopy console lines. Every job
+produces the JES2 messages console_watch parses ($HASP100, $HASP373,
+$HASP395) and a listing the extractor splits: START separator page
+(``****A  START  JOB nnnn NAME``), JES2 job log, ``JES2.JOBnnnnn`` data set
+lines, step ``RC= xxxx`` and the END separator. Run it, then point the
+bridge at it::
+
+    python3 sockdev_sim.py --jobs 1000 --rate 20 --job-size 2048-262144 --codepage cp037
+    BRIDGE_PORT=5000 CONSOLE_PORT=5002 python3 console_bridge.py
+
+``--burst N --burst-gap S`` sends N jobs back to back and pauses S seconds;
+``--mbps`` caps the printer bandwidth. ``--manifest`` writes one JSON line
+per job (JOBID, size, send times) for latency measurements; ``bench.py e2e``
+uses the simulator in-process.
+"""
+import argparse, asyncio, json, math, random, sys, time, logging
+
+CRLF = "\r\n"
+MONTHS = ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC")
+INIT_LINE = "MVS038J MVS 3.8j TK5 system initialization complete"
+PROGRAMS = ("IEFBR14", "IEBGENER", "IEBCOPY", "IEHLIST", "ASMFCL", "SORT", "IDCAMS")
+RCS = ("0000",) * 6 + ("0004", "0008", "0012")
+
+logger = logging.getLogger("sockdev_sim")
+
+
+def parse_size(spec):
+    """``"4096"`` or ``"1024-1048576"`` (log-uniform) -> ``(lo, hi)``."""
+    lo, _, hi = spec.partition("-")
+    return int(lo), int(hi or lo)
+
+
+class Job:
+    __slots__ = ("num", "jobid", "jobname", "rc", "size", "steps")
+
+    def __init__(self, num, rnd, size_range):
+        self.num = num
+        self.jobid = "JOB%05d" % (num % 100000)
+        self.jobname = "SIM%05d" % (num % 100000)
+        self.rc = rnd.choice(RCS)
+        lo, hi = size_range
+        self.size = lo if lo == hi else int(math.exp(rnd.uniform(math.log(lo), math.log(hi))))
+        self.steps = rnd.randint(1, 4)
+
+
+def _clock(ts):
+    t = time.localtime(ts)
+    return time.strftime("%H.%M.%S", t), "%2d %s %02d" % (t.tm_mday, MONTHS[t.tm_mon - 1], t.tm_year % 100)
+
+
+def separator(job, kind, ts):
+    """Separator page lines; the first one is the marker the extractor looks for."""
+    hms, date = _clock(ts)
+    word = "START" if kind == "START" else "END  "
+    line = "****A  %s  JOB %4d  %-8s  ROOM       %s  %s  PRINTER1  SYS TK5   JOB %4d  %s  A****" % (
+        word, job.num % 10000, job.jobname, hms, date, job.num % 10000, word)
+    # el bloque de letras grandes de la portada no lleva marcadores
+    block = ["        " + " ".join(c * 8 for c in job.jobname[:8])] * 6
+    return [line] * 4 + [""] + block + [""] + [line] * 2
+
+
+def console_lines(job, event, ts):
+    hms, _ = _clock(ts)
+    if event == "submitted":
+        return ["%s  $HASP100 %-8s JOB (%s) SUBMITTED" % (hms, job.jobname, job.jobid)]
+    if event == "started":
+        return ["%s  $HASP373 %-8s STARTED - INIT  1 - CLASS A - SYS TK5" % (hms, job.jobname),
+                "%s  IEF403I %s - STARTED - TIME=%s" % (hms, job.jobname, hms)]
+    return ["%s  IEF404I %s - ENDED - TIME=%s" % (hms, job.jobname, hms),
+            "%s  $HASP395 %-8s ENDED" % (hms, job.jobname)]
+
+
+def listing(job, rnd, ts):
+    """The whole printer output of ``job`` (about ``job.size`` bytes, CRLF lines)."""
+    hms, date = _clock(ts)
+    head = separator(job, "START", ts) + [
+        "",
+        "                    J E S 2  J O B  L O G",
+        "",
+        "%s JOB %4d  $HASP373 %-8s STARTED - INIT  1 - CLASS A - SYS TK5" % (hms, job.num % 10000, job.jobname),
+        "%s JOB %4d  IEF403I %s - STARTED - TIME=%s" % (hms, job.num % 10000, job.jobname, hms),
+        "%s JOB %4d  IEF404I %s - ENDED - TIME=%s" % (hms, job.num % 10000, job.jobname, hms),
+        "%s JOB %4d  $HASP395 %-8s ENDED" % (hms, job.num % 10000, job.jobname),
+        "",
+        "------ JES2 JOB STATISTICS ------",
+        "  %s JOB EXECUTION DATE" % date,
+        "",
+        "        1 //%-8s JOB (SIM),'BENCH',CLASS=A,MSGCLASS=A" % job.jobname,
+    ]
+    steps = []
+    for n in range(1, job.steps + 1):
+        pgm = rnd.choice(PROGRAMS)
+        steps += [
+            "IEF236I ALLOC. FOR %s STEP%d" % (job.jobname, n),
+            "IEF237I JES2 ALLOCATED TO SYSPRINT",
+            "IEF142I %s STEP%d - STEP WAS EXECUTED - COND CODE %s" % (job.jobname, n, job.rc),
+            "IEF285I   JES2.%s.SO0%03d                     SYSOUT" % (job.jobid, 100 + n),
+            "IEF373I STEP /STEP%d   / START %s" % (n, time.strftime("%y%j.%H%M", time.localtime(ts))),
+            "IEF374I STEP /STEP%d   / STOP  %s CPU    0MIN 00.0%dSEC SRB    0MIN 00.00SEC VIRT   %3dK" % (
+                n, time.strftime("%y%j.%H%M", time.localtime(ts)), n, 4 * rnd.randint(1, 64)),
+            "  %-8s STEP%d    %-8s RC= %s" % (job.jobname, n, pgm, job.rc),
+        ]
+    tail = separator(job, "END", ts)
+    text = CRLF.join(head + steps) + CRLF
+    end = CRLF.join(tail) + CRLF
+    # SYSPRINT de relleno hasta el tamaño pedido, líneas de longitud variable
+    body = []
+    room = job.size - len(text) - len(end)
+    n = 0
+    while room > 0:
+        n += 1
+        line = " %6d  %s" % (n, " ".join(rnd.choice(("DATA", "RECORD", "MEMBER", "COPIED", "SYSUT1", "00000000"))
+                                         for _ in range(rnd.randint(1, 12))))
+        body.append(line)
+        room -= len(line) + 2
+    return text + (CRLF.join(body) + CRLF if body else "") + end
+
+
+class Simulator:
+    """Printer and console sockdev servers plus the job generator."""
+
+    def __init__(self, host="127.0.0.1", printer_port=5000, console_port=5002, jobs=100, rate=0.0,
+                 job_size="4096-65536", codepage="ascii", burst=1, burst_gap=0.0, mbps=0.0, chunk=4096,
+                 seed=0, first_job=1):
+        self.host = host
+        self.printer_port = printer_port
+        self.console_port = console_port
+        self.jobs = jobs
+        self.rate = rate
+        self.size_range = parse_size(job_size)
+        self.codepage = codepage
+        self.burst = max(1, burst)
+        self.burst_gap = burst_gap
+        self.mbps = mbps
+        self.chunk = chunk
+        self.rnd = random.Random(seed)
+        self.next_num = first_job
+        self.manifest = []
+        self.printer = None
+        self.printer_ready = None
+        self.console_ready = None
+        self.consoles = set()
+        self.servers = []
+        self.done = None
+
+    async def start(self):
+        self.printer_ready = asyncio.Event()
+        self.console_ready = asyncio.Event()
+        self.done = asyncio.Event()
+        self.servers.append(await asyncio.start_server(self._printer_client, self.host, self.printer_port))
+        self.servers.append(await asyncio.start_server(self._console_client, self.host, self.console_port))
+        # puertos reales cuando se pidió el 0
+        self.printer_port = self.servers[0].sockets[0].getsockname()[1]
+        self.console_port = self.servers[1].sockets[0].getsockname()[1]
+        logger.info("printer on %s:%d, console on %s:%d", self.host, self.printer_port, self.host, self.console_port)
+
+    async def _printer_client(self, reader, writer):
+        if self.printer is not None:
+            # Hercules only takes one client per device
+            writer.close()
+            return
+        self.printer = writer
+        self.printer_ready.set()
+        await reader.read()
+        self.printer = None
+        self.printer_ready.clear()
+
+    async def _console_client(self, reader, writer):
+        self.consoles.add(writer)
+        await self._console([INIT_LINE], only=writer)
+        self.console_ready.set()
+        await reader.read()
+        self.consoles.discard(writer)
+
+    async def _console(self, lines, only=None):
+        data = "".join(l + CRLF for l in lines).encode("ascii")
+        for w in [only] if only else list(self.consoles):
+            try:
+                w.write(data)
+                await w.drain()
+            except (ConnectionError, RuntimeError):
+                self.consoles.discard(w)
+
+    async def _print(self, data):
+        """Write ``data`` to the printer client (waiting for one), throttled to ``mbps``."""
+        pos = 0
+        while pos < len(data):
+            await self.printer_ready.wait()
+            writer = self.printer
+            t0 = time.perf_counter()
+            piece = data[pos:pos + self.chunk]
+            try:
+                writer.write(piece)
+                await writer.drain()
+            except (ConnectionError, RuntimeError):
+                continue
+            pos += len(piece)
+            if self.mbps > 0:
+                await asyncio.sleep(max(0.0, len(piece) / (self.mbps * 1e6) - (time.perf_counter() - t0)))
+
+    async def send_job(self):
+        job = Job(self.next_num, self.rnd, self.size_range)
+        self.next_num += 1
+        now = time.time()
+        await self._console(console_lines(job, "submitted", now) + console_lines(job, "started", now))
+        text = listing(job, self.rnd, now)
+        data = text.encode("ascii") if self.codepage == "ascii" else text.encode(self.codepage)
+        await self._console(console_lines(job, "ended", now))
+        sent_start = time.time()
+        await self._print(data)
+        entry = {"num": job.num, "jobid": job.jobid, "jobname": job.jobname, "rc": job.rc, "bytes": len(data),
+                 "submitted_ts": now, "sent_start": sent_start, "sent_end": time.time()}
+        self.manifest.append(entry)
+        return entry
+
+    async def run(self, wait_console=False):
+        """Send ``jobs`` jobs (0 = until cancelled) once a printer (and a console) client is connected."""
+        await self.printer_ready.wait()
+        if wait_console:
+            await self.console_ready.wait()
+        t0 = time.perf_counter()
+        sent = 0
+        try:
+            while not self.jobs or sent < self.jobs:
+                for _ in range(self.burst):
+                    if self.jobs and sent >= self.jobs:
+                        break
+                    await self.send_job()
+                    sent += 1
+                    if self.rate > 0:
+                        # ritmo medio: cada job tiene su hueco en el calendario
+                        await asyncio.sleep(max(0.0, t0 + sent / self.rate - time.perf_counter()))
+                if self.burst_gap > 0:
+                    await asyncio.sleep(self.burst_gap)
+        finally:
+            self.done.set()
+        return self.manifest
+
+    async def close(self, printer_eof=True):
+        """Stop listening; with ``printer_eof`` close the printer like Hercules at shutdown."""
+        for srv in self.servers:
+            srv.close()
+        writers = list(self.consoles) + ([self.printer] if printer_eof and self.printer else [])
+        for w in writers:
+            w.close()
+        for srv in self.servers:
+            await srv.wait_closed()
+
+
+async def _main(args):
+    sim = Simulator(args.host, args.printer_port, args.console_port, args.jobs, args.rate, args.job_size,
+                    args.codepage, args.burst, args.burst_gap, args.mbps, args.chunk, args.seed)
+    await sim.start()
+    t0 = time.time()
+    try:
+        manifest = await sim.run(args.wait_console)
+    finally:
+        if args.manifest:
+            with open(args.manifest, "w") as f:
+                for entry in sim.manifest:
+                    f.write(json.dumps(entry) + "\n")
+    total = sum(e["bytes"] for e in manifest)
+    elapsed = max(time.time() - t0, 1e-9)
+    print("sent %d job(s), %d bytes in %.1fs (%.1f MB/s, %.1f jobs/s)" % (
+        len(manifest), total, elapsed, total / elapsed / 1e6, len(manifest) / elapsed))
+    # deja que el cliente lea lo último antes de cerrar
+    await asyncio.sleep(args.linger)
+    await sim.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--printer-port", type=int, default=5000)
+    parser.add_argument("--console-port", type=int, default=5002)
+    parser.add_argument("--jobs", type=int, default=100, help="jobs to send (0 = forever)")
+    parser.add_argument("--rate", type=float, default=0, help="average jobs/s (0 = as fast as the client reads)")
+    parser.add_argument("--job-size", default="4096-65536", help="bytes per job: N or MIN-MAX (log-uniform)")
+    parser.add_argument("--codepage", default="ascii", help="ascii or an EBCDIC codec (cp037, cp500, ...)")
+    parser.add_argument("--burst", type=int, default=1, help="jobs sent back to back")
+    parser.add_argument("--burst-gap", type=float, default=0, help="seconds of silence after each burst")
+    parser.add_argument("--mbps", type=float, default=0, help="printer bandwidth cap in MB/s (0 = none)")
+    parser.add_argument("--chunk", type=int, default=4096, help="bytes per printer write")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--manifest", help="write one JSON line per job sent here")
+    parser.add_argument("--wait-console", action="store_true", help="start only once a console client is connected")
+    parser.add_argument("--linger", type=float, default=2, help="seconds to keep the sockets open after the last job")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
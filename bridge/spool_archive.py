@@ -0,0 +1,360 @@
+"""Compressed, segmented spool archive with random access.
+
+Each printer session is one *stream* (``spool[_name]_YYYYMMDD-HHMMSS``) stored
+as a series of segment files ``<stream>.<seq>.oseg`` in ``BRIDGE_ARCHIVE_DIR``.
+A segment is a run of independently compressed chunks of ``CHUNK_BYTES``
+stream bytes, each behind a small header::
+
+    b"OMVC" codec:u8 clen:u32 ulen:u32 stream_offset:u64 ts:f64   (big endian)
+
+and, once the segment is closed, a JSON footer listing the chunks and the jobs
+that ended in it (stream offsets, jobid, jobname, rc, timestamp), followed by
+``footer_len:u64 b"OMVSIDX1"``. A reader needs only the footer (or, for a
+segment cut by a crash, a walk over the chunk headers) to decompress exactly
+the chunks covering a byte range or a job.
+
+Segments roll over at ``BRIDGE_ARCHIVE_SEGMENT_MB`` of stream data or after
+``BRIDGE_ARCHIVE_SEGMENT_SECONDS``; closed segments older than
+``BRIDGE_ARCHIVE_KEEP_DAYS`` or beyond ``BRIDGE_ARCHIVE_MAX_MB`` in total are
+deleted, oldest first.
+"""
+import os, re, json, time, glob, zlib, lzma, struct, threading, logging, collections
+
+import spool_writer
+
+OUTDIR = os.environ.get("BRIDGE_OUTDIR", "/app/spool")
+ARCHIVE_DIR = os.environ.get("BRIDGE_ARCHIVE_DIR", os.path.join(OUTDIR, "archive"))
+# zlib (default), lzma o none
+CODEC = os.environ.get("BRIDGE_ARCHIVE_CODEC", "zlib")
+# Stream bytes per compressed chunk: the unit a random read has to decompress
+CHUNK_BYTES = int(os.environ.get("BRIDGE_ARCHIVE_CHUNK_KB", "256")) * 1024
+SEGMENT_BYTES = int(os.environ.get("BRIDGE_ARCHIVE_SEGMENT_MB", "64")) * 1024 * 1024
+SEGMENT_SECONDS = int(os.environ.get("BRIDGE_ARCHIVE_SEGMENT_SECONDS", "3600"))
+# Retention (0 = keep forever / no size cap)
+KEEP_DAYS = float(os.environ.get("BRIDGE_ARCHIVE_KEEP_DAYS", "30"))
+MAX_BYTES = int(os.environ.get("BRIDGE_ARCHIVE_MAX_MB", "0")) * 1024 * 1024
+# A partial chunk is compressed and written once its oldest byte is this old
+FLUSH_SECONDS = float(os.environ.get("BRIDGE_ARCHIVE_FLUSH_SECONDS", "5"))
+
+SUFFIX = ".oseg"
+CHUNK_MAGIC = b"OMVC"
+CHUNK_HEADER = struct.Struct(">4sBIIQd")
+FOOTER_MAGIC = b"OMVSIDX1"
+FOOTER_TRAILER = struct.Struct(">Q8s")
+
+CODECS = {"none": 0, "zlib": 1, "lzma": 2}
+_CODEC_NAMES = {v: k for k, v in CODECS.items()}
+
+logger = logging.getLogger("console_bridge")
+
+# Segments this process is still writing; retention never touches them
+_open_segments = set()
+
+_SEGMENT_RE = re.compile(r"^(?P<stream>.+)\.(?P<seq>\d{5})" + re.escape(SUFFIX) + "$")
+
+
+def compress(codec, data):
+    if codec == 1:
+        return zlib.compress(data, 6)
+    if codec == 2:
+        return lzma.compress(data, preset=6)
+    return bytes(data)
+
+
+def decompress(codec, data):
+    if codec == 1:
+        return zlib.decompress(data)
+    if codec == 2:
+        return lzma.decompress(data)
+    return data
+
+
+def new_stream_id(prefix, archive_dir=None):
+    """``<prefix>_YYYYMMDD-HHMMSS`` not used yet in ``archive_dir`` (never overwrites)."""
+    archive_dir = archive_dir or ARCHIVE_DIR
+    base = time.strftime(f"{prefix}_%Y%m%d-%H%M%S")
+    stream, n = base, 1
+    while glob.glob(os.path.join(glob.escape(archive_dir), glob.escape(stream) + ".*" + SUFFIX)):
+        n += 1
+        stream = f"{base}-{n}"
+    return stream
+
+
+class ArchiveWriter:
+    """Append-only writer for one stream; same write/flush/close interface as ``spool_writer.BufferedStream``.
+
+    Thread safe; registered with the spool_writer flusher so a partial chunk
+    reaches disk within ``FLUSH_SECONDS`` even when the printer goes quiet.
+    """
+
+    def __init__(self, stream, archive_dir=None, codec=None, chunk_bytes=None, segment_bytes=None,
+                 segment_seconds=None, flush_seconds=None):
+        self.archive_dir = archive_dir or ARCHIVE_DIR
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.stream = stream
+        self.name = os.path.join(self.archive_dir, stream)
+        codec = CODEC if codec is None else codec
+        if codec not in CODECS:
+            raise ValueError(f"unknown archive codec {codec!r}; expected one of {', '.join(CODECS)}")
+        self.codec = CODECS[codec]
+        self.chunk_bytes = chunk_bytes or CHUNK_BYTES
+        self.segment_bytes = segment_bytes or SEGMENT_BYTES
+        self.segment_seconds = SEGMENT_SECONDS if segment_seconds is None else segment_seconds
+        self.flush_after = FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.lock = threading.Lock()
+        self.buf = bytearray()
+        # monotonic time of the oldest byte in self.buf
+        self.first_pending = None
+        # Stream offset of self.buf[0]
+        self.offset = 0
+        self.seq = 0
+        self.seg = None
+        self.seg_path = None
+        self.seg_started = None
+        self.seg_bytes = 0
+        self.chunks = []
+        self.jobs = []
+        self.closed = False
+        self.fsync = "spool" in spool_writer.fsync_kinds(spool_writer.FSYNC)
+        spool_writer._flusher.add(self)
+
+    # --- segment handling -------------------------------------------------
+    def _open_segment(self):
+        self.seq += 1
+        self.seg_path = os.path.join(self.archive_dir, f"{self.stream}.{self.seq:05d}{SUFFIX}")
+        self.seg = open(self.seg_path, "xb")
+        _open_segments.add(self.seg_path)
+        self.seg_started = time.time()
+        self.seg_bytes = 0
+        self.chunks = []
+
+    def _close_segment(self):
+        if self.seg is None:
+            return
+        footer = json.dumps({
+            "stream": self.stream, "seq": self.seq, "codec": _CODEC_NAMES[self.codec],
+            "created": self.seg_started, "closed": time.time(),
+            "chunks": self.chunks, "jobs": self.jobs,
+        }, separators=(",", ":")).encode("utf-8")
+        self.seg.write(footer + FOOTER_TRAILER.pack(len(footer), FOOTER_MAGIC))
+        self.seg.close()
+        self.seg = None
+        _open_segments.discard(self.seg_path)
+        logger.info("Archive segment closed: %s (%d chunks, %d jobs)", self.seg_path, len(self.chunks), len(self.jobs))
+        # jobs recorded from now on go to the next segment's footer
+        self.jobs = []
+        try:
+            enforce_retention(self.archive_dir)
+        except Exception:
+            logger.exception("archive retention failed")
+
+    def _write_chunk(self, data):
+        if self.seg is not None and (self.seg_bytes >= self.segment_bytes or
+                                     (self.segment_seconds and time.time() - self.seg_started >= self.segment_seconds)):
+            self._close_segment()
+        if self.seg is None:
+            self._open_segment()
+        ts = time.time()
+        payload = compress(self.codec, data)
+        pos = self.seg.tell()
+        self.seg.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.codec, len(payload), len(data), self.offset, ts) + payload)
+        self.seg.flush()
+        if self.fsync:
+            os.fsync(self.seg.fileno())
+        # [file offset of payload, compressed length, stream offset, length, timestamp]
+        self.chunks.append([pos + CHUNK_HEADER.size, len(payload), self.offset, len(data), ts])
+        self.offset += len(data)
+        self.seg_bytes += len(data)
+
+    def _commit(self, partial=True):
+        """Compress and write full chunks (and, with ``partial``, the rest of the buffer)."""
+        done = 0
+        while len(self.buf) - done >= self.chunk_bytes or (partial and done < len(self.buf)):
+            n = min(self.chunk_bytes, len(self.buf) - done)
+            self._write_chunk(bytes(self.buf[done:done + n]))
+            done += n
+        if done:
+            del self.buf[:done]
+        if not self.buf:
+            self.first_pending = None
+
+    # --- stream interface -------------------------------------------------
+    def write(self, data):
+        with self.lock:
+            if self.first_pending is None:
+                self.first_pending = time.monotonic()
+            self.buf += data
+            if len(self.buf) >= self.chunk_bytes:
+                self._commit(partial=False)
+        return len(data)
+
+    def add_job(self, start_offset, end_offset, jobid=None, jobname=None, rc=None, file=None, ts=None):
+        """Record a job of this stream in the footer of the current segment."""
+        with self.lock:
+            self.jobs.append({"start": start_offset, "end": end_offset, "jobid": jobid, "jobname": jobname,
+                              "rc": rc, "file": file, "ts": ts or time.time()})
+
+    def commit_if_older(self, deadline):
+        with self.lock:
+            if self.first_pending is not None and not self.closed and \
+                    time.monotonic() - self.first_pending >= self.flush_after:
+                self._commit()
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self._commit()
+                if self.seg is None and self.jobs:
+                    self._open_segment()
+                self._close_segment()
+            finally:
+                self.closed = True
+        spool_writer._flusher.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- reading --------------------------------------------------------------
+Segment = collections.namedtuple("Segment", "path stream seq codec chunks jobs created closed size")
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def _scan_chunks(f, size):
+    """Chunk list of a segment without footer (writer crashed), from its chunk headers."""
+    chunks, pos = [], 0
+    codec = 0
+    while pos + CHUNK_HEADER.size <= size:
+        f.seek(pos)
+        magic, codec, clen, ulen, offset, ts = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC or pos + CHUNK_HEADER.size + clen > size:
+            break
+        chunks.append([pos + CHUNK_HEADER.size, clen, offset, ulen, ts])
+        pos += CHUNK_HEADER.size + clen
+    return chunks, codec
+
+
+def read_segment(path):
+    """Parsed ``Segment`` for ``path`` (cached by path, size and mtime)."""
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _index_lock:
+        seg = _index_cache.get(path)
+        if seg is not None and seg[0] == key:
+            return seg[1]
+    m = _SEGMENT_RE.match(os.path.basename(path))
+    stream, seq = (m.group("stream"), int(m.group("seq"))) if m else (os.path.basename(path), 0)
+    with open(path, "rb") as f:
+        footer = None
+        if st.st_size >= FOOTER_TRAILER.size:
+            f.seek(st.st_size - FOOTER_TRAILER.size)
+            flen, magic = FOOTER_TRAILER.unpack(f.read(FOOTER_TRAILER.size))
+            if magic == FOOTER_MAGIC and flen <= st.st_size - FOOTER_TRAILER.size:
+                f.seek(st.st_size - FOOTER_TRAILER.size - flen)
+                footer = json.loads(f.read(flen))
+        if footer:
+            seg = Segment(path, footer["stream"], footer["seq"], CODECS[footer["codec"]], footer["chunks"],
+                          footer["jobs"], footer["created"], True, st.st_size)
+        else:
+            chunks, codec = _scan_chunks(f, st.st_size)
+            seg = Segment(path, stream, seq, codec, chunks, [], chunks[0][4] if chunks else st.st_mtime, False, st.st_size)
+    with _index_lock:
+        _index_cache[path] = (key, seg)
+    return seg
+
+
+def segments(stream=None, archive_dir=None):
+    """Segment paths of ``stream`` (or every stream) in stream/sequence order."""
+    archive_dir = archive_dir or ARCHIVE_DIR
+    pattern = (glob.escape(stream) + ".*" if stream else "*") + SUFFIX
+    paths = glob.glob(os.path.join(glob.escape(archive_dir), pattern))
+    out = []
+    for p in paths:
+        m = _SEGMENT_RE.match(os.path.basename(p))
+        if m and (stream is None or m.group("stream") == stream):
+            out.append((m.group("stream"), int(m.group("seq")), p))
+    return [p for _, _, p in sorted(out)]
+
+
+def stream_size(stream, archive_dir=None):
+    """Stream bytes stored so far (end offset of the last chunk)."""
+    end = 0
+    for p in segments(stream, archive_dir):
+        for _, _, offset, length, _ in read_segment(p).chunks:
+            end = max(end, offset + length)
+    return end
+
+
+def read_range(stream, start, end, archive_dir=None):
+    """Yield stream bytes ``[start, end)``, decompressing only the chunks that overlap."""
+    for p in segments(stream, archive_dir):
+        seg = read_segment(p)
+        wanted = [c for c in seg.chunks if c[2] < end and c[2] + c[3] > start]
+        if not wanted:
+            continue
+        with open(p, "rb") as f:
+            for pos, clen, offset, length, _ in wanted:
+                f.seek(pos)
+                data = decompress(seg.codec, f.read(clen))
+                yield data[max(start - offset, 0):min(end - offset, length)]
+
+
+def find_job(stream, job, archive_dir=None):
+    """Footer entry of the last job of ``stream`` whose jobid or file name is ``job``."""
+    found = None
+    for p in segments(stream, archive_dir):
+        for j in read_segment(p).jobs:
+            if job in (j.get("jobid"), j.get("file")):
+                found = j
+    return found
+
+
+def enforce_retention(archive_dir=None, keep_days=None, max_bytes=None, now=None):
+    """Delete closed segments older than ``keep_days`` and, oldest first, beyond ``max_bytes``.
+
+    Returns the deleted paths. Segments open in this process are never
+    deleted; other segments without footer (another writer, or one that
+    crashed) only expire by age.
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    keep_days = KEEP_DAYS if keep_days is None else keep_days
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    now = now or time.time()
+    entries = []
+    for p in glob.glob(os.path.join(glob.escape(archive_dir), "*" + SUFFIX)):
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    deleted = []
+    for mtime, size, p in entries:
+        expired = keep_days and now - mtime > keep_days * 86400
+        over = max_bytes and total > max_bytes
+        if p in _open_segments or not (expired or over):
+            continue
+        try:
+            if not expired and not read_segment(p).closed:
+                continue
+            os.remove(p)
+        except OSError:
+            continue
+        with _index_lock:
+            _index_cache.pop(p, None)
+        total -= size
+        deleted.append(p)
+        logger.info("Archive retention removed %s", p)
+    return deleted
@@ -0,0 +1,256 @@
+"""Buffered spool writer with group commit.
+
+Bridge output files (full spool, raw dump, per-job logs) are written through
+``BufferedStream``: writes are collected in memory and committed to the file
+in one ``write`` call (plus ``fsync`` when the stream kind asks for it) as soon
+as ``BRIDGE_FLUSH_BYTES`` are pending or the oldest pending byte is
+``BRIDGE_FLUSH_MS`` old. A background thread enforces the time bound, so data
+handed to a stream reaches the OS within ``BRIDGE_FLUSH_MS`` (and the disk
+too, for fsync'd kinds) whether or not more data arrives.
+"""
+import os, threading, time, logging, bisect
+
+import metrics
+
+# Maximum age of buffered data before it is committed (0 = commit on every write)
+FLUSH_MS = int(os.environ.get("BRIDGE_FLUSH_MS", "100"))
+# Pending bytes that trigger an immediate commit
+FLUSH_BYTES = int(os.environ.get("BRIDGE_FLUSH_BYTES", str(256 * 1024)))
+# Stream kinds whose commits also fsync: comma separated "spool,raw,job", "all" or "none"
+FSYNC = os.environ.get("BRIDGE_FSYNC", "none")
+# Seconds between writer statistics log lines (0 disables them)
+REPORT_SECONDS = int(os.environ.get("BRIDGE_WRITER_REPORT", "60"))
+
+logger = logging.getLogger("console_bridge")
+
+M_WRITE = metrics.histogram("bridge_write_seconds", "Time of each group commit (write plus fsync)", ("kind",))
+M_OPEN = metrics.gauge("bridge_open_files", "Output streams open", ("kind",))
+
+
+def fsync_kinds(spec: str):
+    spec = spec.strip().lower()
+    if spec in ("", "none", "0", "false"):
+        return frozenset()
+    if spec in ("all", "1", "true"):
+        return frozenset(("spool", "raw", "job"))
+    return frozenset(k.strip() for k in spec.split(",") if k.strip())
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (bucket bounds in microseconds)."""
+
+    BOUNDS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds * 1e6)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q: float):
+        """Upper bound (us) of the bucket holding the q-th percentile, None if empty."""
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else float("inf")
+        return float("inf")
+
+    def format(self):
+        """One line per non-empty bucket: '<=  250us     42'."""
+        lines = []
+        for i, c in enumerate(self.counts):
+            if c:
+                bound = f"<={self.BOUNDS[i]:>8d}us" if i < len(self.BOUNDS) else f" >{self.BOUNDS[-1]:>8d}us"
+                lines.append(f"{bound} {c:>8d}")
+        return "\n".join(lines)
+
+
+class WriterStats:
+    """Counters shared by every stream; updated once per commit."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.writes = 0
+        self.commits = 0
+        self.fsyncs = 0
+        self.bytes = 0
+        # Time spent in write()+fsync() per commit
+        self.commit_latency = Histogram()
+        # Age of the oldest buffered byte when it was committed
+        self.commit_lag = Histogram()
+        self.since = time.monotonic()
+
+    def record(self, writes, nbytes, latency, lag, fsynced):
+        with self.lock:
+            self.writes += writes
+            self.commits += 1
+            self.bytes += nbytes
+            self.fsyncs += fsynced
+            self.commit_latency.observe(latency)
+            self.commit_lag.observe(lag)
+
+    def report(self, reset=False):
+        """Return a summary dict with per-second rates since the last reset."""
+        with self.lock:
+            elapsed = max(time.monotonic() - self.since, 1e-9)
+            out = {
+                "elapsed": elapsed,
+                "writes": self.writes,
+                "commits": self.commits,
+                "fsyncs": self.fsyncs,
+                "bytes": self.bytes,
+                "writes_per_s": self.writes / elapsed,
+                "commits_per_s": self.commits / elapsed,
+                "commit_p50_us": self.commit_latency.percentile(50),
+                "commit_p99_us": self.commit_latency.percentile(99),
+                "lag_p99_us": self.commit_lag.percentile(99),
+            }
+            if reset:
+                self._reset()
+            return out
+
+
+STATS = WriterStats()
+
+
+class BufferedStream:
+    """Append-only file with in-memory buffering and group commit.
+
+    ``kind`` ("spool", "raw" or "job") selects the fsync policy. Thread safe:
+    writers and the background flusher serialize on a per-stream lock.
+    """
+
+    def __init__(self, path, mode="ab", kind="spool", flush_ms=None, flush_bytes=None, fsync=None):
+        self.name = path
+        self.kind = kind
+        self.f = open(path, mode, buffering=0)
+        self.flush_after = (FLUSH_MS if flush_ms is None else flush_ms) / 1000.0
+        self.flush_bytes = FLUSH_BYTES if flush_bytes is None else flush_bytes
+        self.fsync = (kind in fsync_kinds(FSYNC)) if fsync is None else fsync
+        self.lock = threading.Lock()
+        self.buf = bytearray()
+        self.pending_writes = 0
+        # monotonic time of the oldest uncommitted byte
+        self.first_pending = None
+        self.closed = False
+        self.m_write = M_WRITE.labels(kind)
+        M_OPEN.labels(kind).inc()
+        if self.flush_after > 0:
+            _flusher.add(self)
+
+    def write(self, data):
+        with self.lock:
+            if self.first_pending is None:
+                self.first_pending = time.monotonic()
+            self.buf += data
+            self.pending_writes += 1
+            if self.flush_after <= 0 or len(self.buf) >= self.flush_bytes:
+                self._commit()
+        return len(data)
+
+    def _commit(self):
+        if not self.buf:
+            return
+        t0 = time.monotonic()
+        with memoryview(self.buf) as mv:
+            done = 0
+            while done < len(mv):
+                done += self.f.write(mv[done:])
+        if self.fsync:
+            os.fsync(self.f.fileno())
+        t1 = time.monotonic()
+        STATS.record(self.pending_writes, len(self.buf), t1 - t0, t1 - self.first_pending, self.fsync)
+        self.m_write.observe(t1 - t0)
+        self.buf = bytearray()
+        self.pending_writes = 0
+        self.first_pending = None
+
+    def commit_if_older(self, deadline):
+        """Commit when the oldest pending byte was written before ``deadline``."""
+        with self.lock:
+            if self.first_pending is not None and self.first_pending <= deadline and not self.closed:
+                self._commit()
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self._commit()
+            finally:
+                self.closed = True
+                self.f.close()
+                M_OPEN.labels(self.kind).dec()
+        _flusher.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Flusher:
+    """Background thread committing streams whose data is getting old."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = set()
+        self.thread = None
+
+    def add(self, stream):
+        with self.lock:
+            self.streams.add(stream)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="spool-flusher", daemon=True)
+                self.thread.start()
+
+    def discard(self, stream):
+        with self.lock:
+            self.streams.discard(stream)
+
+    def run(self):
+        # Ticking every FLUSH_MS/2 and committing data older than FLUSH_MS/2
+        # keeps the worst case under FLUSH_MS.
+        half = max(FLUSH_MS, 1) / 2000.0
+        last_report = time.monotonic()
+        while True:
+            time.sleep(half)
+            now = time.monotonic()
+            with self.lock:
+                streams = list(self.streams)
+            for s in streams:
+                try:
+                    s.commit_if_older(now - half)
+                except Exception:
+                    logger.exception("group commit failed for %s", s.name)
+            if REPORT_SECONDS and now - last_report >= REPORT_SECONDS:
+                last_report = now
+                r = STATS.report(reset=True)
+                if r["commits"]:
+                    logger.info("spool writer: %.0f writes/s %.1f commits/s %d bytes %d fsyncs, commit p50<=%sus p99<=%sus lag p99<=%sus",
+                                r["writes_per_s"], r["commits_per_s"], r["bytes"], r["fsyncs"],
+                                r["commit_p50_us"], r["commit_p99_us"], r["lag_p99_us"])
+
+
+_flusher = _Flusher()
+
+
+def open_stream(path, mode="ab", kind="spool"):
+    """Open ``path`` as a group-committed ``BufferedStream``."""
+    return BufferedStream(path, mode, kind=kind)
@@ -0,0 +1,441 @@
+"""Job submission through the 3505 card reader sockdev (``RDRPORT`` in tk5.cnf).
+
+The API stores every deck posted to ``POST /jobs`` in a persistent queue
+(SQLite, ``BRIDGE_SUBMIT_DB``) and one ``Submitter`` task owns the reader:
+it takes up to ``BRIDGE_SUBMIT_BATCH`` queued decks, writes them back to
+back on a single connection to ``BRIDGE_READER`` and waits for Hercules to
+close it. Hercules reads one connection as one card deck and JES2 splits it
+at the JOB cards; a connection made while the reader is still busy is closed
+at once by Hercules, so the batch is retried later.
+
+Decks are matched with the ``console.submitted`` events of console_watch
+($HASP100), in send order per jobname, which gives each one its JOBID; the
+``job.end`` of the extractor for that JOBID marks its output as printed.
+Submission states::
+
+    queued -> sending -> sent -> submitted -> printed
+                          \\-> unconfirmed   (no $HASP100 in BRIDGE_SUBMIT_CONFIRM seconds)
+
+A deck found in ``sending`` after a restart may have reached the reader, so
+it becomes ``sent`` and is never written twice.
+
+Submit files from a shell with::
+
+    python3 submit.py [--api http://127.0.0.1:8000] [--wait 60] deck.jcl ...
+"""
+import os, re, sys, time, json, fcntl, socket, select, sqlite3, asyncio, functools, logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+OUTDIR = os.environ.get("BRIDGE_OUTDIR", "/app/spool")
+# Cola persistente de envíos
+SUBMIT_DB = os.environ.get("BRIDGE_SUBMIT_DB", os.path.join(OUTDIR, "submit.db"))
+# host:port of the 3505 reader sockdev
+READER = os.environ.get("BRIDGE_READER", "127.0.0.1:" + os.environ.get("RDRPORT", "3505"))
+# Decks written per reader connection
+BATCH = int(os.environ.get("BRIDGE_SUBMIT_BATCH", "50"))
+# Maximum decks per second sent to the reader (0 = as fast as it reads them)
+RATE = float(os.environ.get("BRIDGE_SUBMIT_RATE", "0"))
+# Seconds a sent deck waits for its $HASP100 before it is marked unconfirmed
+CONFIRM_SECONDS = float(os.environ.get("BRIDGE_SUBMIT_CONFIRM", "300"))
+# Days finished submissions are kept
+KEEP_DAYS = float(os.environ.get("BRIDGE_SUBMIT_KEEP_DAYS", "7"))
+
+# Card width of the reader ("trunc" would cut longer lines silently)
+CARD = 80
+# Largest body accepted by POST /jobs
+MAX_BODY = 16 * 1024 * 1024
+# Seconds after connect() in which a busy reader closes the connection
+REJECT_PROBE = 0.2
+# Seconds to wait for Hercules to read a whole batch and close
+DRAIN_TIMEOUT = 120
+# Seconds between attempts while the reader is busy with the previous batch
+BUSY_RETRY = 0.25
+# Backoff (seconds) while the reader refuses connections or fails
+RETRY_MIN, RETRY_MAX = 0.5, 30
+# Seconds between expiry/cleanup passes
+TICK_SECONDS = 5
+
+JOB_CARD_RE = re.compile(r"^//([A-Z@#$][A-Z0-9@#$]{0,7})\s+JOB(\s|$)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    jobname TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_ts REAL NOT NULL,
+    sent_ts REAL,
+    submitted_ts REAL,
+    printed_ts REAL,
+    batch INTEGER,                  -- reader connection the deck was sent on
+    jobid TEXT,
+    file TEXT,                      -- joblog written by the extractor
+    rc TEXT
+);
+CREATE INDEX IF NOT EXISTS submissions_state ON submissions (state, id);
+CREATE INDEX IF NOT EXISTS submissions_jobid ON submissions (jobid);
+"""
+STATES = ("queued", "sending", "sent", "submitted", "printed", "unconfirmed")
+COLUMNS = "id, jobname, state, created_ts, sent_ts, submitted_ts, printed_ts, batch, jobid, file, rc"
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+M_SUBMIT = metrics.counter("bridge_submit_jobs_total", "Submitted decks reaching each state", ("state",))
+M_SUBMIT_LATENCY = metrics.histogram("bridge_submit_latency_seconds", "Time from POST /jobs to each state",
+                                     ("state",), buckets=LATENCY_BUCKETS)
+M_SUBMIT_BATCH = metrics.histogram("bridge_submit_batch_decks", "Decks written per reader connection",
+                                   buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+M_SUBMIT_QUEUED = metrics.gauge("bridge_submit_queued", "Decks waiting for the reader")
+
+logger = logging.getLogger("console_bridge")
+
+
+def split_decks(text):
+    """Split JCL into ``[(jobname, deck)]``, one deck per JOB card; ValueError if a card is unusable."""
+    decks = []
+    for n, line in enumerate(text.replace("\r\n", "\n").split("\n"), 1):
+        line = line.rstrip("\r")
+        if not line.isascii():
+            raise ValueError(f"line {n}: non-ASCII characters")
+        if len(line) > CARD:
+            raise ValueError(f"line {n}: {len(line)} columns (the reader takes {CARD})")
+        if m := JOB_CARD_RE.match(line):
+            decks.append((m.group(1), []))
+        elif not decks:
+            if line.strip():
+                raise ValueError(f"line {n}: text before the first JOB card")
+            continue
+        decks[-1][1].append(line)
+    if not decks:
+        raise ValueError("no JOB card found")
+    out = []
+    for name, lines in decks:
+        while lines and not lines[-1].strip():
+            lines.pop()
+        out.append((name, "\n".join(lines) + "\n"))
+    return out
+
+
+def parse_reader(spec=None):
+    host, _, port = (spec or READER).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class ReaderBusy(OSError):
+    """Hercules closed the connection without reading: the reader is still on the previous deck."""
+
+
+def send_batch(decks, addr=None, timeout=DRAIN_TIMEOUT):
+    """Write ``decks`` (strings) on one reader connection and wait until Hercules closes it."""
+    data = "".join(decks).encode("ascii")
+    with socket.create_connection(addr or parse_reader(), timeout=10) as s:
+        # un lector ocupado acepta y cierra enseguida: no mandar nada a ese socket
+        if select.select([s], [], [], REJECT_PROBE)[0] and not s.recv(1, socket.MSG_PEEK):
+            raise ReaderBusy("reader busy")
+        s.settimeout(timeout)
+        s.sendall(data)
+        s.shutdown(socket.SHUT_WR)
+        try:
+            while s.recv(4096):
+                pass
+        except socket.timeout:
+            logger.warning("reader kept the connection open %ss after the deck; closing", timeout)
+    return len(data)
+
+
+class SubmitQueue:
+    """The ``submissions`` table; one connection and one thread of its own.
+
+    The methods are blocking: from the event loop, run them with ``call``
+    (or ``schedule``), which keeps them in order on that thread.
+    """
+
+    def __init__(self, path=SUBMIT_DB):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.row_factory = sqlite3.Row
+        self._update_gauge()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="submit-db")
+
+    def schedule(self, fn, *args, **kwargs) -> asyncio.Future:
+        """Queue ``fn`` on the queue's thread now (order kept); returns an awaitable future."""
+        return asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def call(self, fn, *args, **kwargs):
+        return await self.schedule(fn, *args, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.db.close()
+
+    def recover(self):
+        """Decks left in ``sending`` by a previous owner of the reader become ``sent``."""
+        with self.db:
+            # pudieron llegar al lector antes de la caída: no se reenvían
+            return self.db.execute("UPDATE submissions SET state = 'sent', sent_ts = COALESCE(sent_ts, ?) "
+                                   "WHERE state = 'sending'", (time.time(),)).rowcount
+
+    def _update_gauge(self):
+        M_SUBMIT_QUEUED.set(self.db.execute("SELECT COUNT(*) FROM submissions WHERE state = 'queued'").fetchone()[0])
+
+    def add(self, decks):
+        """Queue ``[(jobname, deck)]`` in one transaction; returns the new ids."""
+        now = time.time()
+        with self.db:
+            ids = [self.db.execute("INSERT INTO submissions (jobname, deck, state, created_ts) "
+                                   "VALUES (?, ?, 'queued', ?)", (name, deck, now)).lastrowid
+                   for name, deck in decks]
+        M_SUBMIT.labels("queued").inc(len(ids))
+        self._update_gauge()
+        return ids
+
+    def take(self, n):
+        """Mark the oldest ``n`` queued decks as sending; returns ``(batch, rows)``."""
+        rows = self.db.execute("SELECT id, deck FROM submissions WHERE state = 'queued' ORDER BY id LIMIT ?",
+                               (n,)).fetchall()
+        if not rows:
+            return None, []
+        batch = rows[0]["id"]
+        with self.db:
+            self.db.executemany("UPDATE submissions SET state = 'sending', batch = ? WHERE id = ?",
+                                [(batch, r["id"]) for r in rows])
+        return batch, rows
+
+    def sent(self, batch):
+        now = time.time()
+        with self.db:
+            rows = self.db.execute("SELECT created_ts FROM submissions WHERE batch = ?", (batch,)).fetchall()
+            self.db.execute("UPDATE submissions SET state = 'sent', sent_ts = ? WHERE batch = ? AND state = 'sending'",
+                            (now, batch))
+        for r in rows:
+            M_SUBMIT_LATENCY.labels("sent").observe(now - r["created_ts"])
+        M_SUBMIT.labels("sent").inc(len(rows))
+        self._update_gauge()
+
+    def requeue(self, batch):
+        """Put a batch the reader never read back at the head of the queue."""
+        with self.db:
+            self.db.execute("UPDATE submissions SET state = 'queued', batch = NULL WHERE batch = ? AND state = 'sending'",
+                            (batch,))
+
+    def submitted(self, jobname, jobid, ts=None):
+        """Give ``jobid`` to the oldest sent deck named ``jobname``; returns its id or None."""
+        ts = ts or time.time()
+        # el $HASP100 puede llegar antes de que send_batch vea cerrar la conexión
+        row = self.db.execute("SELECT id, created_ts FROM submissions WHERE jobname = ? AND jobid IS NULL "
+                              "AND state IN ('sending', 'sent', 'unconfirmed') ORDER BY id LIMIT 1",
+                              (jobname,)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute("UPDATE submissions SET state = 'submitted', jobid = ?, submitted_ts = ?, "
+                            "sent_ts = COALESCE(sent_ts, ?) WHERE id = ?", (jobid, ts, ts, row["id"]))
+        M_SUBMIT.labels("submitted").inc()
+        M_SUBMIT_LATENCY.labels("submitted").observe(ts - row["created_ts"])
+        return row["id"]
+
+    def printed(self, jobid, file=None, rc=None, ts=None):
+        """Record the joblog of a submitted ``jobid``; returns the submission id or None."""
+        ts = ts or time.time()
+        row = self.db.execute("SELECT id, created_ts FROM submissions WHERE jobid = ? AND state = 'submitted' "
+                              "ORDER BY id DESC LIMIT 1", (jobid,)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute("UPDATE submissions SET state = 'printed', printed_ts = ?, file = ?, rc = ? WHERE id = ?",
+                            (ts, file, rc, row["id"]))
+        M_SUBMIT.labels("printed").inc()
+        M_SUBMIT_LATENCY.labels("printed").observe(ts - row["created_ts"])
+        return row["id"]
+
+    def expire(self, now=None):
+        """Mark sent decks without $HASP100 as unconfirmed and drop old finished rows."""
+        now = now or time.time()
+        with self.db:
+            n = self.db.execute("UPDATE submissions SET state = 'unconfirmed' WHERE state = 'sent' AND sent_ts < ?",
+                                (now - CONFIRM_SECONDS,)).rowcount
+            self.db.execute("DELETE FROM submissions WHERE state IN ('printed', 'unconfirmed', 'submitted') "
+                            "AND created_ts < ?", (now - KEEP_DAYS * 86400,))
+        if n:
+            M_SUBMIT.labels("unconfirmed").inc(n)
+            logger.warning("%d submitted deck(s) without $HASP100 after %ss", n, CONFIRM_SECONDS)
+        return n
+
+    def get(self, ids):
+        marks = ",".join("?" * len(ids))
+        rows = self.db.execute(f"SELECT {COLUMNS} FROM submissions WHERE id IN ({marks})", list(ids)).fetchall()
+        by_id = {r["id"]: dict(r) for r in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def list(self, state=None, limit=100):
+        where, args = ("WHERE state = ?", [state]) if state else ("", [])
+        return [dict(r) for r in self.db.execute(
+            f"SELECT {COLUMNS} FROM submissions {where} ORDER BY id DESC LIMIT ?", args + [limit])]
+
+    def stats(self, window=60, now=None):
+        """Counts per state, jobs/s over the last ``window`` seconds and latency percentiles."""
+        now = now or time.time()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.db.execute("SELECT state, COUNT(*) FROM submissions GROUP BY state").fetchall())
+        out = {"states": counts, "window_seconds": window}
+        for state, col in (("sent", "sent_ts"), ("submitted", "submitted_ts"), ("printed", "printed_ts")):
+            n = self.db.execute(f"SELECT COUNT(*) FROM submissions WHERE {col} >= ?", (now - window,)).fetchone()[0]
+            out[f"{state}_per_second"] = round(n / window, 3)
+            lat = sorted(r[0] for r in self.db.execute(
+                f"SELECT {col} - created_ts FROM submissions WHERE {col} IS NOT NULL ORDER BY id DESC LIMIT 1000"))
+            out[f"{state}_latency"] = {f"p{p}": round(lat[min(len(lat) - 1, len(lat) * p // 100)], 3) if lat else None
+                                       for p in (50, 95, 99)}
+        return out
+
+
+class Submitter:
+    """Sends queued decks to the reader and follows them through the event bus."""
+
+    def __init__(self, queue: SubmitQueue, reader=None, batch=BATCH, rate=RATE):
+        self.queue = queue
+        self.addr = parse_reader(reader)
+        self.batch = batch
+        self.rate = rate
+        self.wakeup = asyncio.Event()
+        self.waiters = {}
+
+    async def submit(self, text):
+        """Queue the decks in ``text``; returns their ids (ValueError for bad JCL)."""
+        ids = await self.queue.call(self.queue.add, split_decks(text))
+        self.wakeup.set()
+        return ids
+
+    def on_event(self, event):
+        """EventBus handler: $HASP100 gives the JOBID, job.end the output (updated on the queue's thread)."""
+        t = event.get("type")
+        if t == "console.submitted":
+            fut = self.queue.schedule(self.queue.submitted, event.get("jobname"), event.get("jobid"), event.get("ts"))
+        elif t == "job.end" and event.get("jobid"):
+            fut = self.queue.schedule(self.queue.printed, event["jobid"], event.get("file"), event.get("rc"),
+                                      event.get("ts"))
+        else:
+            return
+        fut.add_done_callback(self._wake_waiters)
+
+    def _wake_waiters(self, fut):
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            logger.error("submission update failed: %s", fut.exception())
+            return
+        sid = fut.result()
+        if sid is not None:
+            for waiter in self.waiters.pop(sid, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def wait(self, ids, timeout, until=("submitted", "printed")):
+        """Rows of ``ids`` once all of them reached ``until`` (or after ``timeout`` seconds)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            rows = await self.queue.call(self.queue.get, ids)
+            pending = [r["id"] for r in rows if r["state"] not in until]
+            remaining = deadline - loop.time()
+            if not pending or remaining <= 0:
+                return rows
+            fut = loop.create_future()
+            for sid in pending:
+                self.waiters.setdefault(sid, []).append(fut)
+            try:
+                await asyncio.wait_for(fut, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                for sid in pending:
+                    if fut in self.waiters.get(sid, ()):
+                        self.waiters[sid].remove(fut)
+
+    def _lock(self):
+        """Only one process may own the reader (several API workers share SUBMIT_DB)."""
+        f = open(self.queue.path + ".lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            f.close()
+            return None
+
+    async def run(self):
+        lock = None
+        while lock is None:
+            lock = await self.queue.call(self._lock)
+            if lock is None:
+                await asyncio.sleep(TICK_SECONDS)
+        if n := await self.queue.call(self.queue.recover):
+            logger.warning("%d deck(s) were being sent when the API stopped; not sending them again", n)
+        logger.info("submitter: reader %s:%s, %d deck(s)/connection", *self.addr, self.batch)
+        retry = RETRY_MIN
+        last_tick = 0
+        try:
+            while True:
+                if time.monotonic() - last_tick >= TICK_SECONDS:
+                    last_tick = time.monotonic()
+                    await self.queue.call(self.queue.expire)
+                batch, rows = await self.queue.call(self.queue.take, self.batch)
+                if not rows:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), TICK_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                t0 = time.monotonic()
+                try:
+                    size = await asyncio.to_thread(send_batch, [r["deck"] for r in rows], self.addr)
+                except ReaderBusy:
+                    await self.queue.call(self.queue.requeue, batch)
+                    await asyncio.sleep(BUSY_RETRY)
+                    continue
+                except OSError as e:
+                    await self.queue.call(self.queue.requeue, batch)
+                    logger.warning("reader %s:%s: %s; retrying in %.1fs", *self.addr, e, retry)
+                    await asyncio.sleep(retry)
+                    retry = min(retry * 2, RETRY_MAX)
+                    continue
+                retry = RETRY_MIN
+                await self.queue.call(self.queue.sent, batch)
+                M_SUBMIT_BATCH.observe(len(rows))
+                logger.info("submitted %d deck(s), %d bytes, in %.2fs", len(rows), size, time.monotonic() - t0)
+                if self.rate > 0:
+                    await asyncio.sleep(max(0.0, len(rows) / self.rate - (time.monotonic() - t0)))
+        finally:
+            lock.close()
+
+
+def main(argv=None):
+    import argparse, urllib.request
+    parser = argparse.ArgumentParser(description="Submit JCL files through the bridge API")
+    parser.add_argument("files", nargs="+", help="JCL decks (several JOB cards per file are fine)")
+    parser.add_argument("--api", default=os.environ.get("BRIDGE_API", "http://127.0.0.1:" + os.environ.get("API_PORT", "8000")))
+    parser.add_argument("--wait", type=float, default=60, help="seconds to wait for the JOBIDs")
+    args = parser.parse_args(argv)
+
+    text = ""
+    for path in args.files:
+        with open(path) as f:
+            text += f.read().rstrip("\n") + "\n"
+    t0 = time.time()
+    req = urllib.request.Request(f"{args.api}/jobs?wait={args.wait}", data=text.encode("ascii"),
+                                 headers={"Content-Type": "text/plain"}, method="POST")
+    with urllib.request.urlopen(req, timeout=args.wait + 30) as resp:
+        jobs = json.load(resp)["jobs"]
+    elapsed = time.time() - t0
+    for job in jobs:
+        print(f"{job['id']:>8} {job['jobname']:<8} {job['jobid'] or '-':<10} {job['state']}")
+    done = sum(1 for j in jobs if j["jobid"])
+    print(f"{done}/{len(jobs)} job(s) submitted in {elapsed:.2f}s ({done / max(elapsed, 1e-9):.1f} jobs/s)")
+    return 0 if done == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
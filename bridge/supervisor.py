@@ -0,0 +1,378 @@
+"""Container supervisor: starts MVS, the bridge helpers and the API, restarts crashed helpers.
+
+``start.sh`` execs this. Startup is driven by events instead of sleeps:
+
+- The sockdev ports are connect-probed every ``PROBE_INTERVAL`` seconds, not
+  found by parsing ``ss`` output.
+- The helpers report readiness with ``notify()``: one JSON datagram to
+  ``BRIDGE_NOTIFY_SOCKET``, which the supervisor sets in their environment.
+  ``console_watch`` sends ``MVS_INIT`` when it sees the init line, and each
+  helper sends ``READY`` once connected to its sockdev.
+- The API starts right away, in parallel with MVS.
+
+Every step is timed from the supervisor start. The timeline goes to
+``startup.log`` and to ``startup-timelines.jsonl`` (one line per boot).
+``python3 supervisor.py timeline`` summarizes those lines.
+"""
+import argparse, asyncio, contextlib, json, os, signal, socket, statistics, sys, time, logging
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGDIR = os.environ.get("BRIDGE_LOGDIR", "/app/logs")
+PIDDIR = os.environ.get("BRIDGE_PIDDIR", os.environ.get("PIDDIR", "/app/pids"))
+READY_FILE = os.environ.get("BRIDGE_READYFILE", os.path.join(PIDDIR, "console_bridge.ready"))
+NOTIFY_SOCKET = os.environ.get("BRIDGE_NOTIFY_SOCKET", os.path.join(PIDDIR, "supervisor.sock"))
+MVS_CMD = os.environ.get("MVS_CMD", "/tk5-/mvs")
+HOST = os.environ.get("BRIDGE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("BRIDGE_PORT", "5000"))
+CONSOLE_PORT = int(os.environ.get("CONSOLE_PORT", "5002"))
+API_PORT = int(os.environ.get("API_PORT", "8000"))
+# How long to wait for MVS to listen on its sockdev ports
+SOCKDEV_TIMEOUT = float(os.environ.get("SOCKDEV_TIMEOUT", "240"))
+PROBE_INTERVAL = 0.1
+CW_INIT_LINE = os.environ.get("CW_INIT_LINE", "MVS038J MVS 3.8j TK5 system initialization complete")
+CW_INIT_TIMEOUT = float(os.environ.get("CW_INIT_TIMEOUT", "240"))
+HELPER_READY_TIMEOUT = float(os.environ.get("HELPER_READY_TIMEOUT", "30"))
+STARTUP_GRACE_SECONDS = float(os.environ.get("STARTUP_GRACE_SECONDS", "2"))
+# Restart backoff of crashed helpers: doubles from BACKOFF_MIN up to BACKOFF_MAX,
+# back to BACKOFF_MIN once a helper has stayed up STABLE_SECONDS
+BACKOFF_MIN = 1.0
+BACKOFF_MAX = 60.0
+STABLE_SECONDS = 60.0
+STOP_TIMEOUT = 5.0
+
+STARTUP_LOG = os.path.join(LOGDIR, "startup.log")
+TIMELINES = os.path.join(LOGDIR, "startup-timelines.jsonl")
+
+logger = logging.getLogger("supervisor")
+
+
+def notify(state, **fields):
+    """Tell the supervisor about this process (``READY``, ``MVS_INIT``, ...); no-op without one."""
+    path = os.environ.get("BRIDGE_NOTIFY_SOCKET")
+    if not path:
+        return False
+    name = os.environ.get("BRIDGE_NOTIFY_NAME") or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    msg = json.dumps({"name": name, "pid": os.getpid(), "state": state, **fields}).encode("utf-8")
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.sendto(msg, path)
+        return True
+    except OSError:
+        return False
+
+
+class Timeline:
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.started = time.time()
+        self.steps = []
+
+    def mark(self, step, **info):
+        elapsed = time.monotonic() - self.t0
+        self.steps.append({"step": step, "t": round(elapsed, 3), **info})
+        logger.info("[+%7.3fs] %s%s", elapsed, step, "".join(f" {k}={v}" for k, v in info.items()))
+
+    def seen(self, step):
+        return any(s["step"] == step for s in self.steps)
+
+    def save(self):
+        try:
+            with open(TIMELINES, "a") as f:
+                f.write(json.dumps({"started": self.started, "steps": self.steps}) + "\n")
+        except OSError:
+            logger.exception("Failed to write %s", TIMELINES)
+
+
+class Helper:
+    """A child process restarted with backoff when it dies (unless stopping)."""
+
+    def __init__(self, sup, name, argv, log_path=None, env=None, restart=True):
+        self.sup = sup
+        self.name = name
+        self.argv = argv
+        self.log_path = log_path
+        self.env = dict(os.environ, BRIDGE_NOTIFY_SOCKET=NOTIFY_SOCKET, BRIDGE_NOTIFY_NAME=name, **(env or {}))
+        self.restart = restart
+        self.proc = None
+        self.starts = 0
+        self.pid_file = os.path.join(PIDDIR, f"{name}.pid")
+
+    async def _spawn(self):
+        out = open(self.log_path, "ab") if self.log_path else None
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.argv, env=self.env, stdout=out, stderr=asyncio.subprocess.STDOUT if out else None)
+        finally:
+            if out:
+                out.close()
+        self.starts += 1
+        with open(self.pid_file, "w") as f:
+            f.write(str(self.proc.pid))
+        self.sup.timeline.mark(f"{self.name}_started" if self.starts == 1 else f"{self.name}_restarted",
+                               pid=self.proc.pid)
+
+    async def run(self):
+        backoff = BACKOFF_MIN
+        while True:
+            t0 = time.monotonic()
+            try:
+                await self._spawn()
+            except OSError as e:
+                logger.error("Cannot start %s: %s", self.name, e)
+            else:
+                rc = await self.proc.wait()
+                if self.sup.stopping:
+                    return rc
+                logger.warning("%s (pid %d) exited with %s", self.name, self.proc.pid, rc)
+            if not self.restart or self.sup.stopping:
+                return None
+            if time.monotonic() - t0 >= STABLE_SECONDS:
+                backoff = BACKOFF_MIN
+            logger.info("Restarting %s in %.0fs", self.name, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX)
+
+    async def stop(self):
+        proc = self.proc
+        if proc is None or proc.returncode is not None:
+            return
+        logger.info("Attempting TERM -> %s pid=%d", self.name, proc.pid)
+        proc.terminate()
+        try:
+            await asyncio.wait_for(proc.wait(), STOP_TIMEOUT)
+            logger.info("%s exited after TERM", self.name)
+        except asyncio.TimeoutError:
+            logger.info("%s did not exit after TERM; sending KILL", self.name)
+            proc.kill()
+            await proc.wait()
+
+
+async def wait_port(host, port, timeout):
+    """Connect-probe ``host:port`` until it accepts; returns the number of probes or None on timeout."""
+    deadline = time.monotonic() + timeout
+    probes = 0
+    while time.monotonic() < deadline:
+        probes += 1
+        try:
+            _, w = await asyncio.wait_for(asyncio.open_connection(host, port), 1.0)
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(PROBE_INTERVAL)
+            continue
+        w.close()
+        return probes
+    return None
+
+
+def printer_ports():
+    """Sockdev printer ports the bridge will read, and whether it also reads the console."""
+    spec = os.environ.get("BRIDGE_ENDPOINTS", "")
+    if not spec:
+        return [PORT], False
+    ports, console = [], False
+    for item in spec.split(","):
+        addr, _, kind = item.strip().rpartition("=")[2].partition("/")
+        port = addr.rpartition(":")[2]
+        if kind == "console":
+            console = True
+        elif port.isdigit():
+            ports.append(int(port))
+    return ports or [PORT], console
+
+
+class Supervisor:
+    def __init__(self):
+        self.timeline = Timeline()
+        self.stopping = False
+        self.helpers = []
+        self.tasks = []
+        # estado -> {helper name: asyncio.Event}
+        self.notified = {}
+
+    def event(self, state, name):
+        return self.notified.setdefault(state, {}).setdefault(name, asyncio.Event())
+
+    def on_notify(self, msg):
+        name, state = msg.get("name"), msg.get("state")
+        ev = self.event(state, name)
+        if not ev.is_set():
+            ev.set()
+            self.timeline.mark(f"{name}_{state.lower()}", pid=msg.get("pid"))
+
+    def listen(self):
+        try:
+            os.unlink(NOTIFY_SOCKET)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(NOTIFY_SOCKET)
+        sock.setblocking(False)
+
+        def on_readable():
+            while True:
+                try:
+                    data = sock.recv(4096)
+                except (BlockingIOError, InterruptedError):
+                    return
+                try:
+                    msg = json.loads(data)
+                except ValueError:
+                    continue
+                if isinstance(msg, dict) and msg.get("name") and msg.get("state"):
+                    self.on_notify(msg)
+
+        asyncio.get_running_loop().add_reader(sock.fileno(), on_readable)
+        return sock
+
+    def start(self, helper):
+        self.helpers.append(helper)
+        self.tasks.append(asyncio.create_task(helper.run()))
+        return helper
+
+    async def wait_event(self, state, names, timeout, what):
+        """Wait for ``state`` from any of ``names``; logs and returns False on timeout."""
+        waits = [asyncio.create_task(self.event(state, n).wait()) for n in names]
+        done, pending = await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for t in pending:
+            t.cancel()
+        if not done:
+            self.timeline.mark(f"timeout_{what}", seconds=timeout)
+        return bool(done)
+
+    async def boot(self):
+        py = sys.executable
+        ports, daemon_reads_console = printer_ports()
+        use_daemon = bool(os.environ.get("BRIDGE_ENDPOINTS")) and os.path.exists(os.path.join(APP_DIR, "bridge_daemon.py"))
+        if not use_daemon:
+            daemon_reads_console = False
+
+        # The API does not depend on MVS: start it right away
+        if os.path.exists(os.path.join(APP_DIR, "api", "app.py")):
+            self.start(Helper(self, "bridge_api",
+                              [py, "-m", "uvicorn", "api.app:app", "--host", "0.0.0.0", "--port", str(API_PORT),
+                               "--log-level", "info"],
+                              os.path.join(LOGDIR, "api.log"), env={"PYTHONPATH": APP_DIR}))
+            self.tasks.append(asyncio.create_task(self._probe("api_listening", "127.0.0.1", API_PORT)))
+
+        console = asyncio.create_task(self._probe("console_port_listening", HOST, CONSOLE_PORT))
+        printers = asyncio.gather(*(self._probe("printer_port_listening", HOST, p) for p in ports))
+
+        # their output already goes to the log file their logger writes: no second copy on stderr
+        log_env = {"CW_INIT_LINE": CW_INIT_LINE, "BRIDGE_LOG_STDERR": "0"}
+        watch_names = []
+        if not daemon_reads_console and os.path.exists(os.path.join(APP_DIR, "console_watch.py")):
+            await console
+            # fresh console_watch.log for this run
+            open(os.path.join(LOGDIR, "console_watch.log"), "w").close()
+            self.start(Helper(self, "console_watch", [py, os.path.join(APP_DIR, "console_watch.py")],
+                              os.path.join(LOGDIR, "console_watch.log"), env=log_env))
+            watch_names.append("console_watch")
+
+        await printers
+        script = "bridge_daemon.py" if use_daemon else "console_bridge.py"
+        if watch_names:
+            # as before: the bridge starts once MVS finished its initialization
+            await self.wait_event("MVS_INIT", watch_names, CW_INIT_TIMEOUT, "mvs_init")
+        self.start(Helper(self, "console_bridge", [py, os.path.join(APP_DIR, script)],
+                          os.path.join(LOGDIR, "console_bridge.log"), env=log_env))
+        await self.wait_event("READY", ["console_bridge"], HELPER_READY_TIMEOUT, "console_bridge_ready")
+        self.timeline.mark("startup_complete")
+        self.timeline.save()
+
+    async def _probe(self, step, host, port):
+        probes = await wait_port(host, port, SOCKDEV_TIMEOUT)
+        if probes is None:
+            self.timeline.mark(f"timeout_{step}", port=port)
+        else:
+            self.timeline.mark(step, port=port, probes=probes)
+
+    async def main(self):
+        loop = asyncio.get_running_loop()
+        os.makedirs(LOGDIR, exist_ok=True)
+        os.makedirs(PIDDIR, exist_ok=True)
+        cleanup_files()
+        sock = self.listen()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        mvs = Helper(self, "mvs", [MVS_CMD], restart=False)
+        mvs_task = asyncio.create_task(mvs.run())
+        boot = asyncio.create_task(self.boot())
+        stop_wait = asyncio.create_task(stop.wait())
+        await asyncio.wait([mvs_task, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+        if mvs_task.done():
+            logger.info("MVS exited; waiting %.0fs for helpers to finish before cleanup...", STARTUP_GRACE_SECONDS)
+            await asyncio.sleep(STARTUP_GRACE_SECONDS)
+        else:
+            logger.info("Stop requested")
+        self.stopping = True
+        boot.cancel()
+        if not self.timeline.seen("startup_complete"):
+            self.timeline.mark("startup_aborted")
+            self.timeline.save()
+        await asyncio.gather(*(h.stop() for h in reversed(self.helpers + [mvs])))
+        for t in self.tasks + [mvs_task, stop_wait]:
+            t.cancel()
+        loop.remove_reader(sock.fileno())
+        sock.close()
+        with contextlib.suppress(OSError):
+            os.unlink(NOTIFY_SOCKET)
+        cleanup_files()
+        logger.info("Startup log available at %s", STARTUP_LOG)
+
+
+def cleanup_files():
+    """Remove pid/ready files and the console_watch log left by a previous run."""
+    for d in (PIDDIR, LOGDIR):
+        for name in os.listdir(d):
+            if name.endswith((".pid", ".ready")):
+                try:
+                    os.remove(os.path.join(d, name))
+                except OSError:
+                    pass
+    for path in (READY_FILE, os.path.join(LOGDIR, "console_watch.log")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def summarize(path=TIMELINES, last=20):
+    """Median/p95/max time at which each step was reached over the last boots."""
+    runs = []
+    try:
+        with open(path) as f:
+            runs = [json.loads(line) for line in f if line.strip()][-last:]
+    except FileNotFoundError:
+        pass
+    steps = {}
+    for run in runs:
+        for s in run["steps"]:
+            steps.setdefault(s["step"], []).append(s["t"])
+    print(f"{len(runs)} boot(s) from {path}")
+    for step, ts in sorted(steps.items(), key=lambda kv: statistics.median(kv[1])):
+        p95 = statistics.quantiles(ts, n=20, method="inclusive")[-1] if len(ts) > 1 else ts[0]
+        print(f"{step:32s} n={len(ts):3d} median={statistics.median(ts):8.3f}s p95={p95:8.3f}s max={max(ts):8.3f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="cmd")
+    p = sub.add_parser("timeline", help="summarize recorded startup timelines")
+    p.add_argument("--last", type=int, default=20)
+    args = parser.parse_args(argv)
+    if args.cmd == "timeline":
+        summarize(last=args.last)
+        return
+    os.makedirs(LOGDIR, exist_ok=True)
+    fmt = logging.Formatter("%(asctime)s %(message)s", "%Y-%m-%dT%H:%M:%SZ")
+    fmt.converter = time.gmtime
+    for h in (logging.StreamHandler(), logging.FileHandler(STARTUP_LOG)):
+        h.setFormatter(fmt)
+        logger.addHandler(h)
+    logger.setLevel(logging.INFO)
+    asyncio.run(Supervisor().main())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,28 +24,47 @@
     if(logname) showLog(logname);
   }));
 
-  // +Add
+  // +Add: pick JCL files and submit them to the card reader (POST /jobs)
   const addBtn = qs('.btn.add');
   if(addBtn) addBtn.addEventListener('click', ()=>{
-    // placeholder - hook into API or open a modal later
-    alert('Action: + Add (placeholder)');
+    const input = document.createElement('input');
+    input.type = 'file'; input.multiple = true; input.accept = '.jcl,.txt,text/plain';
+    input.addEventListener('change', async ()=>{
+      const texts = await Promise.all(Array.from(input.files).map(f=>f.text()));
+      if(!texts.length) return;
+      try{
+        const res = await fetch((API?API:'') + '/jobs?wait=30', {method: 'POST', headers: {'Content-Type': 'text/plain'}, body: texts.join('\n')});
+        const data = await res.json();
+        if(!res.ok) throw new Error(data.detail || ('status ' + res.status));
+        alert(data.jobs.map(j=>`${j.jobname} ${j.jobid || '(' + j.state + ')'}`).join('\n'));
+        loadSpools();
+      }catch(err){
+        alert('Submit failed: ' + err.message);
+      }
+    });
+    input.click();
   });
 
   // Populate data table from /spools
+  // ETag of the last listing; the API answers 304 while nothing changed
+  let spoolsEtag = null;
   async function loadSpools(){
     const tbody = qs('.data-table tbody');
     if(!tbody) return;
     try{
-      const res = await fetch((API?API:'') + '/spools');
+      const headers = spoolsEtag ? {'If-None-Match': spoolsEtag} : {};
+      const res = await fetch((API?API:'') + '/spools?limit=200', {headers, cache: 'no-cache'});
+      if(res.status === 304) return;
       if(!res.ok) throw new Error('status ' + res.status);
       const files = await res.json();
+      spoolsEtag = res.headers.get('ETag');
       if(!Array.isArray(files) || files.length===0){
         tbody.innerHTML = `<tr><td colspan="5" style="color:#777;padding:16px">No spools</td></tr>`;
         return;
       }
   const rows = files.map(f=>{
         // f can be a string or an object with keys like 'file-name', 'job-id', size
-        let name = '', size = '--', jobname = '', jobid = '';
+        let name = '', size = '--', jobname = '', jobid = '', jobrc = '';
         if(typeof f === 'string'){
           name = f;
         }else if(f && typeof f === 'object'){
@@ -97,9 +116,17 @@
   };
   window.stopConsoleStream = function(){ if(es){ es.close(); es=null; } };
 
-  // Auto-refresh table every 10s
+  // Refresh the table when the bridge announces a job (pushed from /events);
+  // the slow poll only covers a lost event stream
   loadSpools();
-  setInterval(loadSpools, 10000);
+  let refreshTimer = null;
+  const scheduleRefresh = ()=>{ if(!refreshTimer) refreshTimer = setTimeout(()=>{ refreshTimer = null; loadSpools(); }, 250); };
+  if(window.EventSource){
+    const jobs = new EventSource((API?API:'') + '/events?types=job.end,job.rc');
+    jobs.addEventListener('job.end', scheduleRefresh);
+    jobs.addEventListener('job.rc', scheduleRefresh);
+  }
+  setInterval(loadSpools, 60000);
   
   /* Modal logic */
   const modal = document.getElementById('modal');
@@ -107,7 +134,7 @@
   const modalBody = document.getElementById('modal-body');
   const modalDownload = document.getElementById('modal-download');
   function openModal(){ modal.setAttribute('aria-hidden','false'); }
-  function closeModal(){ modal.setAttribute('aria-hidden','true'); modalBody.textContent = ''; modalTitle.textContent = ''; modalDownload.href = '#'; }
+  function closeModal(){ modal.setAttribute('aria-hidden','true'); modalBody.onscroll = null; delete modalBody.dataset.session; modalBody.textContent = ''; modalTitle.textContent = ''; modalDownload.href = '#'; }
   modal.querySelectorAll('[data-close]').forEach(el=>el.addEventListener('click', closeModal));
   const mclose = modal.querySelector('.modal-close'); if(mclose) mclose.addEventListener('click', closeModal);
 
@@ -119,27 +146,38 @@
       modalTitle.textContent = name;
     }
     modalBody.textContent = 'Loading...';
-    modalDownload.href = '#';
+    const url = (API?API:'') + '/spools/' + encodeURIComponent(name);
+    // the server sends the whole file only when Download is clicked
+    modalDownload.href = url; modalDownload.download = name;
     openModal();
-    try{
-      const url = (API?API:'') + '/spools/' + encodeURIComponent(name);
-      const res = await fetch(url);
-      if(!res.ok) throw new Error('status '+res.status);
-      const blob = await res.blob();
-      const maxPreview = 200000; // 200 KB
-      if(blob.size > maxPreview){
-        modalBody.textContent = `File too large to preview (${blob.size} bytes)`;
-        const objectUrl = URL.createObjectURL(blob);
-        modalDownload.href = objectUrl; modalDownload.download = name;
-        return;
+    // Fetch the listing one page of lines at a time, the next one when scrolled near the end
+    const PAGE = 2000;
+    let next = 1, done = false, loading = false;
+    const session = modalBody.dataset.session = String(Date.now());
+    async function loadPage(){
+      if(done || loading || modalBody.dataset.session !== session) return;
+      loading = true;
+      try{
+        const res = await fetch(url + '?lines=' + next + ':' + (next + PAGE - 1));
+        if(!res.ok) throw new Error('status '+res.status);
+        const text = await res.text();
+        if(modalBody.dataset.session !== session) return;
+        if(next === 1) modalBody.textContent = '';
+        modalBody.append(text);
+        next += PAGE;
+        const total = Number(res.headers.get('X-Total-Lines'));
+        done = !text || (total ? next > total : text.split('\n').length <= PAGE);
+      }catch(err){
+        modalBody.textContent = 'Failed to load: ' + err;
+        done = true;
+      }finally{
+        loading = false;
       }
-      const text = await blob.text();
-      modalBody.textContent = text;
-      const objectUrl = URL.createObjectURL(blob);
-      modalDownload.href = objectUrl; modalDownload.download = name;
-    }catch(err){
-      modalBody.textContent = 'Failed to load: ' + err;
     }
+    modalBody.onscroll = ()=>{
+      if(modalBody.scrollTop + modalBody.clientHeight >= modalBody.scrollHeight - 200) loadPage();
+    };
+    await loadPage();
   }
 
   // Show tail of a server log in modal by calling /logs/{logname}